@@ -13,19 +13,383 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import time
+import random
+import hashlib
+import weakref
+import threading
+from copy import deepcopy
+from functools import wraps
 from os import path, environ
+from collections import OrderedDict
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential, ClientSecretCredential
+from azure.mgmt.core.polling.arm_polling import ARMPolling
 from msrestazure.azure_active_directory import UserPassCredentials
 from msrestazure.azure_cloud import AZURE_CHINA_CLOUD, AZURE_PUBLIC_CLOUD
 
+from azure_sdk import throttle
 from cloudify_azure import constants, utils
 from cloudify_azure._compat import SafeConfigParser
 from cloudify.exceptions import NonRecoverableError
+from cloudify.state import current_ctx, NotInContext
+
+
+def fingerprint(value):
+    """Returns a stable, non reversible digest of a secret value."""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class CredentialCache(object):
+    """
+        Process-wide registry of Azure credential objects.
+
+        Credential objects keep their own token cache, so handing the same
+        object to every AzureResource built with the same identity means a
+        single AAD token fetch per identity, instead of one per resource.
+        Entries are evicted after ttl seconds so that rotated secrets and
+        changed environments are picked up.
+    """
+
+    def __init__(self, ttl=constants.CREDENTIALS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    def get(self, key, factory):
+        """Returns the cached credential for key, or builds one."""
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry:
+                return entry[0]
+            credential = factory()
+            self._entries[key] = (credential, now)
+            return credential
+
+    def _evict_expired(self, now):
+        for key, (_, created_at) in list(self._entries.items()):
+            if now - created_at >= self.ttl:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+credentials_cache = CredentialCache()
+
+
+class ClientPool(object):
+    """
+        Bounded LRU pool of Azure management clients.
+
+        Building a management client re-runs the model registry and the
+        pipeline setup, so clients are shared by every AzureResource that
+        asks for the same client class, identity, subscription and
+        api version.
+    """
+
+    def __init__(self, maxsize=constants.CLIENT_POOL_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.RLock()
+        self._clients = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, factory):
+        """Returns the pooled client for key, or builds one."""
+        with self._lock:
+            if key in self._clients:
+                self.hits += 1
+                self._clients.move_to_end(key)
+                return self._clients[key]
+            self.misses += 1
+            client = factory()
+            self._clients[key] = client
+            while len(self._clients) > self.maxsize:
+                # Evicted clients are not closed, since a resource created
+                # earlier may still be using them.
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def close_all(self):
+        """Closes every pooled client and empties the pool."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            close = getattr(client, 'close', None)
+            if callable(close):
+                close()
+
+
+client_pool = ClientPool()
+
+
+class SharedHttpTransport(RequestsTransport):
+    """
+        Keep-alive HTTP transport shared by all pooled management clients.
+
+        The transport does not own its session, so closing a client does
+        not close the session that every other client is using. Pooled
+        connections that were idle for longer than idle_timeout are closed
+        before the next request, rather than being reused after the
+        server side has already dropped them.
+    """
+
+    def __init__(self,
+                 pool_size=constants.HTTP_POOL_SIZE,
+                 connections_per_host=constants.HTTP_POOL_CONNECTIONS_PER_HOST,
+                 idle_timeout=constants.HTTP_POOL_IDLE_TIMEOUT,
+                 **kwargs):
+        session = requests.Session()
+        # Retries are handled by the azure-core retry policy.
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=connections_per_host,
+            max_retries=Retry(total=False, redirect=False,
+                              raise_on_status=False))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        super(SharedHttpTransport, self).__init__(
+            session=session, session_owner=False, **kwargs)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._last_used = time.time()
+
+    def reap_idle_connections(self):
+        """Closes the pooled connections if they were idle too long."""
+        with self._lock:
+            idle = time.time() - self._last_used
+            if not self.idle_timeout or idle < self.idle_timeout:
+                return False
+            for adapter in self.session.adapters.values():
+                adapter.poolmanager.clear()
+            self._last_used = time.time()
+            return True
+
+    def send(self, request, **kwargs):
+        self.reap_idle_connections()
+        try:
+            return super(SharedHttpTransport, self).send(request, **kwargs)
+        finally:
+            self._last_used = time.time()
+
+
+_http_transports = {}
+_http_transports_lock = threading.Lock()
+
+
+def get_http_transport(pool_size=None,
+                       connections_per_host=None,
+                       idle_timeout=None):
+    """
+        Returns the shared HTTP transport for a pool configuration.
+
+    :param pool_size: Number of per-host connection pools to keep.
+    :param connections_per_host: Maximum connections kept to one host.
+    :param idle_timeout: Seconds before idle connections are reaped.
+    :rtype: :class:`SharedHttpTransport`
+    """
+    key = (int(pool_size or constants.HTTP_POOL_SIZE),
+           int(connections_per_host or
+               constants.HTTP_POOL_CONNECTIONS_PER_HOST),
+           int(idle_timeout or constants.HTTP_POOL_IDLE_TIMEOUT))
+    with _http_transports_lock:
+        if key not in _http_transports:
+            _http_transports[key] = SharedHttpTransport(*key)
+        return _http_transports[key]
+
+
+class OperationCache(object):
+    """
+        Read-through cache of resource reads, scoped to the Cloudify
+        operation that is currently running.
+
+        Entries are kept per operation context and dropped with it. Any write
+        made through an AzureResource during the operation clears that
+        operation's entries. Outside of an operation nothing is cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._operations = weakref.WeakKeyDictionary()
+
+    def _get_operation(self, _ctx=None):
+        if _ctx is None:
+            try:
+                _ctx = current_ctx.get_ctx()
+            except NotInContext:
+                return None
+        with self._lock:
+            if _ctx not in self._operations:
+                self._operations[_ctx] = {
+                    'entries': {}, 'hits': 0, 'misses': 0}
+            return self._operations[_ctx]
+
+    def get(self, key, factory):
+        operation = self._get_operation()
+        if operation is None:
+            return factory()
+        with self._lock:
+            if key in operation['entries']:
+                operation['hits'] += 1
+                return deepcopy(operation['entries'][key])
+        value = factory()
+        with self._lock:
+            operation['misses'] += 1
+            operation['entries'][key] = deepcopy(value)
+        return value
+
+    def invalidate(self):
+        operation = self._get_operation()
+        if operation is not None:
+            with self._lock:
+                operation['entries'].clear()
+
+    def stats(self, _ctx=None):
+        operation = self._get_operation(_ctx) or {}
+        return {'size': len(operation.get('entries', {})),
+                'hits': operation.get('hits', 0),
+                'misses': operation.get('misses', 0)}
+
+
+operation_cache = OperationCache()
+
+
+def _cached_read(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = (type(self), func.__name__, self.client,
+               json.dumps([args, kwargs], sort_keys=True, default=str))
+        return operation_cache.get(key, lambda: func(self, *args, **kwargs))
+    return wrapper
+
+
+def _invalidating_write(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            operation_cache.invalidate()
+    return wrapper
+
+
+class LongRunningOperationPending(Exception):
+    """
+        Raised in non blocking mode when a long running operation was
+        started or resumed, but has not completed yet.
+    """
+
+    def __init__(self, continuation_token):
+        self.continuation_token = continuation_token
+        super(LongRunningOperationPending, self).__init__(
+            'The long running operation is still in progress.')
+
+
+class AdaptiveARMPolling(ARMPolling):
+    """
+        ARM polling method that checks the operation status with an
+        exponential, jittered backoff instead of a fixed interval. A
+        Retry-After header returned by Azure takes precedence.
+    """
+
+    def __init__(self,
+                 initial_delay,
+                 max_delay,
+                 backoff=constants.POLLING_BACKOFF,
+                 jitter=constants.POLLING_JITTER,
+                 **kwargs):
+        super(AdaptiveARMPolling, self).__init__(
+            timeout=initial_delay, **kwargs)
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._backoff = backoff
+        self._jitter = jitter
+        self._checks = 0
+
+    def _extract_delay(self):
+        delay = min(self._initial_delay * self._backoff ** self._checks,
+                    self._max_delay)
+        self._checks += 1
+        # The base class returns Retry-After if set, or else the timeout.
+        self._timeout = delay * random.uniform(
+            1 - self._jitter, 1 + self._jitter)
+        return super(AdaptiveARMPolling, self)._extract_delay()
+
+
+class _StatusChecked(Exception):
+    pass
+
+
+class SingleCheckARMPolling(ARMPolling):
+    """
+        ARM polling method that checks the operation status once and
+        returns, instead of sleeping until the operation completes.
+    """
+
+    def _delay(self):
+        # Called by the base class before every status check after the
+        # first one.
+        raise _StatusChecked()
+
+    def run(self):
+        try:
+            super(SingleCheckARMPolling, self).run()
+        except _StatusChecked:
+            pass
 
 
 class AzureResource(object):
 
+    # Methods of subclasses that read through the operation cache, and
+    # methods that invalidate it.
+    cached_reads = ('get', 'get_instance_view')
+    cache_writes = ('create', 'create_or_update', 'update', 'set_or_update',
+                    'delete', 'start', 'power_off', 'restart', 'run_command')
+    # Client operation, as (operation group, method), that lists the
+    # resources of this type in a parent scope, e.g. a resource group.
+    name_list_operation = None
+    # Key of constants.POLLING_PROFILES used for long running operations.
+    polling_profile = 'default'
+
+    def __init_subclass__(cls, **kwargs):
+        super(AzureResource, cls).__init_subclass__(**kwargs)
+        for name in cls.cached_reads:
+            if name in cls.__dict__:
+                setattr(cls, name, _cached_read(cls.__dict__[name]))
+        for name in cls.cache_writes:
+            if name in cls.__dict__:
+                setattr(cls, name, _invalidating_write(cls.__dict__[name]))
+
     def __init__(self, azure_config):
         self.creds = self.handle_credentials(azure_config)
         azure_config_env_vars = azure_config.get('environment_variables')
@@ -38,6 +402,7 @@ class AzureResource(object):
         subscription_id = azure_config.get("subscription_id") or \
             azure_config_env_vars.get('AZURE_SUBSCRIPTION_ID')
         self._credentials = None
+        self._credentials_key = None
 
         # Traditional method
         client_id = self.creds.get("client_id")
@@ -46,15 +411,27 @@ class AzureResource(object):
         username = self.creds.get('username')
         password = self.creds.get('password')
 
+        cloud = self.creds['cloud_environment'].name
         if username and password:
-            self._credentials = UserPassCredentials(
-                username, password, client_id=client_id, secret=secret)
+            self._credentials_key = (
+                UserPassCredentials, username, fingerprint(password),
+                client_id, fingerprint(secret), cloud)
+            self._credentials = credentials_cache.get(
+                self._credentials_key,
+                lambda: UserPassCredentials(
+                    username, password, client_id=client_id, secret=secret))
         elif client_id and secret:
-            self._credentials = ClientSecretCredential(
-                tenant_id=self.creds.get("tenant_id"),
-                client_id=client_id,
-                client_secret=secret,
-            )
+            tenant_id = self.creds.get("tenant_id")
+            self._credentials_key = (
+                ClientSecretCredential, tenant_id, client_id,
+                fingerprint(secret), cloud)
+            self._credentials = credentials_cache.get(
+                self._credentials_key,
+                lambda: ClientSecretCredential(
+                    tenant_id=tenant_id,
+                    client_id=client_id,
+                    client_secret=secret,
+                ))
         # Disabling Azure Stack
         # elif client_id and secret:
         #     self._credentials = ServicePrincipalCredentials(
@@ -77,9 +454,23 @@ class AzureResource(object):
             )
 
         if not self._credentials:
-            self.credentials = DefaultAzureCredential()
+            self._credentials_key = (
+                DefaultAzureCredential,
+                fingerprint(azure_config_env_vars or {}), cloud)
+            self.credentials = credentials_cache.get(
+                self._credentials_key, DefaultAzureCredential)
 
         self.subscription_id = subscription_id
+        self.transport = get_http_transport(
+            self.creds.get('http_pool_size'),
+            self.creds.get('http_pool_connections_per_host'),
+            self.creds.get('http_pool_idle_timeout'))
+        # Set by cloudify_azure.utils.run_task for node operations when
+        # async_mode is enabled in the client config.
+        self.non_blocking = False
+        # Fixed delay between LRO status checks, overriding the profile.
+        self.retry_after = None
+        self.continuation_token = None
         self._client = None
 
     @property
@@ -98,6 +489,76 @@ class AzureResource(object):
     def credentials(self, value):
         self._credentials = value
 
+    def get_management_client(self, client_class, api_version=None):
+        """
+            Gets a management client from the shared client pool.
+
+        :param client_class: An Azure management client class,
+            e.g. ComputeManagementClient.
+        :param api_version: The api version to pin the client to, if any.
+        :returns: An instance of client_class.
+        """
+        kwargs = {'transport': self.transport}
+        if api_version:
+            kwargs['api_version'] = api_version
+        throttled = bool(self.creds.get('arm_throttle', True))
+        if throttled:
+            kwargs['per_retry_policies'] = [throttle.throttle_policy]
+        key = (client_class,
+               self._credentials_key,
+               self.subscription_id,
+               api_version,
+               self.transport,
+               throttled)
+        return client_pool.get(
+            key,
+            lambda: client_class(
+                self.credentials, self.subscription_id, **kwargs))
+
+    @property
+    def lro_kwargs(self):
+        """
+            Extra keyword arguments for begin_* calls, i.e. the polling
+            method. In non blocking mode the poller checks the operation
+            status once, and resumes from continuation_token if one was set.
+        """
+        if not self.non_blocking:
+            return {'polling': self.get_polling_method()}
+        kwargs = {'polling': SingleCheckARMPolling()}
+        if self.continuation_token:
+            kwargs['continuation_token'] = self.continuation_token
+        return kwargs
+
+    def get_polling_method(self):
+        """
+            Returns the polling method for a long running operation, using
+            retry_after as a fixed delay if set, or the polling profile of
+            the resource type.
+        """
+        if self.retry_after:
+            return AdaptiveARMPolling(self.retry_after, self.retry_after)
+        return AdaptiveARMPolling(
+            *constants.POLLING_PROFILES[self.polling_profile])
+
+    def wait_for_lro(self, poller, **kwargs):
+        """
+            Waits for a long running operation started with lro_kwargs.
+
+        :param poller: The LROPoller returned by a begin_* call.
+        :param kwargs: Passed to poller.wait in blocking mode.
+        :returns: The poller, once the operation completed.
+        :raises LongRunningOperationPending: In non blocking mode, if the
+            operation is still in progress.
+        """
+        if not self.non_blocking:
+            poller.wait(**kwargs)
+            return poller
+        poller.wait()
+        self.continuation_token = None
+        if not poller.polling_method().finished():
+            raise LongRunningOperationPending(poller.continuation_token())
+        return poller
+
     def handle_credentials(self, azure_config):
         """
             Gets any Azure API access information from the
@@ -133,6 +594,35 @@ class AzureResource(object):
             creds['endpoint_verify'] = True
         return utils.cleanup_empty_params(creds)
 
+    def list_names(self, *scope):
+        """
+            Lists the names of the resources of this type with one call.
+
+        :param scope: The arguments of the get call that identify the
+            parent scope, e.g. the resource group name.
+        :returns: A set of resource names.
+        """
+        if not self.name_list_operation:
+            raise NotImplementedError()
+        group, method = self.name_list_operation
+        result = getattr(getattr(self.client, group), method)(*scope)
+        # Some list operations return a result object instead of a pager.
+        return set(item.name for item in getattr(result, 'value', result))
+
+    def list_by_scope(self, *scope):
+        """
+            Lists the resources of this type with one call.
+
+        :param scope: The arguments of the get call that identify the
+            parent scope, e.g. the resource group name.
+        :returns: A list of resource dicts.
+        """
+        if not self.name_list_operation:
+            raise NotImplementedError()
+        group, method = self.name_list_operation
+        result = getattr(getattr(self.client, group), method)(*scope)
+        return [item.as_dict() for item in getattr(result, 'value', result)]
+
     def get(self):
         raise NotImplementedError()
 
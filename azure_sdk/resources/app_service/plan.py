@@ -20,13 +20,13 @@ from azure_sdk.common import AzureResource
 
 
 class ServicePlan(AzureResource):
+    name_list_operation = ('app_service_plans', 'list_by_resource_group')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_APP_SERVICE):
         super(ServicePlan, self).__init__(azure_config)
         self.logger = logger
-        self.client = WebSiteManagementClient(self.credentials,
-                                              self.subscription_id)
+        self.client = self.get_management_client(WebSiteManagementClient)
 
     def get(self, group_name, plan_name):
         self.logger.info("Get plan...{0}".format(plan_name))
@@ -25,8 +25,7 @@ class PublishingUser(AzureResource):
                  api_version=constants.API_VER_APP_SERVICE):
         super(PublishingUser, self).__init__(azure_config)
         self.logger = logger
-        self.client = WebSiteManagementClient(self.credentials,
-                                              self.subscription_id)
+        self.client = self.get_management_client(WebSiteManagementClient)
 
     def set_or_update(self, user_details):
         self.logger.info("Set/Updating publishing_user...")
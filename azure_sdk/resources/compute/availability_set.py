@@ -20,15 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class AvailabilitySet(AzureResource):
+    name_list_operation = ('availability_sets', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_COMPUTE):
         super(AvailabilitySet, self).__init__(azure_config)
         self.logger = logger
         self.api_version = api_version
-        self.client = \
-            ComputeManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            ComputeManagementClient, api_version=api_version)
 
     def get(self, group_name, availability_set_name):
         self.logger.info(
@@ -25,8 +25,7 @@ class ContainerService(AzureResource):
                  api_version=constants.API_VER_CONTAINER):
         super(ContainerService, self).__init__(azure_config)
         self.logger = logger
-        self.client = ContainerServiceClient(self.credentials,
-                                             self.subscription_id)
+        self.client = self.get_management_client(ContainerServiceClient)
 
     def get(self, group_name, container_service_name):
         self.logger.info(
@@ -20,13 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class ManagedCluster(AzureResource):
+    name_list_operation = ('managed_clusters', 'list_by_resource_group')
+    polling_profile = 'slow'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_MANAGED_CLUSTER):
         super(ManagedCluster, self).__init__(azure_config)
         self.logger = logger
-        self.client = ContainerServiceClient(self.credentials,
-                                             self.subscription_id)
+        self.client = self.get_management_client(ContainerServiceClient)
 
     def get(self, group_name, resource_name):
         self.logger.info("Get managed_cluster...{0}".format(resource_name))
@@ -41,11 +42,8 @@ class ManagedCluster(AzureResource):
 
     def list(self):
         self.logger.info("Listing managed_clusters...")
-        managed_clusters = [
-            cluster for cluster in
-            self.client.managed_clusters.list()
-        ]
-        return managed_clusters
+        # The pager requests the next page only when it is iterated.
+        return self.client.managed_clusters.list()
 
     def create_or_update(self, group_name, resource_name, params):
         self.logger.info(
@@ -55,8 +53,9 @@ class ManagedCluster(AzureResource):
                 resource_group_name=group_name,
                 resource_name=resource_name,
                 parameters=params,
+                **self.lro_kwargs
             )
-        create_async_operation.wait()
+        self.wait_for_lro(create_async_operation)
         managed_cluster = create_async_operation.result().as_dict()
         self.logger.info(
             'Create managed_cluster result: {0}'.format(
@@ -69,9 +68,10 @@ class ManagedCluster(AzureResource):
             "Deleting managed_cluster...{0}".format(resource_name))
         delete_async_operation = self.client.managed_clusters.begin_delete(
             resource_group_name=group_name,
-            resource_name=resource_name
+            resource_name=resource_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted managed_cluster {0}'.format(resource_name))
 
@@ -13,22 +13,109 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import json
+import time
+import threading
+
 from azure.mgmt.compute import ComputeManagementClient
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 from cloudify_azure import (constants, utils)
 from azure_sdk.common import AzureResource
 
 
+def parse_power_state(instance_view):
+    """
+        Returns the power state code, e.g. PowerState/running, of a
+        virtual machine instance view, or else its last status code.
+    """
+    codes = [status.get('code') for status in
+             (instance_view or {}).get('statuses') or []]
+    for code in codes:
+        if code and code.startswith('PowerState/'):
+            return code
+    if not codes:
+        raise KeyError('statuses')
+    return codes[-1]
+
+
+class PowerStateCache(object):
+    """
+        Cache of virtual machine power states, in a JSON file per virtual
+        machine, so that the operations of all of the processes on the
+        manager share them.
+
+        Operations that poll the power state of virtual machines, e.g. the
+        retries of start and stop of many node instances, and the refresh
+        workflow, share each state for ttl seconds. Operations that change
+        the power state invalidate it.
+    """
+
+    def __init__(self,
+                 cache_dir=constants.POWER_STATE_CACHE_DIR,
+                 ttl=constants.POWER_STATE_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '{0}.json'.format(
+            '_'.join(str(part) for part in key).replace(os.sep, '_')))
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as infile:
+                cached = json.load(infile)
+            if time.time() - cached['time'] < self.ttl:
+                return cached['power_state']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def set(self, key, power_state):
+        path = self._path(key)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            temp_path = '{0}.{1}.{2}'.format(
+                path, os.getpid(), threading.current_thread().ident)
+            with open(temp_path, 'w') as outfile:
+                json.dump({'time': time.time(), 'power_state': power_state},
+                          outfile)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except (IOError, OSError):
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except (IOError, OSError):
+                pass
+
+
+power_state_cache = PowerStateCache()
+
+
 class VirtualMachine(AzureResource):
+    name_list_operation = ('virtual_machines', 'list')
+    polling_profile = 'slow'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_COMPUTE):
         super(VirtualMachine, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            ComputeManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            ComputeManagementClient, api_version=api_version)
 
     def get(self, group_name, vm_name):
         self.logger.info("Get virtual_machine...{0}".format(vm_name))
@@ -56,16 +143,109 @@ class VirtualMachine(AzureResource):
             )
         return virtual_machine
 
-    def create_or_update(self, group_name, vm_name, params):
+    def list_statuses(self):
+        """
+            Lists the instance view statuses of all of the virtual machines
+            in the subscription with one call.
+
+        :returns: A list of virtual machine dicts, with only the id, name
+            and instance_view of each one.
+        """
+        self.logger.info("List virtual_machine statuses...")
+        client = self.get_management_client(
+            ComputeManagementClient,
+            api_version=constants.API_VER_COMPUTE_STATUS)
+        return [virtual_machine.as_dict() for virtual_machine in
+                client.virtual_machines.list_all(status_only='true')]
+
+    def _power_state_key(self, group_name, vm_name):
+        return (self.subscription_id, group_name.lower(), vm_name.lower())
+
+    def get_power_state(self, group_name, vm_name):
+        """
+            Gets the power state of a virtual machine from its instance
+            view, which is much smaller than the virtual machine with its
+            instance view.
+
+        :returns: The power state code, e.g. PowerState/running.
+        """
+        key = self._power_state_key(group_name, vm_name)
+        power_state = power_state_cache.get(key)
+        if power_state is None:
+            instance_view = self.client.virtual_machines.instance_view(
+                resource_group_name=group_name,
+                vm_name=vm_name
+            ).as_dict()
+            power_state = parse_power_state(instance_view)
+            power_state_cache.set(key, power_state)
+        self.logger.debug(
+            'virtual_machine {0} power state: {1}'.format(
+                vm_name, power_state))
+        return power_state
+
+    def get_power_states(self, virtual_machines):
+        """
+            Gets the power states of many virtual machines with one status
+            only list call for the subscription. If the list call fails,
+            e.g. with an API version without it, the power state of each
+            virtual machine is read from its instance view.
+
+        :param virtual_machines: A list of (group name, vm name).
+        :returns: A dict of (group name, vm name) to the power state code,
+            or None if the virtual machine does not exist.
+        """
+        cached = dict(
+            ((group_name, vm_name), power_state_cache.get(
+                self._power_state_key(group_name, vm_name)))
+            for group_name, vm_name in virtual_machines)
+        if all(power_state is not None for power_state in cached.values()):
+            return cached
+        try:
+            listed = self.list_statuses()
+        except HttpResponseError as e:
+            self.logger.debug(
+                'Listing virtual_machine statuses failed, reading each '
+                'instance view: {0}'.format(e))
+        else:
+            power_states = {}
+            for virtual_machine in listed:
+                group_name = virtual_machine['id'].split('/')[4]
+                key = self._power_state_key(
+                    group_name, virtual_machine['name'])
+                try:
+                    power_states[key] = parse_power_state(
+                        virtual_machine.get('instance_view'))
+                except KeyError:
+                    continue
+                power_state_cache.set(key, power_states[key])
+            return dict(
+                ((group_name, vm_name), power_states.get(
+                    self._power_state_key(group_name, vm_name)))
+                for group_name, vm_name in virtual_machines)
+        result = {}
+        for group_name, vm_name in virtual_machines:
+            try:
+                result[(group_name, vm_name)] = \
+                    self.get_power_state(group_name, vm_name)
+            except ResourceNotFoundError:
+                result[(group_name, vm_name)] = None
+        return result
+
+    def create_or_update(self, group_name, vm_name, params, etag=None):
         self.logger.info(
             "Create/Updating virtual_machine...{0}".format(vm_name))
+        kwargs = dict(self.lro_kwargs)
+        if etag:
+            # Fail with 412 if the resource changed since it was read.
+            kwargs['headers'] = {'If-Match': etag}
         create_async_operation = \
             self.client.virtual_machines.begin_create_or_update(
                 resource_group_name=group_name,
                 vm_name=vm_name,
                 parameters=params,
+                **kwargs
             )
-        create_async_operation.wait()
+        self.wait_for_lro(create_async_operation)
         virtual_machine = create_async_operation.result().as_dict()
         self.logger.info(
             'Create virtual_machine result: {0}'.format(
@@ -74,50 +254,62 @@ class VirtualMachine(AzureResource):
         return virtual_machine
 
     def delete(self, group_name, vm_name):
+        power_state_cache.invalidate(
+            self._power_state_key(group_name, vm_name))
         self.logger.info(
             "Deleting virtual_machine...{0}".format(vm_name))
         try:
             delete_async_operation = self.client.virtual_machines.begin_delete(
                 resource_group_name=group_name,
-                vm_name=vm_name
+                vm_name=vm_name,
+                **self.lro_kwargs
             )
         except ResourceNotFoundError:
             self.logger.debug('Deleted machine not found.')
         else:
-            delete_async_operation.wait()
+            self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted virtual_machine {0}'.format(vm_name))
 
     def start(self, group_name, vm_name):
+        power_state_cache.invalidate(
+            self._power_state_key(group_name, vm_name))
         self.logger.info(
             "Starting virtual_machine...{0}".format(vm_name))
         start_async_operation = self.client.virtual_machines.begin_start(
             resource_group_name=group_name,
-            vm_name=vm_name
+            vm_name=vm_name,
+            **self.lro_kwargs
         )
-        start_async_operation.wait()
+        self.wait_for_lro(start_async_operation)
         self.logger.debug(
             'Started virtual_machine {0}'.format(vm_name))
 
     def power_off(self, group_name, vm_name):
+        power_state_cache.invalidate(
+            self._power_state_key(group_name, vm_name))
         self.logger.info(
             "Stopping virtual_machine...{0}".format(vm_name))
         stop_async_operation = self.client.virtual_machines.begin_power_off(
             resource_group_name=group_name,
-            vm_name=vm_name
+            vm_name=vm_name,
+            **self.lro_kwargs
         )
-        stop_async_operation.wait()
+        self.wait_for_lro(stop_async_operation)
         self.logger.debug(
             'Stopped virtual_machine {0}'.format(vm_name))
 
     def restart(self, group_name, vm_name):
+        power_state_cache.invalidate(
+            self._power_state_key(group_name, vm_name))
         self.logger.info(
             "Restarting virtual_machine...{0}".format(vm_name))
         restart_async_operation = self.client.virtual_machines.begin_restart(
             resource_group_name=group_name,
-            vm_name=vm_name
+            vm_name=vm_name,
+            **self.lro_kwargs
         )
-        restart_async_operation.wait()
+        self.wait_for_lro(restart_async_operation)
         self.logger.debug(
             'Restarted virtual_machine {0}'.format(vm_name))
 
@@ -128,7 +320,8 @@ class VirtualMachine(AzureResource):
             self.client.virtual_machines.begin_run_command(
                 resource_group_name=group_name,
                 vm_name=vm_name,
-                parameters=cmd_params)
+                parameters=cmd_params,
+                polling=self.get_polling_method())
         run_cmd_async_operation.wait()
         run_cmd = run_cmd_async_operation.result().as_dict()
         self.logger.info(
@@ -20,14 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class VirtualMachineExtension(AzureResource):
+    name_list_operation = ('virtual_machine_extensions', 'list')
+    polling_profile = 'slow'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_COMPUTE):
         super(VirtualMachineExtension, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            ComputeManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            ComputeManagementClient, api_version=api_version)
 
     def get(self, group_name, vm_name, vm_extension_name):
         self.logger.info("Get vm_extension...{0}".format(vm_extension_name))
@@ -51,8 +52,9 @@ class VirtualMachineExtension(AzureResource):
                 vm_name=vm_name,
                 vm_extension_name=vm_extension_name,
                 extension_parameters=params,
+                **self.lro_kwargs
             )
-        create_async_operation.wait()
+        self.wait_for_lro(create_async_operation)
         virtual_machine_extension = create_async_operation.result().as_dict()
         self.logger.info(
             'Create virtual_machine_extension result: {0}'.format(
@@ -67,8 +69,9 @@ class VirtualMachineExtension(AzureResource):
             self.client.virtual_machine_extensions.begin_delete(
                 resource_group_name=group_name,
                 vm_name=vm_name,
-                vm_extension_name=vm_extension_name
+                vm_extension_name=vm_extension_name,
+                **self.lro_kwargs
             )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted virtual_machine_extension {0}'.format(vm_extension_name))
@@ -0,0 +1,103 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from azure.mgmt.compute import ComputeManagementClient
+from azure.core.exceptions import ResourceNotFoundError
+
+from cloudify_azure import (constants, utils)
+from azure_sdk.common import AzureResource
+
+
+class VirtualMachineScaleSet(AzureResource):
+    name_list_operation = ('virtual_machine_scale_sets', 'list')
+    polling_profile = 'slow'
+
+    def __init__(self, azure_config, logger,
+                 api_version=constants.API_VER_COMPUTE_SCALE_SET):
+        super(VirtualMachineScaleSet, self).__init__(azure_config)
+        self.logger = logger
+        self.client = self.get_management_client(
+            ComputeManagementClient, api_version=api_version)
+
+    def get(self, group_name, scale_set_name):
+        self.logger.info(
+            "Get virtual_machine_scale_set...{0}".format(scale_set_name))
+        scale_set = self.client.virtual_machine_scale_sets.get(
+            resource_group_name=group_name,
+            vm_scale_set_name=scale_set_name
+        ).as_dict()
+        self.logger.info(
+            'Get virtual_machine_scale_set result: {0}'.format(
+                utils.secure_logging_content(scale_set))
+            )
+        return scale_set
+
+    def create_or_update(self, group_name, scale_set_name, params,
+                         etag=None, if_none_match=False):
+        self.logger.info(
+            "Create/Updating virtual_machine_scale_set...{0}".format(
+                scale_set_name))
+        kwargs = dict(self.lro_kwargs)
+        if etag:
+            # Fail with 412 if the resource changed since it was read.
+            kwargs['headers'] = {'If-Match': etag}
+        elif if_none_match:
+            # Fail with 412 if the resource was created meanwhile.
+            kwargs['headers'] = {'If-None-Match': '*'}
+        create_async_operation = \
+            self.client.virtual_machine_scale_sets.begin_create_or_update(
+                resource_group_name=group_name,
+                vm_scale_set_name=scale_set_name,
+                parameters=params,
+                **kwargs
+            )
+        self.wait_for_lro(create_async_operation)
+        scale_set = create_async_operation.result().as_dict()
+        self.logger.info(
+            'Create virtual_machine_scale_set result: {0}'.format(
+                utils.secure_logging_content(scale_set))
+            )
+        return scale_set
+
+    def delete(self, group_name, scale_set_name):
+        self.logger.info(
+            "Deleting virtual_machine_scale_set...{0}".format(scale_set_name))
+        try:
+            delete_async_operation = \
+                self.client.virtual_machine_scale_sets.begin_delete(
+                    resource_group_name=group_name,
+                    vm_scale_set_name=scale_set_name,
+                    **self.lro_kwargs
+                )
+        except ResourceNotFoundError:
+            self.logger.debug('Deleted scale set not found.')
+        else:
+            self.wait_for_lro(delete_async_operation)
+        self.logger.debug(
+            'Deleted virtual_machine_scale_set {0}'.format(scale_set_name))
+
+    def list_virtual_machines(self, group_name, scale_set_id):
+        """
+            Lists the virtual machines of a flexible orchestration scale set
+            with one call.
+
+        :returns: A list of virtual machine dicts.
+        """
+        return [
+            virtual_machine.as_dict() for virtual_machine in
+            self.client.virtual_machines.list(group_name)
+            if virtual_machine.virtual_machine_scale_set and
+            virtual_machine.virtual_machine_scale_set.id.lower() ==
+            scale_set_id.lower()]
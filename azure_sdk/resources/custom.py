@@ -12,6 +12,10 @@ class AzureCustomResourceError(Exception):
 
 class CustomAzureResource(AzureResource):
 
+    # The read target depends on the configured resource object, not only
+    # on the get arguments, so reads are not cached.
+    cached_reads = ()
+
     def __init__(self,
                  azure_config,
                  logger,
@@ -49,15 +53,7 @@ class CustomAzureResource(AzureResource):
                 )
             )
         self.client_class_name = custom_resource_class_name
-        if api_version:
-            self._client = self.get_client(
-                self.credentials,
-                self.subscription_id,
-                api_version=api_version)
-        else:
-            self._client = self.get_client(
-                self.credentials,
-                self.subscription_id)
+        self._client = self.get_client(api_version=api_version)
         self.custom_resource = self.get_client_attributes(
             custom_resource_object_name)
         self.create_fn_name = create_fn_name or 'create_or_update'
@@ -66,9 +62,9 @@ class CustomAzureResource(AzureResource):
         self.get_fn_name = get_fn_name or 'get'
         self.get_params = get_params
 
-    def get_client(self, *args, **kwargs):
+    def get_client(self, api_version=None):
         client_obj = getattr(self.client_module, self.client_class_name)
-        return client_obj(*args, **kwargs)
+        return self.get_management_client(client_obj, api_version)
 
     def get_client_attributes(self, attribute_name, client=None):
         client = client or self.client
@@ -25,13 +25,14 @@ from azure_sdk.common import AzureResource
 
 
 class Deployment(AzureResource):
+    name_list_operation = ('deployments', 'list_by_resource_group')
+    polling_profile = 'slow'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_RESOURCES):
         super(Deployment, self).__init__(azure_config)
         self.logger = logger
-        self.client = ResourceManagementClient(self.credentials,
-                                               self.subscription_id)
+        self.client = self.get_management_client(ResourceManagementClient)
 
     def get(self, group_name, deployment_name):
         self.logger.info("Get deployment...{0}".format(deployment_name))
@@ -59,9 +60,10 @@ class Deployment(AzureResource):
                 resource_group_name=group_name,
                 deployment_name=deployment_name,
                 parameters=AzDeployment(properties=deployment_properties),
+                **self.lro_kwargs
                 # verify=resource_verify
             )
-        async_deployment_creation.wait(timeout=timeout)
+        self.wait_for_lro(async_deployment_creation, timeout=timeout)
         deployment = async_deployment_creation.result().as_dict()
         self.logger.info(
             'Create deployment result: {0}'.format(
@@ -72,9 +74,10 @@ class Deployment(AzureResource):
         self.logger.info("Deleting deployment...{0}".format(deployment_name))
         delete_async_operation = self.client.deployments.begin_delete(
             resource_group_name=group_name,
-            deployment_name=deployment_name
+            deployment_name=deployment_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted deployment {0}'.format(deployment_name))
 
@@ -92,7 +95,8 @@ class Deployment(AzureResource):
             resource_group_name=group_name,
             deployment_name=deployment_name,
             parameters=DeploymentWhatIf(
-                properties=what_if_properties)
+                properties=what_if_properties),
+            polling=self.get_polling_method()
         )
         async_what_if_operation.wait(timeout=timeout)
         what_if_result = async_what_if_operation.result().as_dict()
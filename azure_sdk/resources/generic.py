@@ -0,0 +1,54 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from azure.mgmt.resource import ResourceManagementClient
+
+from cloudify_azure import (constants, utils)
+from azure_sdk.common import AzureResource
+
+
+class GenericResource(AzureResource):
+    """Any ARM resource, addressed by type or ID."""
+    cached_reads = ('get_by_id',)
+
+    def __init__(self, azure_config, logger,
+                 api_version=constants.API_VER_RESOURCES):
+        super(GenericResource, self).__init__(azure_config)
+        self.logger = logger
+        self.client = self.get_management_client(
+            ResourceManagementClient, api_version=api_version)
+
+    def list_by_type(self, resource_type):
+        """List all resources of a type in the subscription, with their
+        change and creation times.
+
+        :param resource_type: An ARM type, i.e. Microsoft.Web/sites.
+        :return: A pager of GenericResourceExpanded.
+        """
+        self.logger.info("Listing resources...{0}".format(resource_type))
+        return self.client.resources.list(
+            filter="resourceType eq '{0}'".format(resource_type),
+            expand='changedTime,createdTime')
+
+    def get_by_id(self, resource_id, api_version):
+        self.logger.info("Get resource...{0}".format(resource_id))
+        resource = self.client.resources.get_by_id(
+            resource_id=resource_id,
+            api_version=api_version
+        ).as_dict()
+        self.logger.info(
+            'Get resource result: {0}'.format(
+                utils.secure_logging_content(resource)))
+        return resource
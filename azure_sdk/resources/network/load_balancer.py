@@ -20,14 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class LoadBalancer(AzureResource):
+    name_list_operation = ('load_balancers', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(LoadBalancer, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, load_balancer_name):
         self.logger.info("Get load_balancer...{0}".format(load_balancer_name))
@@ -41,16 +41,22 @@ class LoadBalancer(AzureResource):
             )
         return load_balancer
 
-    def create_or_update(self, group_name, load_balancer_name, params):
+    def create_or_update(self, group_name, load_balancer_name, params,
+                         etag=None):
         self.logger.info(
             "Create/Updating load_balancer...{0}".format(load_balancer_name))
+        kwargs = dict(self.lro_kwargs)
+        if etag:
+            # Fail with 412 if the resource changed since it was read.
+            kwargs['headers'] = {'If-Match': etag}
         async_load_balancer_creation = \
             self.client.load_balancers.begin_create_or_update(
                 resource_group_name=group_name,
                 load_balancer_name=load_balancer_name,
                 parameters=params,
+                **kwargs
             )
-        async_load_balancer_creation.wait()
+        self.wait_for_lro(async_load_balancer_creation)
         load_balancer = async_load_balancer_creation.result().as_dict()
         self.logger.info(
             'create load_balancer result: {0}'.format(
@@ -63,22 +69,23 @@ class LoadBalancer(AzureResource):
             "Deleting load_balancer...{0}".format(load_balancer_name))
         delete_async_operation = self.client.load_balancers.begin_delete(
             resource_group_name=group_name,
-            load_balancer_name=load_balancer_name
+            load_balancer_name=load_balancer_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted load_balancer {0}'.format(load_balancer_name))
 
 
 class LoadBalancerBackendAddressPool(AzureResource):
+    name_list_operation = ('load_balancer_backend_address_pools', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK_LB_BACKEND_PROBES):
         super(LoadBalancerBackendAddressPool, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, load_balancer_name, backend_address_pool_name):
         self.logger.info("Get load balancer backend address pool...{0}".format(
@@ -95,14 +102,14 @@ class LoadBalancerBackendAddressPool(AzureResource):
 
 
 class LoadBalancerProbe(AzureResource):
+    name_list_operation = ('load_balancer_probes', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK_LB_BACKEND_PROBES):
         super(LoadBalancerProbe, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, load_balancer_name, probe_name):
         self.logger.info("Get load balancer probe...{0}".format(
@@ -119,14 +126,14 @@ class LoadBalancerProbe(AzureResource):
 
 
 class LoadBalancerLoadBalancingRule(AzureResource):
+    name_list_operation = ('load_balancer_load_balancing_rules', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK_LB_BACKEND_PROBES):
         super(LoadBalancerLoadBalancingRule, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, load_balancer_name, load_balancing_rule_name):
         self.logger.info("Get load balancer rule...{0}".format(
@@ -143,14 +150,14 @@ class LoadBalancerLoadBalancingRule(AzureResource):
 
 
 class LoadBalancerInboundNatRule(AzureResource):
+    name_list_operation = ('inbound_nat_rules', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK_LB_BACKEND_PROBES):
         super(LoadBalancerInboundNatRule, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, load_balancer_name, inbound_nat_rule_name):
         self.logger.info("Get load balancer inbound nat rule...{0}".format(
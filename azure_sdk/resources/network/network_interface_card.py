@@ -20,14 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class NetworkInterfaceCard(AzureResource):
+    name_list_operation = ('network_interfaces', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(NetworkInterfaceCard, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, network_interface_name):
         self.logger.info(
@@ -42,17 +42,23 @@ class NetworkInterfaceCard(AzureResource):
             )
         return network_interface
 
-    def create_or_update(self, group_name, network_interface_name, params):
+    def create_or_update(self, group_name, network_interface_name, params,
+                         etag=None):
         self.logger.info(
             "Create/Updating network_interface...{0}".format(
                 network_interface_name))
+        kwargs = dict(self.lro_kwargs)
+        if etag:
+            # Fail with 412 if the resource changed since it was read.
+            kwargs['headers'] = {'If-Match': etag}
         async_network_interface_creation = \
             self.client.network_interfaces.begin_create_or_update(
                 resource_group_name=group_name,
                 network_interface_name=network_interface_name,
                 parameters=params,
+                **kwargs
             )
-        async_network_interface_creation.wait()
+        self.wait_for_lro(async_network_interface_creation)
         network_interface = async_network_interface_creation.result().as_dict()
         self.logger.info(
             'create network_interface result: {0}'.format(
@@ -65,8 +71,9 @@ class NetworkInterfaceCard(AzureResource):
             "Deleting network_interface...{0}".format(network_interface_name))
         delete_async_operation = self.client.network_interfaces.begin_delete(
             resource_group_name=group_name,
-            network_interface_name=network_interface_name
+            network_interface_name=network_interface_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted network_interface {0}'.format(network_interface_name))
@@ -20,14 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class NetworkSecurityGroup(AzureResource):
+    name_list_operation = ('network_security_groups', 'list')
+    polling_profile = 'fast'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(NetworkSecurityGroup, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, network_security_group_name):
         self.logger.info(
@@ -53,8 +54,9 @@ class NetworkSecurityGroup(AzureResource):
                 resource_group_name=group_name,
                 network_security_group_name=network_security_group_name,
                 parameters=params,
+                **self.lro_kwargs
             )
-        async_nsg_creation.wait()
+        self.wait_for_lro(async_nsg_creation)
         network_security_group = async_nsg_creation.result().as_dict()
         self.logger.info(
             'create network_security_group result: {0}'.format(
@@ -69,9 +71,10 @@ class NetworkSecurityGroup(AzureResource):
         delete_async_operation = \
             self.client.network_security_groups.begin_delete(
                 resource_group_name=group_name,
-                network_security_group_name=network_security_group_name
+                network_security_group_name=network_security_group_name,
+                **self.lro_kwargs
             )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted network_security_group {0}'.format(
                 network_security_group_name))
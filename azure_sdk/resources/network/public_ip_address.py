@@ -20,14 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class PublicIPAddress(AzureResource):
+    name_list_operation = ('public_ip_addresses', 'list')
+    polling_profile = 'fast'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(PublicIPAddress, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, public_ip_address_name):
         self.logger.info(
@@ -50,8 +51,9 @@ class PublicIPAddress(AzureResource):
                 resource_group_name=group_name,
                 public_ip_address_name=public_ip_address_name,
                 parameters=params,
+                **self.lro_kwargs
             )
-        async_public_ip_address_creation.wait()
+        self.wait_for_lro(async_public_ip_address_creation)
         public_ip_address = async_public_ip_address_creation.result().as_dict()
         self.logger.info(
             'create public_ip_address result: {0}'.format(
@@ -63,8 +65,9 @@ class PublicIPAddress(AzureResource):
             "Deleting public_ip_address...{0}".format(public_ip_address_name))
         delete_async_operation = self.client.public_ip_addresses.begin_delete(
             resource_group_name=group_name,
-            public_ip_address_name=public_ip_address_name
+            public_ip_address_name=public_ip_address_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted public_ip_address {0}'.format(public_ip_address_name))
@@ -20,14 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class Route(AzureResource):
+    name_list_operation = ('routes', 'list')
+    polling_profile = 'fast'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(Route, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, route_table_name, route_name):
         self.logger.info("Get route...{0}".format(route_name))
@@ -20,14 +20,15 @@ from azure_sdk.common import AzureResource
 
 
 class Subnet(AzureResource):
+    name_list_operation = ('subnets', 'list')
+    polling_profile = 'fast'
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(Subnet, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, virtual_network_name, subnet_name):
         self.logger.info("Get subnet...{0}".format(subnet_name))
@@ -48,8 +49,9 @@ class Subnet(AzureResource):
             virtual_network_name=vnet_name,
             subnet_name=subnet_name,
             subnet_parameters=params,
+            **self.lro_kwargs
         )
-        async_subnet_creation.wait()
+        self.wait_for_lro(async_subnet_creation)
         subnet = async_subnet_creation.result().as_dict()
         self.logger.info(
             'create subnet result: {0}'.format(
@@ -61,7 +63,8 @@ class Subnet(AzureResource):
         delete_async_operation = self.client.subnets.begin_delete(
             resource_group_name=group_name,
             virtual_network_name=vnet_name,
-            subnet_name=subnet_name
+            subnet_name=subnet_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug('Deleted subnet {0}'.format(subnet_name))
@@ -20,14 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class VirtualNetwork(AzureResource):
+    name_list_operation = ('virtual_networks', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_NETWORK):
         super(VirtualNetwork, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            NetworkManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            NetworkManagementClient, api_version=api_version)
 
     def get(self, group_name, virtual_network_name):
         self.logger.info(
@@ -50,8 +50,9 @@ class VirtualNetwork(AzureResource):
                 resource_group_name=group_name,
                 virtual_network_name=virtual_network_name,
                 parameters=params,
+                **self.lro_kwargs
             )
-        async_vnet_creation.wait()
+        self.wait_for_lro(async_vnet_creation)
         virtual_network = async_vnet_creation.result().as_dict()
         self.logger.info(
             'create virtual_network result: {0}'.format(
@@ -63,8 +64,9 @@ class VirtualNetwork(AzureResource):
             "Deleting virtual_network...{0}".format(virtual_network_name))
         delete_async_operation = self.client.virtual_networks.begin_delete(
             resource_group_name=group_name,
-            virtual_network_name=virtual_network_name
+            virtual_network_name=virtual_network_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted virtual_network {0}'.format(virtual_network_name))
@@ -0,0 +1,211 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from azure.core.rest import HttpRequest
+from azure.core.configuration import Configuration
+from azure.core.pipeline import policies
+from azure.mgmt.core import ARMPipelineClient
+from azure.mgmt.core.policies import ARMChallengeAuthenticationPolicy
+
+from cloudify_azure import constants
+from azure_sdk.common import AzureResource
+
+RESOURCE_GRAPH_URL = 'https://management.azure.com'
+RESOURCE_GRAPH_PATH = '/providers/Microsoft.ResourceGraph/resources'
+
+
+class ResourceGraphClient(object):
+    """A minimal client for the Resource Graph query API, built on the
+    same ARM pipeline as the management SDK clients, so that it shares the
+    client pool, the HTTP transport and the request throttle.
+    """
+
+    def __init__(self,
+                 credential,
+                 subscription_id,
+                 api_version=constants.API_VER_RESOURCE_GRAPH,
+                 base_url=RESOURCE_GRAPH_URL,
+                 **kwargs):
+        self.subscription_id = subscription_id
+        self.api_version = api_version
+        config = Configuration(**kwargs)
+        config.headers_policy = policies.HeadersPolicy(**kwargs)
+        config.user_agent_policy = policies.UserAgentPolicy(
+            sdk_moniker='cloudify-azure-plugin', **kwargs)
+        config.proxy_policy = policies.ProxyPolicy(**kwargs)
+        config.logging_policy = policies.NetworkTraceLoggingPolicy(**kwargs)
+        config.retry_policy = policies.RetryPolicy(**kwargs)
+        config.redirect_policy = policies.RedirectPolicy(**kwargs)
+        config.authentication_policy = ARMChallengeAuthenticationPolicy(
+            credential, base_url + '/.default', **kwargs)
+        self._client = ARMPipelineClient(
+            base_url=base_url, config=config, **kwargs)
+
+    def resources(self, body):
+        """Run one Resource Graph query request and return the parsed
+        response, raising HttpResponseError on failure.
+        """
+        request = HttpRequest(
+            'POST',
+            RESOURCE_GRAPH_PATH,
+            params={'api-version': self.api_version},
+            json=body)
+        request.url = self._client.format_url(request.url)
+        response = self._client.send_request(request)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self._client.close()
+
+
+def quote(value):
+    return "'{0}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+
+
+def datetime_literal(value):
+    """A KQL datetime literal of an ISO 8601 time."""
+    if not re.match(r'^[0-9T:.+\-Z ]+$', value):
+        raise ValueError('Not an ISO 8601 time: {0}'.format(value))
+    return 'datetime({0})'.format(value)
+
+
+def build_query(resource_types,
+                locations=None,
+                projection=None,
+                changed_since=None):
+    """Build a KQL query over the Resources table.
+
+    :param resource_types: List of types,
+        i.e. Microsoft.ContainerService/ManagedClusters.
+    :param locations: List of locations to filter on, or all locations.
+    :param projection: List of columns to return, or all columns.
+    :param changed_since: Only return the resources that changed after this
+        ISO 8601 time.
+    :return: The query string.
+    """
+    query = ['Resources']
+    query.append('where type in~ ({0})'.format(
+        ', '.join(quote(t) for t in resource_types)))
+    if locations:
+        query.append('where location in~ ({0})'.format(
+            ', '.join(quote(loc) for loc in locations)))
+    if changed_since:
+        query.append('where changedTime > {0}'.format(
+            datetime_literal(changed_since)))
+    if projection:
+        query.append('project {0}'.format(', '.join(projection)))
+    return ' | '.join(query)
+
+
+class ResourceGraph(AzureResource):
+    # Query results are not a single resource and change between calls.
+    cached_reads = ()
+
+    def __init__(self, azure_config, logger,
+                 api_version=constants.API_VER_RESOURCE_GRAPH):
+        super(ResourceGraph, self).__init__(azure_config)
+        self.logger = logger
+        self.client = self.get_management_client(
+            ResourceGraphClient, api_version)
+
+    def query(self,
+              query,
+              subscriptions=None,
+              page_size=constants.RESOURCE_GRAPH_PAGE_SIZE):
+        """Run a KQL query, following the skip token across pages.
+
+        :param query: The KQL query.
+        :param subscriptions: List of subscriptions to query, by default the
+            subscription of the client config.
+        :param page_size: Rows per page.
+        :return: A generator of result rows as dicts.
+        """
+        self.logger.info('Querying resource graph: {0}'.format(query))
+        body = {
+            'query': query,
+            'subscriptions': subscriptions or [self.subscription_id],
+            'options': {'resultFormat': 'objectArray', '$top': page_size},
+        }
+        while True:
+            result = self.client.resources(body)
+            for row in result.get('data', []):
+                yield row
+            skip_token = result.get('$skipToken')
+            if not skip_token:
+                break
+            body['options']['$skipToken'] = skip_token
+
+    def list_resources(self,
+                       resource_types,
+                       locations=None,
+                       subscriptions=None,
+                       projection=None,
+                       changed_since=None):
+        """Find all resources of the given types with one paged query.
+
+        :param resource_types: List of resource types,
+            i.e. Microsoft.ContainerService/ManagedClusters.
+        :param locations: List of locations to filter on.
+        :param subscriptions: List of subscriptions to query.
+        :param projection: List of columns to return, see
+            RESOURCE_GRAPH_PROJECTION. id, type and location are always
+            returned, and changedTime with changed_since.
+        :param changed_since: Only find the resources that changed after
+            this ISO 8601 time.
+        :return: A generator of result rows as dicts.
+        """
+        projection = list(projection or constants.RESOURCE_GRAPH_PROJECTION)
+        columns = ['id', 'type', 'location']
+        if changed_since:
+            columns.append('changedTime')
+        for column in columns:
+            if column not in projection:
+                projection.append(column)
+        return self.query(
+            build_query(resource_types, locations, projection, changed_since),
+            subscriptions=subscriptions)
+
+    def list_resource_ids(self,
+                          resource_types,
+                          locations=None,
+                          subscriptions=None):
+        """Find the IDs of all resources of the given types, which is
+        cheaper than listing them.
+
+        :return: A generator of resource IDs.
+        """
+        query = build_query(resource_types, locations, ['id'])
+        for row in self.query(query, subscriptions=subscriptions):
+            yield row['id']
+
+    def count_resources(self,
+                        resource_types,
+                        locations=None,
+                        subscriptions=None):
+        """Count the resources of the given types, which is much cheaper
+        than listing them.
+
+        :return: A dict of (subscription ID, lower case resource type,
+            location) to the number of resources.
+        """
+        query = '{0} | summarize total = count() ' \
+            'by subscriptionId, type, location'.format(
+                build_query(resource_types, locations))
+        return dict(((row['subscriptionId'], row['type'].lower(),
+                      row['location']), row['total'])
+                    for row in self.query(query, subscriptions=subscriptions))
@@ -20,14 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class ResourceGroup(AzureResource):
+    name_list_operation = ('resource_groups', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_RESOURCES):
         self.logger = logger
         super(ResourceGroup, self).__init__(azure_config)
-        self.client = \
-            ResourceManagementClient(self.credentials, self.subscription_id,
-                                     api_version=api_version)
+        self.client = self.get_management_client(
+            ResourceManagementClient, api_version=api_version)
 
     def get(self, group_name):
         self.logger.info("Get resource_group...{0}".format(group_name))
@@ -53,9 +53,10 @@ class ResourceGroup(AzureResource):
     def delete(self, group_name):
         self.logger.info("Deleting resource_group...{0}".format(group_name))
         delete_async_operation = self.client.resource_groups.begin_delete(
-            resource_group_name=group_name
+            resource_group_name=group_name,
+            **self.lro_kwargs
         )
-        delete_async_operation.wait()
+        self.wait_for_lro(delete_async_operation)
         self.logger.debug(
             'Deleted resource_group {0}'.format(group_name))
 
@@ -71,7 +72,8 @@ class ResourceGroup(AzureResource):
         resources_list = [{'id': resource.id,
                            'created_time': resource.created_time,
                            'changed_time': resource.changed_time,
-                           'provisioning_state': resource.provisioning_state}
+                           'provisioning_state': resource.provisioning_state,
+                           'managed_by': resource.managed_by}
                           for resource in resources_list_iter]
         self.logger.info('List resources of resource group {0}'
                          ' result: {1}'.format(group_name, resources_list))
@@ -5,14 +5,14 @@ from azure_sdk.common import AzureResource
 
 
 class FileShare(AzureResource):
+    name_list_operation = ('file_shares', 'list')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_STORAGE_FILE_SHARE):
         super(FileShare, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            StorageManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            StorageManagementClient, api_version=api_version)
 
     def get(self, group_name, account_name, share_name):
         self.logger.info("Get File Share...{0}".format(share_name))
@@ -20,14 +20,14 @@ from azure_sdk.common import AzureResource
 
 
 class StorageAccount(AzureResource):
+    name_list_operation = ('storage_accounts', 'list_by_resource_group')
 
     def __init__(self, azure_config, logger,
                  api_version=constants.API_VER_STORAGE):
         super(StorageAccount, self).__init__(azure_config)
         self.logger = logger
-        self.client = \
-            StorageManagementClient(self.credentials, self.subscription_id,
-                                    api_version=api_version)
+        self.client = self.get_management_client(
+            StorageManagementClient, api_version=api_version)
 
     def get(self, group_name, account_name):
         self.logger.info("Get Storage Account...{0}".format(account_name))
@@ -47,15 +47,30 @@ class StorageAccount(AzureResource):
             self.client.storage_accounts.begin_create(
                 resource_group_name=group_name,
                 account_name=account_name,
-                parameters=parameters
+                parameters=parameters,
+                **self.lro_kwargs
             )
-        async_storage_account_creation.wait()
+        self.wait_for_lro(async_storage_account_creation)
         storage_account = async_storage_account_creation.result().as_dict()
         self.logger.info(
             'storage_account : {0}'.format(
                 utils.secure_logging_content(storage_account)))
         return storage_account
 
+    def check_name_availability(self, account_name):
+        self.logger.info(
+            "Check Storage Account name availability...{0}".format(
+                account_name))
+        result = self.client.storage_accounts.check_name_availability(
+            account_name={
+                'name': account_name,
+                'type': 'Microsoft.Storage/storageAccounts'
+            })
+        self.logger.debug(
+            'Storage Account name {0} available: {1}'.format(
+                account_name, result.name_available))
+        return result.name_available
+
     def create_or_update(self, *args, **kwargs):
         return self.create(*args, **kwargs)
 
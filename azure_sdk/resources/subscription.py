@@ -0,0 +1,51 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from azure.mgmt.resource import SubscriptionClient
+
+from cloudify_azure import constants
+from azure_sdk.common import AzureResource
+
+
+def subscription_client(credential, subscription_id, **kwargs):
+    # Unlike the other management clients, SubscriptionClient is not bound
+    # to a subscription.
+    return SubscriptionClient(credential, **kwargs)
+
+
+class Subscription(AzureResource):
+
+    def __init__(self, azure_config, logger,
+                 api_version=constants.API_VER_SUBSCRIPTIONS):
+        super(Subscription, self).__init__(azure_config)
+        self.logger = logger
+        self.client = self.get_management_client(
+            subscription_client, api_version)
+
+    def list_locations(self, subscription_id=None):
+        """List the names of the physical locations that a subscription
+        can use.
+        """
+        subscription_id = subscription_id or self.subscription_id
+        self.logger.info(
+            "Listing locations of subscription...{0}".format(subscription_id))
+        locations = []
+        for location in self.client.subscriptions.list_locations(
+                subscription_id):
+            metadata = getattr(location, 'metadata', None)
+            if getattr(metadata, 'region_type', None) == 'Logical':
+                continue
+            locations.append(location.name)
+        return locations
@@ -0,0 +1,345 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+
+from mock import patch, MagicMock
+from azure.core.exceptions import HttpResponseError
+from unittest import TestCase
+
+from cloudify.state import current_ctx
+from cloudify.mocks import MockCloudifyContext
+
+from .. import common
+from ..resources.network.subnet import Subnet
+from ..resources.subscription import Subscription
+from ..resources.compute import virtual_machine
+from ..resources.resource_group import ResourceGroup
+
+
+class TestCredentialCache(TestCase):
+
+    def setUp(self):
+        common.credentials_cache.clear()
+        self.azure_config = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_shared_credentials(self, credential, *_):
+        first = common.AzureResource(self.azure_config)
+        second = common.AzureResource(self.azure_config)
+        self.assertIs(first.credentials, second.credentials)
+        credential.assert_called_once_with(
+            tenant_id='dummy', client_id='dummy', client_secret='dummy')
+        self.azure_config['client_secret'] = 'rotated'
+        third = common.AzureResource(self.azure_config)
+        self.assertEqual(credential.call_count, 2)
+        self.assertNotEqual(
+            first._credentials_key, third._credentials_key)
+        self.assertNotIn('rotated', str(third._credentials_key))
+
+    @patch('azure_sdk.common.time')
+    def test_ttl_eviction(self, mock_time, *_):
+        cache = common.CredentialCache(ttl=10)
+        factory = MagicMock(side_effect=['first', 'second'])
+        mock_time.time.return_value = 100
+        self.assertEqual(cache.get('key', factory), 'first')
+        mock_time.time.return_value = 105
+        self.assertEqual(cache.get('key', factory), 'first')
+        mock_time.time.return_value = 110
+        self.assertEqual(cache.get('key', factory), 'second')
+        self.assertEqual(factory.call_count, 2)
+
+
+class TestClientPool(TestCase):
+
+    def test_lru_and_stats(self):
+        pool = common.ClientPool(maxsize=2)
+        clients = [MagicMock(), MagicMock(), MagicMock()]
+        factory = MagicMock(side_effect=clients)
+        self.assertIs(pool.get('a', factory), clients[0])
+        self.assertIs(pool.get('b', factory), clients[1])
+        self.assertIs(pool.get('a', factory), clients[0])
+        # b is the least recently used client, so it is evicted.
+        self.assertIs(pool.get('c', factory), clients[2])
+        self.assertEqual(
+            pool.stats(),
+            {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 3,
+             'evictions': 1})
+        pool.close_all()
+        clients[0].close.assert_called_once_with()
+        clients[1].close.assert_not_called()
+        clients[2].close.assert_called_once_with()
+        self.assertEqual(pool.stats()['size'], 0)
+
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_shared_management_client(self, *_):
+        azure_config = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+        client_class = MagicMock(side_effect=lambda *_, **__: MagicMock())
+        first = common.AzureResource(azure_config)
+        second = common.AzureResource(azure_config)
+        self.assertIs(
+            first.get_management_client(client_class, '2020-01-01'),
+            second.get_management_client(client_class, '2020-01-01'))
+        self.assertIsNot(
+            first.get_management_client(client_class, '2020-01-01'),
+            second.get_management_client(client_class))
+        self.assertEqual(client_class.call_count, 2)
+
+
+class TestSharedHttpTransport(TestCase):
+
+    def test_shared_transport(self):
+        transport = common.get_http_transport(4, 8, 60)
+        self.assertIs(transport, common.get_http_transport(4, 8, 60))
+        self.assertIsNot(transport, common.get_http_transport(4, 16, 60))
+        adapter = transport.session.get_adapter('https://management.azure.com')
+        self.assertEqual(adapter._pool_connections, 4)
+        self.assertEqual(adapter._pool_maxsize, 8)
+
+    @patch('azure_sdk.common.time')
+    def test_reap_idle_connections(self, mock_time):
+        mock_time.time.return_value = 100
+        transport = common.SharedHttpTransport(idle_timeout=60)
+        adapter = MagicMock()
+        transport.session.adapters = {'https://': adapter}
+        mock_time.time.return_value = 150
+        self.assertFalse(transport.reap_idle_connections())
+        adapter.poolmanager.clear.assert_not_called()
+        mock_time.time.return_value = 161
+        self.assertTrue(transport.reap_idle_connections())
+        adapter.poolmanager.clear.assert_called_once_with()
+
+
+class TestNonBlockingOperations(TestCase):
+
+    def test_single_status_check(self):
+        polling = common.SingleCheckARMPolling()
+        with patch.object(polling, 'finished', return_value=False), \
+                patch.object(polling, 'update_status') as update_status:
+            polling.run()
+        update_status.assert_called_once_with()
+
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_wait_for_lro(self, *_):
+        resource = common.AzureResource({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        })
+        poller = MagicMock()
+        self.assertIsInstance(
+            resource.lro_kwargs['polling'], common.AdaptiveARMPolling)
+        resource.wait_for_lro(poller, timeout=10)
+        poller.wait.assert_called_once_with(timeout=10)
+
+        resource.non_blocking = True
+        resource.continuation_token = 'token'
+        kwargs = resource.lro_kwargs
+        self.assertIsInstance(
+            kwargs['polling'], common.SingleCheckARMPolling)
+        self.assertEqual(kwargs['continuation_token'], 'token')
+        poller.polling_method().finished.return_value = False
+        poller.continuation_token.return_value = 'next'
+        with self.assertRaises(common.LongRunningOperationPending) as e:
+            resource.wait_for_lro(poller)
+        self.assertEqual(e.exception.continuation_token, 'next')
+        poller.polling_method().finished.return_value = True
+        self.assertIs(resource.wait_for_lro(poller), poller)
+
+
+class TestOperationCache(TestCase):
+
+    @patch('azure_sdk.resources.resource_group.ResourceManagementClient')
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_read_through(self, _, client):
+        resource_group = ResourceGroup({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }, MagicMock())
+        client().resource_groups.get().as_dict.return_value = {'id': 'foo'}
+        get = client().resource_groups.get
+        get.reset_mock()
+
+        # Outside of an operation nothing is cached.
+        resource_group.get('foo')
+        resource_group.get('foo')
+        self.assertEqual(get.call_count, 2)
+
+        ctx = MockCloudifyContext()
+        current_ctx.set(ctx)
+        self.addCleanup(current_ctx.clear)
+        get.reset_mock()
+        result = resource_group.get('foo')
+        result['id'] = 'changed'
+        self.assertEqual(resource_group.get('foo'), {'id': 'foo'})
+        resource_group.get('bar')
+        self.assertEqual(get.call_count, 2)
+        resource_group.delete('foo')
+        resource_group.get('foo')
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(
+            common.operation_cache.stats(ctx),
+            {'size': 1, 'hits': 1, 'misses': 3})
+
+
+class TestAdaptivePolling(TestCase):
+
+    @patch('azure_sdk.common.random')
+    def test_backoff(self, mock_random):
+        mock_random.uniform.return_value = 1
+        polling = common.AdaptiveARMPolling(2, 10, backoff=2)
+        polling._pipeline_response = MagicMock()
+        polling._pipeline_response.http_response.headers = {}
+        self.assertEqual(
+            [polling._extract_delay() for _ in range(4)], [2, 4, 8, 10])
+        polling._pipeline_response.http_response.headers = {
+            'Retry-After': '25'}
+        self.assertEqual(polling._extract_delay(), 25)
+
+    @patch('azure_sdk.resources.network.subnet.NetworkManagementClient')
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_polling_profile(self, *_):
+        subnet = Subnet({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }, MagicMock())
+        polling = subnet.get_polling_method()
+        self.assertEqual(
+            (polling._initial_delay, polling._max_delay),
+            common.constants.POLLING_PROFILES['fast'])
+        subnet.retry_after = 42
+        polling = subnet.get_polling_method()
+        self.assertEqual((polling._initial_delay, polling._max_delay),
+                         (42, 42))
+
+
+class TestSubscription(TestCase):
+
+    @patch('azure_sdk.resources.subscription.SubscriptionClient')
+    @patch('azure_sdk.common.ClientSecretCredential')
+    def test_list_locations(self, credential, client):
+        subscription = Subscription({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }, MagicMock())
+        self.assertEqual(
+            client.call_args[1]['api_version'],
+            common.constants.API_VER_SUBSCRIPTIONS)
+        eastus = MagicMock()
+        eastus.name = 'eastus'
+        eastus.metadata.region_type = 'Physical'
+        global_location = MagicMock()
+        global_location.name = 'global'
+        global_location.metadata.region_type = 'Logical'
+        client().subscriptions.list_locations.return_value = [
+            eastus, global_location]
+        self.assertEqual(subscription.list_locations(), ['eastus'])
+        client().subscriptions.list_locations.assert_called_once_with(
+            'dummy')
+
+
+@patch('azure_sdk.resources.compute.virtual_machine.ComputeManagementClient')
+@patch('azure_sdk.common.ClientSecretCredential')
+class TestPowerState(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        patcher = patch.object(
+            virtual_machine.power_state_cache, 'cache_dir', cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.azure_config = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+
+    def test_cached_power_state(self, _, client):
+        vm = virtual_machine.VirtualMachine(self.azure_config, MagicMock())
+        client().virtual_machines.instance_view().as_dict.return_value = {
+            'statuses': [{'code': 'ProvisioningState/succeeded'},
+                         {'code': 'PowerState/running'}]}
+        instance_view = client().virtual_machines.instance_view
+        instance_view.reset_mock()
+        other_vm = virtual_machine.VirtualMachine(
+            self.azure_config, MagicMock())
+        self.assertEqual(vm.get_power_state('rg', 'vm'),
+                         'PowerState/running')
+        self.assertEqual(other_vm.get_power_state('RG', 'vm'),
+                         'PowerState/running')
+        instance_view.assert_called_once_with(
+            resource_group_name='rg', vm_name='vm')
+        vm.power_off('rg', 'vm')
+        vm.get_power_state('rg', 'vm')
+        self.assertEqual(instance_view.call_count, 2)
+
+    def test_power_states(self, _, client):
+        vm = virtual_machine.VirtualMachine(self.azure_config, MagicMock())
+        listed = MagicMock()
+        listed.as_dict.return_value = {
+            'id': '/subscriptions/dummy/resourceGroups/RG/providers/'
+                  'Microsoft.Compute/virtualMachines/vm1',
+            'name': 'vm1',
+            'instance_view': {'statuses': [{'code': 'PowerState/stopped'}]}}
+        client().virtual_machines.list_all.return_value = [listed]
+        self.assertEqual(
+            vm.get_power_states([('rg', 'vm1'), ('rg', 'vm2')]),
+            {('rg', 'vm1'): 'PowerState/stopped', ('rg', 'vm2'): None})
+        client().virtual_machines.list_all.assert_called_once_with(
+            status_only='true')
+
+        # The listed states are cached in files, so other processes read
+        # them too, and fresh states are not listed again.
+        cache = virtual_machine.PowerStateCache(
+            virtual_machine.power_state_cache.cache_dir)
+        self.assertEqual(cache.get(('dummy', 'rg', 'vm1')),
+                         'PowerState/stopped')
+        self.assertEqual(
+            vm.get_power_states([('RG', 'VM1')]),
+            {('RG', 'VM1'): 'PowerState/stopped'})
+        client().virtual_machines.list_all.assert_called_once()
+        cache.invalidate(('dummy', 'rg', 'vm1'))
+        self.assertIsNone(
+            virtual_machine.power_state_cache.get(('dummy', 'rg', 'vm1')))
+
+        # Without status only listing, each instance view is read.
+        virtual_machine.power_state_cache.clear()
+        client().virtual_machines.list_all.side_effect = \
+            HttpResponseError('unsupported')
+        client().virtual_machines.instance_view().as_dict.return_value = {
+            'statuses': [{'code': 'PowerState/running'}]}
+        self.assertEqual(
+            vm.get_power_states([('rg', 'vm1')]),
+            {('rg', 'vm1'): 'PowerState/running'})
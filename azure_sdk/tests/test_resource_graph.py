@@ -0,0 +1,111 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+
+import requests_mock
+from mock import patch, MagicMock
+from unittest import TestCase
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import HttpResponseError
+
+from ..resources import resource_graph
+
+GRAPH_URL = resource_graph.RESOURCE_GRAPH_URL + \
+    resource_graph.RESOURCE_GRAPH_PATH
+
+
+class TestResourceGraph(TestCase):
+
+    def setUp(self):
+        credential = MagicMock(spec=['get_token'])
+        credential.get_token.return_value = AccessToken('token', 2 ** 40)
+        patcher = patch('azure_sdk.common.ClientSecretCredential',
+                        return_value=credential)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.graph = resource_graph.ResourceGraph({
+            'client_id': 'graph',
+            'client_secret': 'graph',
+            'subscription_id': 'sub1',
+            'tenant_id': 'graph',
+            'arm_throttle': False
+        }, logging.getLogger('unit_test_logger'))
+
+    def test_build_query(self):
+        self.assertEqual(
+            resource_graph.build_query(
+                ['Microsoft.Compute/virtualMachines'],
+                ['eastus', "west'us"],
+                ['id', 'name']),
+            "Resources | where type in~ ('Microsoft.Compute/virtualMachines')"
+            " | where location in~ ('eastus', 'west\\'us')"
+            " | project id, name")
+        self.assertEqual(
+            resource_graph.build_query(
+                ['Microsoft.Compute/virtualMachines'],
+                changed_since='2022-01-01T00:00:00Z'),
+            "Resources | where type in~ ('Microsoft.Compute/virtualMachines')"
+            " | where changedTime > datetime(2022-01-01T00:00:00Z)")
+        with self.assertRaises(ValueError):
+            resource_graph.build_query(
+                ['Microsoft.Compute/virtualMachines'],
+                changed_since="') | foo")
+
+    def test_paged_query(self):
+        pages = [
+            {'data': [{'id': 'vm1'}, {'id': 'vm2'}], '$skipToken': 'next'},
+            {'data': [{'id': 'vm3'}]},
+        ]
+        with requests_mock.Mocker() as m:
+            m.post(GRAPH_URL, [{'json': page} for page in pages])
+            rows = list(self.graph.list_resources(
+                ['Microsoft.Compute/virtualMachines'],
+                subscriptions=['sub1', 'sub2'],
+                projection=['name']))
+        self.assertEqual(rows, [{'id': 'vm1'}, {'id': 'vm2'}, {'id': 'vm3'}])
+        self.assertEqual(m.call_count, 2)
+        first, second = [json.loads(r.body) for r in m.request_history]
+        self.assertEqual(
+            first['query'],
+            "Resources | where type in~ ('Microsoft.Compute/virtualMachines')"
+            " | project name, id, type, location")
+        self.assertEqual(first['subscriptions'], ['sub1', 'sub2'])
+        self.assertNotIn('$skipToken', first['options'])
+        self.assertEqual(second['options']['$skipToken'], 'next')
+        self.assertEqual(
+            m.request_history[0].qs['api-version'], ['2021-03-01'])
+        self.assertEqual(
+            m.request_history[0].headers['Authorization'], 'Bearer token')
+
+    def test_count_resources(self):
+        with requests_mock.Mocker() as m:
+            m.post(GRAPH_URL, json={'data': [
+                {'subscriptionId': 'sub1', 'location': 'eastus',
+                 'type': 'microsoft.compute/virtualmachines', 'total': 3}]})
+            counts = self.graph.count_resources(
+                ['Microsoft.Compute/virtualMachines'], ['eastus', 'westus'])
+        self.assertEqual(counts, {
+            ('sub1', 'microsoft.compute/virtualmachines', 'eastus'): 3})
+        self.assertIn('summarize total = count() by subscriptionId, type, '
+                      'location', json.loads(m.last_request.body)['query'])
+
+    def test_query_error(self):
+        with requests_mock.Mocker() as m:
+            m.post(GRAPH_URL, status_code=400, json={
+                'error': {'code': 'BadRequest', 'message': 'bad query'}})
+            with self.assertRaises(HttpResponseError):
+                list(self.graph.query('Resources | foo'))
@@ -0,0 +1,94 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+from mock import patch, MagicMock
+from unittest import TestCase
+
+from .. import throttle
+
+
+class TestThrottleGovernor(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        self.governor = throttle.ThrottleGovernor(
+            self.state_dir, {'reads': (2, 1), 'writes': (1, 0.5)})
+
+    @patch('azure_sdk.throttle.time')
+    def test_acquire(self, mock_time):
+        mock_time.time.return_value = 100
+        self.assertEqual(self.governor.acquire('sub', 'reads'), 0)
+        self.assertEqual(self.governor.acquire('sub', 'reads'), 0)
+        self.assertEqual(self.governor.levels(),
+                         {'sub': {'reads': 0, 'writes': 1}})
+
+        def sleep(delay):
+            mock_time.time.return_value += delay
+        mock_time.sleep.side_effect = sleep
+        self.assertEqual(self.governor.acquire('sub', 'reads'), 1)
+        self.assertEqual(self.governor.acquire('sub', 'writes'), 0)
+        self.assertEqual(self.governor.acquire('sub', 'writes'), 2)
+
+    @patch('azure_sdk.throttle.time')
+    def test_shared_state(self, mock_time):
+        mock_time.time.return_value = 100
+        self.governor.update('sub', 'reads', 0)
+        other = throttle.ThrottleGovernor(
+            self.state_dir, {'reads': (2, 1), 'writes': (1, 0.5)})
+        self.assertEqual(other.levels()['sub']['reads'], 0)
+        mock_time.time.return_value = 101.5
+        self.assertEqual(other.levels()['sub']['reads'], 1.5)
+
+
+class TestThrottlePolicy(TestCase):
+
+    @staticmethod
+    def _request(method, url):
+        request = MagicMock()
+        request.http_request.method = method
+        request.http_request.url = url
+        return request
+
+    def test_policy(self):
+        governor = MagicMock()
+        policy = throttle.ThrottlePolicy(governor)
+        request = self._request(
+            'PUT', 'https://management.azure.com/subscriptions/sub/'
+                   'resourceGroups/rg?api-version=2020-01-01')
+        response = MagicMock()
+        response.http_response.status_code = 200
+        response.http_response.headers = {
+            'x-ms-ratelimit-remaining-subscription-writes': '42'}
+        policy.on_request(request)
+        policy.on_response(request, response)
+        governor.acquire.assert_called_once_with('sub', 'writes')
+        governor.update.assert_called_once_with('sub', 'writes', '42')
+
+        response.http_response.status_code = 429
+        response.http_response.headers = {}
+        request = self._request(
+            'GET', 'https://management.azure.com/subscriptions/sub/providers')
+        policy.on_response(request, response)
+        governor.update.assert_called_with('sub', 'reads', 0)
+
+        governor.reset_mock()
+        request = self._request('GET', 'https://login.microsoftonline.com/')
+        policy.on_request(request)
+        policy.on_response(request, response)
+        governor.acquire.assert_not_called()
+        governor.update.assert_not_called()
@@ -0,0 +1,173 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows agents only share the budget in process.
+    fcntl = None
+
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+
+from cloudify_azure import constants
+
+SUBSCRIPTION_PATTERN = re.compile(r'/subscriptions/([^/?]+)', re.IGNORECASE)
+REMAINING_HEADERS = {
+    'reads': 'x-ms-ratelimit-remaining-subscription-reads',
+    'writes': 'x-ms-ratelimit-remaining-subscription-writes',
+}
+
+
+class ThrottleGovernor(object):
+    """
+        Token buckets of ARM request budget, per subscription and request
+        kind (reads or writes).
+
+        The buckets of a subscription are kept in a locked file, so every
+        worker process on the host draws from the same budget. They refill
+        at the rate ARM restores budget, and are synced with the remaining
+        budget ARM reports on every response, which also accounts for other
+        clients of the subscription.
+    """
+
+    def __init__(self,
+                 state_dir=constants.THROTTLE_STATE_DIR,
+                 buckets=None):
+        self.state_dir = state_dir
+        self.buckets = buckets or constants.THROTTLE_BUCKETS
+        self._lock = threading.Lock()
+
+    def _path(self, subscription_id):
+        return os.path.join(self.state_dir, '{0}.json'.format(
+            re.sub(r'[^\w-]', '_', subscription_id)))
+
+    @contextmanager
+    def _state(self, subscription_id):
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir, exist_ok=True)
+        with self._lock, open(self._path(subscription_id), 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state, kind, now):
+        size, rate = self.buckets[kind]
+        bucket = state.setdefault(kind, {'tokens': size, 'updated': now})
+        elapsed = max(now - bucket['updated'], 0)
+        bucket['tokens'] = min(bucket['tokens'] + elapsed * rate, size)
+        bucket['updated'] = now
+        return bucket
+
+    def acquire(self, subscription_id, kind):
+        """
+            Takes a token from a bucket, waiting until one is available.
+
+        :param subscription_id: The Azure subscription ID.
+        :param kind: reads or writes.
+        :returns: The number of seconds waited.
+        """
+        waited = 0
+        while True:
+            with self._state(subscription_id) as state:
+                bucket = self._refill(state, kind, time.time())
+                if bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return waited
+                delay = (1 - bucket['tokens']) / self.buckets[kind][1]
+            time.sleep(delay)
+            waited += delay
+
+    def update(self, subscription_id, kind, remaining):
+        """Syncs a bucket with the remaining budget reported by ARM."""
+        size, _ = self.buckets[kind]
+        with self._state(subscription_id) as state:
+            bucket = self._refill(state, kind, time.time())
+            bucket['tokens'] = min(float(remaining), size)
+
+    def levels(self):
+        """
+            Returns the current bucket levels for monitoring, as
+            {subscription_id: {'reads': tokens, 'writes': tokens}}.
+        """
+        levels = {}
+        if not os.path.isdir(self.state_dir):
+            return levels
+        now = time.time()
+        for filename in sorted(os.listdir(self.state_dir)):
+            if not filename.endswith('.json'):
+                continue
+            subscription_id = filename[:-len('.json')]
+            with self._state(subscription_id) as state:
+                levels[subscription_id] = dict(
+                    (kind, self._refill(state, kind, now)['tokens'])
+                    for kind in self.buckets)
+        return levels
+
+
+class ThrottlePolicy(SansIOHTTPPolicy):
+    """
+        Pipeline policy that takes a token from the governor before each
+        request attempt and syncs the governor from each response.
+    """
+
+    def __init__(self, governor):
+        self.governor = governor
+
+    @staticmethod
+    def _get_scope(request):
+        match = SUBSCRIPTION_PATTERN.search(request.http_request.url)
+        if not match:
+            return None, None
+        kind = 'reads' if request.http_request.method in ('GET', 'HEAD') \
+            else 'writes'
+        return match.group(1), kind
+
+    def on_request(self, request):
+        subscription_id, kind = self._get_scope(request)
+        if subscription_id:
+            self.governor.acquire(subscription_id, kind)
+
+    def on_response(self, request, response):
+        subscription_id, kind = self._get_scope(request)
+        if not subscription_id:
+            return
+        http_response = response.http_response
+        if http_response.status_code == 429:
+            self.governor.update(subscription_id, kind, 0)
+            return
+        remaining = http_response.headers.get(REMAINING_HEADERS[kind])
+        if remaining is not None:
+            self.governor.update(subscription_id, kind, remaining)
+
+
+governor = ThrottleGovernor()
+throttle_policy = ThrottlePolicy(governor)
@@ -36,6 +36,75 @@ CONN_API_ENDPOINT = 'https://management.azure.com'
 # az cloud # suffixes.storageEndpoint
 CONN_STORAGE_ENDPOINT = "core.windows.net"
 
+# Seconds a shared credential object is reused before it is rebuilt.
+CREDENTIALS_CACHE_TTL = 3000
+# Virtual machine power states are cached in a file per virtual machine in
+# POWER_STATE_CACHE_DIR, and shared by the operations and workflows that
+# poll them for POWER_STATE_CACHE_TTL seconds.
+POWER_STATE_CACHE_DIR = '/tmp/cloudify_azure_power_states'
+POWER_STATE_CACHE_TTL = 5
+# Maximum number of management clients kept in the shared client pool.
+CLIENT_POOL_SIZE = 64
+# Defaults for the keep-alive HTTP transport shared by management clients,
+# overridable with the http_pool_* client_config keys.
+HTTP_POOL_SIZE = 10
+HTTP_POOL_CONNECTIONS_PER_HOST = 32
+HTTP_POOL_IDLE_TIMEOUT = 240
+# Conditional (If-Match) updates that lost a race with another writer are
+# re-read and retried this many times, backing off from RMW_BACKOFF seconds.
+RMW_ATTEMPTS = 5
+RMW_BACKOFF = 1
+# Long running operation polling profiles, as (first delay, maximum delay)
+# between status checks in seconds. The delay grows by POLLING_BACKOFF with
+# each check and is randomized by +/- POLLING_JITTER. A Retry-After header
+# from Azure takes precedence.
+POLLING_PROFILES = {
+    'fast': (1, 10),
+    'default': (5, 30),
+    'slow': (15, 60),
+}
+POLLING_BACKOFF = 1.5
+POLLING_JITTER = 0.2
+# ARM request budget per subscription, as (bucket size, tokens restored per
+# second), kept in one file per subscription in THROTTLE_STATE_DIR so that
+# all worker processes on the host share it.
+THROTTLE_BUCKETS = {
+    'reads': (250, 25),
+    'writes': (200, 10),
+}
+THROTTLE_STATE_DIR = '/tmp/cloudify_azure_throttle'
+# Number of list calls, and of enricher calls per list call, that resource
+# discovery runs at the same time, how many listed resources may wait to be
+# consumed, and how many resources are written to a spill file at once.
+DISCOVERY_MAX_WORKERS = 8
+DISCOVERY_ENRICH_WORKERS = 8
+DISCOVERY_QUEUE_SIZE = 1000
+DISCOVERY_CHUNK_SIZE = 500
+# Child deployments of discovered resources are created in chunks of
+# DEPLOY_CHUNK_SIZE, DEPLOY_MAX_WORKERS chunks at a time. A failed chunk is
+# retried DEPLOY_ATTEMPTS times, backing off from DEPLOY_BACKOFF seconds.
+DEPLOY_CHUNK_SIZE = 50
+DEPLOY_MAX_WORKERS = 4
+DEPLOY_ATTEMPTS = 3
+DEPLOY_BACKOFF = 2
+# Maximum number of node instances that the parallel_install workflow
+# installs at the same time in one subscription.
+INSTALL_MAX_CONCURRENCY = 10
+# Maximum number of network interface cards that a virtual machine start
+# operation gets at the same time.
+NIC_RESOLVE_WORKERS = 4
+# The locations of each subscription are cached in a file per subscription
+# in LOCATIONS_CACHE_DIR for LOCATIONS_CACHE_TTL seconds.
+LOCATIONS_CACHE_DIR = '/tmp/cloudify_azure_locations'
+LOCATIONS_CACHE_TTL = 24 * 60 * 60
+# Rows per Resource Graph query page, the service maximum is 1000, and the
+# columns that discovery projects from the Resources table by default.
+RESOURCE_GRAPH_PAGE_SIZE = 1000
+RESOURCE_GRAPH_PROJECTION = [
+    'id', 'name', 'type', 'location', 'resourceGroup', 'subscriptionId',
+    'changedTime'
+]
+
 # API version constants
 # Each service has its own API version independent of any other services
 API_VER_RESOURCES = '2017-05-10'
@@ -48,10 +117,18 @@ API_VER_NETWORK_LB_BACKEND_PROBES = '2020-03-01'
 # ::check_if_configuration_changed props list,
 # according to api version.
 API_VER_COMPUTE = '2017-03-30'
+# The first compute API version with status only VM listing.
+API_VER_COMPUTE_STATUS = '2020-06-01'
+# The first compute API version with flexible orchestration scale sets.
+API_VER_COMPUTE_SCALE_SET = '2021-07-01'
+# The tag that maps a scale set Virtual Machine to its node instance.
+SCALE_SET_INSTANCE_TAG = 'cloudify_node_instance_id'
 API_VER_STORAGE_BLOB = '2015-12-11'
 API_VER_CONTAINER = '2017-07-01'
 API_VER_MANAGED_CLUSTER = '2018-03-31'
 API_VER_APP_SERVICE = '2019-08-01'
+API_VER_RESOURCE_GRAPH = '2021-03-01'
+API_VER_SUBSCRIPTIONS = '2019-11-01'
 
 # Node type constants
 VM_NODE_TYPE = \
@@ -62,7 +139,15 @@ LB_NODE_TYPE = \
      'cloudify.nodes.azure.network.LoadBalancer')
 NIC_NODE_TYPE = \
     ('cloudify.azure.nodes.network.NetworkInterfaceCard',
-     'cloudify.nodes.azure..network.NetworkInterfaceCard')
+     'cloudify.nodes.azure.network.NetworkInterfaceCard')
+PIP_NODE_TYPE = \
+    ('cloudify.azure.nodes.network.PublicIPAddress',
+     'cloudify.nodes.azure.network.PublicIPAddress')
+RG_NODE_TYPE = \
+    ('cloudify.azure.nodes.ResourceGroup',
+     'cloudify.nodes.azure.ResourceGroup')
+# Prefixes of the node types of this plugin.
+AZURE_NODE_TYPE_PREFIXES = ('cloudify.azure.nodes.', 'cloudify.nodes.azure.')
 # Relationship constants
 REL_CONTAINED_IN_RG = \
     ('cloudify.azure.relationships.contained_in_resource_group',
@@ -112,6 +197,9 @@ REL_CONNECTED_TO_LB_BE_POOL = \
 REL_CONNECTED_TO_LB_PROBE = \
     ('cloudify.azure.relationships.connected_to_lb_probe',
      'cloudify.relationships.azure.connected_to_lb_probe')
+REL_CONNECTED_TO_DATADISK = \
+    ('cloudify.azure.relationships.vm_connected_to_datadisk',
+     'cloudify.relationships.azure.vm_connected_to_datadisk')
 REL_VMX_CONTAINED_IN_VM = \
     ('cloudify.azure.relationships.vmx_contained_in_vm',
      'cloudify.relationships.azure.vmx_contained_in_vm')
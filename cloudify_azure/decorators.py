@@ -22,13 +22,14 @@ from functools import wraps
 
 from msrest.exceptions import ValidationError
 from msrestazure.azure_exceptions import CloudError
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 from cloudify import exceptions as cfy_exc
 from cloudify_common_sdk.utils import \
     skip_creative_or_destructive_operation as skip
 
 from . import utils, constants
+from azure_sdk.common import operation_cache
 from azure_sdk.resources.network.route import Route
 from azure_sdk.resources.network.subnet import Subnet
 from azure_sdk.resources.deployment import Deployment
@@ -59,55 +60,76 @@ def file_share_name_generator():
                    for i in range(random.randint(24, 63)))
 
 
+def generate_name(resource):
+    """Generates a random name that is valid for the resource type"""
+    # special naming handling
+    if isinstance(resource, StorageAccount):
+        return sa_name_generator()
+    elif isinstance(resource, FileShare):
+        return file_share_name_generator()
+    return "{0}".format(uuid4())
+
+
+def get_name_scope(resource, resource_group_name, **kwargs):
+    """
+        Returns the arguments of the resource's get call that identify
+        the scope its name must be unique in.
+    """
+    # handle speical cases
+    # resource_group
+    if isinstance(resource, ResourceGroup):
+        return []
+    # virtual_machine_extension
+    elif isinstance(resource, VirtualMachineExtension):
+        return [resource_group_name, kwargs['vm_name']]
+    # subnet
+    elif isinstance(resource, Subnet):
+        return [resource_group_name, kwargs['vnet_name']]
+    # route
+    elif isinstance(resource, Route):
+        return [resource_group_name, kwargs['rtbl_name']]
+    # network_security_rule
+    elif isinstance(resource, NetworkSecurityRule):
+        return [resource_group_name, kwargs['nsg_name']]
+    elif isinstance(resource, (LoadBalancerBackendAddressPool,
+                               LoadBalancerLoadBalancingRule,
+                               LoadBalancerInboundNatRule,
+                               LoadBalancerProbe)):
+        return [resource_group_name, kwargs['lb_name']]
+    elif isinstance(resource, FileShare):
+        return [resource_group_name, kwargs['sa_name']]
+    return [resource_group_name]
+
+
 def get_unique_name(resource, resource_group_name, name, **kwargs):
-    if not name:
-        for _ in range(0, 15):
-            # special naming handling
-            if isinstance(resource, StorageAccount):
-                name = sa_name_generator()
-            elif isinstance(resource, FileShare):
-                name = file_share_name_generator()
-            else:
-                name = "{0}".format(uuid4())
-            try:
-                # handle speical cases
-                # resource_group
-                if isinstance(resource, ResourceGroup):
-                    result = resource.get(name)
-                # virtual_machine_extension
-                elif isinstance(resource, VirtualMachineExtension):
-                    vm_name = kwargs['vm_name']
-                    result = resource.get(resource_group_name, vm_name, name)
-                # subnet
-                elif isinstance(resource, Subnet):
-                    vnet_name = kwargs['vnet_name']
-                    result = resource.get(resource_group_name, vnet_name, name)
-                # route
-                elif isinstance(resource, Route):
-                    rtbl_name = kwargs['rtbl_name']
-                    result = resource.get(resource_group_name, rtbl_name, name)
-                # network_security_rule
-                elif isinstance(resource, NetworkSecurityRule):
-                    nsg_name = kwargs['nsg_name']
-                    result = resource.get(resource_group_name, nsg_name, name)
-                elif isinstance(resource, (LoadBalancerBackendAddressPool,
-                                           LoadBalancerLoadBalancingRule,
-                                           LoadBalancerInboundNatRule,
-                                           LoadBalancerProbe)):
-                    lb_name = kwargs['lb_name']
-                    result = resource.get(resource_group_name, lb_name, name)
-                elif isinstance(resource, FileShare):
-                    sa_name = kwargs['sa_name']
-                    result = resource.get(resource_group_name, sa_name, name)
-                else:
-                    result = resource.get(resource_group_name, name)
-                if result:  # found a resource with same name
-                    name = ""
-                    continue
-            except (CloudError, ResourceNotFoundError):  # name is not used
-                return name
-    else:
+    if name:
         return name
+    candidates = [generate_name(resource) for _ in range(0, 15)]
+    scope = get_name_scope(resource, resource_group_name, **kwargs)
+    # Check all candidates with a single call where possible.
+    try:
+        if isinstance(resource, StorageAccount):
+            # Storage account names are globally unique.
+            for name in candidates:
+                if resource.check_name_availability(name):
+                    return name
+            return
+        used_names = resource.list_names(*scope)
+    except (NotImplementedError, CloudError, HttpResponseError):
+        pass
+    else:
+        for name in candidates:
+            if name not in used_names:
+                return name
+        return
+    # Otherwise check the candidates one by one.
+    for name in candidates:
+        try:
+            if resource.get(*(scope + [name])):
+                # found a resource with same name
+                continue
+        except (CloudError, ResourceNotFoundError):  # name is not used
+            return name
 
 
 def with_generate_name(resource_class_name):
@@ -259,21 +281,31 @@ def with_azure_resource(resource_class_name):
                 exists = False
             special_condition = get_special_condition(ctx.node.type_hierarchy,
                                                       ctx.operation.name)
+            # A pending long running operation, started by a previous
+            # attempt of this operation, is resumed regardless of state.
+            if ctx.instance.runtime_properties.get('async_op'):
+                special_condition = True
             create_op = get_create_op(ctx.operation.name,
                                       ctx.node.type_hierarchy)
             delete_op = get_delete_op(ctx.operation.name,
                                       ctx.node.type_hierarchy)
             # There is now a good idea whether the desired resource exists.
             # Now find out if it is expected and if it does or doesn't.
-            if not skip(
-                    resource_class_name,
-                    name,
-                    _ctx_node=ctx.node,
-                    exists=exists,
-                    special_condition=special_condition,
-                    create_operation=create_op,
-                    delete_operation=delete_op):
-                return func(*args, **kwargs)
+            try:
+                if not skip(
+                        resource_class_name,
+                        name,
+                        _ctx_node=ctx.node,
+                        exists=exists,
+                        special_condition=special_condition,
+                        create_operation=create_op,
+                        delete_operation=delete_op):
+                    return func(*args, **kwargs)
+            finally:
+                stats = operation_cache.stats(ctx)
+                ctx.logger.debug(
+                    'Resource cache: {0} hits, {1} misses.'.format(
+                        stats['hits'], stats['misses']))
         return wrapper_inner
     return wrapper_outer
 
@@ -22,8 +22,9 @@ import base64
 
 from uuid import uuid4
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from msrestazure.azure_exceptions import CloudError
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 from cloudify import ctx as ctx_from_imports
 from cloudify import compute
@@ -32,12 +33,14 @@ from cloudify.decorators import operation
 
 from cloudify_azure import (constants, decorators, utils)
 from cloudify_azure.resources.compute.virtualmachine.virtualmachine_utils \
-    import check_if_configuration_changed
+    import (check_if_configuration_changed, configuration_fingerprint)
 from cloudify_azure.resources.network.publicipaddress import PUBLIC_IP_PROPERTY
 from azure_sdk.resources.network.public_ip_address import PublicIPAddress
 from azure_sdk.resources.compute.virtual_machine import VirtualMachine
 from azure_sdk.resources.compute.virtual_machine_extension \
     import VirtualMachineExtension
+from azure_sdk.resources.compute.virtual_machine_scale_set import \
+    VirtualMachineScaleSet
 from azure_sdk.resources.network.network_interface_card import \
     NetworkInterfaceCard
 from azure.mgmt.compute.models import (
@@ -241,12 +244,220 @@ def _create_or_update(ctx, args=None):
         ctx.node.properties.get('api_version', constants.API_VER_COMPUTE)
     virtual_machine = VirtualMachine(azure_config, ctx.logger, api_version)
     resource_create_payload = _get_vm_create_or_update_payload(ctx, args, name)
+    if (ctx.node.properties.get('scale_set') or {}).get('enabled'):
+        _create_in_scale_set(ctx, resource_group_name, resource_create_payload)
+        return
     _create_update_resource(resource_group_name,
                             name,
                             virtual_machine,
                             resource_create_payload)
 
 
+def build_scale_set_params(ctx, payload):
+    """
+        Creates the parameters of a flexible orchestration Virtual Machine
+        Scale Set from the create payload of one of its Virtual Machines,
+        without the capacity.
+
+    :param dict payload: The create payload of a Virtual Machine.
+    :returns: Virtual Machine Scale Set parameters
+    :rtype: dict
+    """
+    scale_set = ctx.node.properties.get('scale_set') or {}
+    storage_profile = deepcopy(payload.get('storage_profile') or {})
+    # Scale sets name the disks of their Virtual Machines.
+    for disk in [storage_profile.get('os_disk') or {}] + \
+            (storage_profile.get('data_disks') or []):
+        disk.pop('name', None)
+        disk.pop('vhd', None)
+    os_profile = deepcopy(payload.get('os_profile') or {})
+    os_profile['computer_name_prefix'] = os_profile.pop('computer_name', None)
+    virtual_machine_profile = utils.dict_update(
+        {'storage_profile': storage_profile, 'os_profile': os_profile},
+        scale_set.get('virtual_machine_profile'))
+    if not virtual_machine_profile.get('network_profile'):
+        raise cfy_exc.NonRecoverableError(
+            'scale_set.virtual_machine_profile.network_profile is required, '
+            'as scale set Virtual Machines do not use NIC relationships.')
+    return {
+        'location': payload.get('location'),
+        'tags': payload.get('tags'),
+        'sku': {
+            'name': (payload.get('hardware_profile') or {}).get('vm_size')
+        },
+        'orchestration_mode': 'Flexible',
+        'platform_fault_domain_count':
+            scale_set.get('platform_fault_domain_count', 1),
+        'virtual_machine_profile': virtual_machine_profile
+    }
+
+
+def _create_in_scale_set(ctx, resource_group_name, payload):
+    """
+        Creates the Virtual Machine of this node instance as a member of
+        the scale set of the node.
+    """
+    azure_config = utils.get_client_config(ctx.node.properties)
+    scale_set_name = \
+        ctx.node.properties['scale_set'].get('name') or ctx.node.id
+    scale_set_iface = VirtualMachineScaleSet(azure_config, ctx.logger)
+    api_version = \
+        ctx.node.properties.get('api_version', constants.API_VER_COMPUTE)
+    vm_iface = VirtualMachine(azure_config, ctx.logger, api_version)
+    virtual_machine = _get_scale_set_virtual_machine(
+        scale_set_iface,
+        vm_iface,
+        resource_group_name,
+        scale_set_name,
+        build_scale_set_params(ctx, payload),
+        ctx.instance.id,
+        ctx.node.number_of_instances)
+    utils.save_common_info_in_runtime_properties(resource_group_name,
+                                                 virtual_machine['name'],
+                                                 virtual_machine)
+    ctx.instance.runtime_properties['scale_set_name'] = scale_set_name
+    ctx.instance.runtime_properties['scale_set_id'] = \
+        virtual_machine['virtual_machine_scale_set']['id']
+    # The payload describes the scale set, so configure has nothing to
+    # update.
+    ctx.instance.runtime_properties['configuration_fingerprint'] = \
+        configuration_fingerprint(payload)
+
+
+def _get_scale_set_virtual_machine(scale_set_iface,
+                                   vm_iface,
+                                   resource_group_name,
+                                   scale_set_name,
+                                   params,
+                                   instance_id,
+                                   capacity):
+    """
+        Finds the Virtual Machine of a node instance in a scale set, or
+        else claims a new one. The capacity of the scale set is set to the
+        number of instances of the node, so the whole scale group is added
+        by the first of its node instances, and the others, as well as
+        retries, find the scale set at that capacity already.
+
+    :param dict params: The scale set parameters, without the capacity.
+    :param int capacity: The number of instances of the node.
+    :returns: The Virtual Machine of the node instance.
+    """
+    try:
+        scale_set = scale_set_iface.get(resource_group_name, scale_set_name)
+    except ResourceNotFoundError:
+        scale_set = {}
+    if scale_set:
+        for virtual_machine in scale_set_iface.list_virtual_machines(
+                resource_group_name, scale_set['id']):
+            if (virtual_machine.get('tags') or {}).get(
+                    constants.SCALE_SET_INSTANCE_TAG) == instance_id:
+                return virtual_machine
+
+    def scale_out(current):
+        if (current.get('sku') or {}).get('capacity', 0) >= capacity:
+            return None
+        scale_set_params = deepcopy(params)
+        scale_set_params['sku']['capacity'] = capacity
+        return scale_set_params
+
+    if (scale_set.get('sku') or {}).get('capacity', 0) < capacity:
+        scale_set_iface.logger.debug(
+            'Setting the capacity of scale set {0} to {1}.'.format(
+                scale_set_name, capacity))
+        try:
+            scale_set = _scale_out(scale_set_iface, resource_group_name,
+                                   scale_set_name, scale_out)
+        except CloudError as cr:
+            raise cfy_exc.NonRecoverableError(
+                "scale out virtual_machine_scale_set '{0}' "
+                "failed with this error : {1}".format(
+                    scale_set_name, cr.message))
+    virtual_machines = _claim_virtual_machines(
+        vm_iface,
+        resource_group_name,
+        scale_set_iface.list_virtual_machines(
+            resource_group_name, scale_set['id']),
+        [instance_id])
+    if instance_id not in virtual_machines:
+        raise cfy_exc.OperationRetry(
+            'No virtual machine of scale set {0} is available for node '
+            'instance {1} yet.'.format(scale_set_name, instance_id))
+    return virtual_machines[instance_id]
+
+
+def _scale_out(scale_set_iface, resource_group_name, scale_set_name, mutate):
+    """
+        Updates the capacity of a scale set with its ETag, so that scale
+        outs of other processes are not lost, or creates the scale set if
+        it doesn't exist yet. mutate returns None if the capacity needs no
+        update.
+    """
+    try:
+        return utils.read_modify_write(
+            scale_set_iface, resource_group_name, scale_set_name, mutate)
+    except ResourceNotFoundError:
+        pass
+    try:
+        return scale_set_iface.create_or_update(
+            resource_group_name, scale_set_name, mutate({}),
+            if_none_match=True)
+    except HttpResponseError as e:
+        if not utils.is_concurrent_update_error(e):
+            raise
+    # Another process created the scale set meanwhile.
+    return utils.read_modify_write(
+        scale_set_iface, resource_group_name, scale_set_name, mutate)
+
+
+def _claim_virtual_machines(vm_iface,
+                            resource_group_name,
+                            virtual_machines,
+                            instance_ids):
+    """
+        Maps node instances to scale set Virtual Machines by the
+        SCALE_SET_INSTANCE_TAG tag. The node instances that have no tagged
+        Virtual Machine yet claim untagged ones, with a conditional update
+        of the tags, so that each Virtual Machine is claimed by a single
+        node instance, also when other processes scale out the same scale
+        set.
+
+    :returns: A dict of node instance ID to its Virtual Machine.
+    """
+    claimed = {}
+    untagged = []
+    for virtual_machine in sorted(virtual_machines,
+                                  key=lambda vm: vm['name']):
+        instance_id = (virtual_machine.get('tags') or {}).get(
+            constants.SCALE_SET_INSTANCE_TAG)
+        if instance_id in instance_ids:
+            claimed[instance_id] = virtual_machine
+        elif not instance_id:
+            untagged.append(virtual_machine)
+    unclaimed = [instance_id for instance_id in instance_ids
+                 if instance_id not in claimed]
+    for virtual_machine in untagged:
+        if not unclaimed:
+            break
+        current = vm_iface.get(resource_group_name, virtual_machine['name'])
+        tags = dict(current.get('tags') or {})
+        if tags.get(constants.SCALE_SET_INSTANCE_TAG):
+            continue
+        tags[constants.SCALE_SET_INSTANCE_TAG] = unclaimed[0]
+        try:
+            virtual_machine = vm_iface.create_or_update(
+                resource_group_name,
+                virtual_machine['name'],
+                {'location': current.get('location'), 'tags': tags},
+                etag=current.get('etag'))
+        except HttpResponseError as e:
+            if not utils.is_concurrent_update_error(e):
+                raise
+            # Another node instance claimed it meanwhile.
+            continue
+        claimed[unclaimed.pop(0)] = virtual_machine
+    return claimed
+
+
 def _get_vm_create_or_update_payload(ctx, args, name):
     res_cfg = ctx.node.properties.get("resource_config", {})
     spot_instance = res_cfg.pop("spot_instance", None)
@@ -346,7 +557,13 @@ def _get_vm_create_or_update_payload(ctx, args, name):
 def _create_update_resource(resource_group_name,
                             name,
                             vm_iface,
-                            resource_create_payload):
+                            resource_create_payload,
+                            configuration=None):
+    """
+        Creates or updates the Virtual Machine with resource_create_payload,
+        and stores the fingerprint of configuration, the full configuration
+        that the payload results in, which defaults to the payload itself.
+    """
     result = utils.handle_create(
         vm_iface,
         resource_group_name,
@@ -355,6 +572,9 @@ def _create_update_resource(resource_group_name,
     utils.save_common_info_in_runtime_properties(resource_group_name,
                                                  name,
                                                  result)
+    ctx_from_imports.instance.runtime_properties[
+        'configuration_fingerprint'] = \
+        configuration_fingerprint(configuration or resource_create_payload)
 
 
 @operation(resumable=True)
@@ -375,13 +595,24 @@ def configure(ctx, args=None, **_):
     virtual_machine = VirtualMachine(azure_config, ctx.logger, api_version)
     payload = _get_vm_create_or_update_payload(ctx, args, name)
     ctx.logger.debug("create_payload: \n {payload}".format(payload=payload))
-    current_vm = ctx.instance.runtime_properties["resource"]
-    if check_if_configuration_changed(ctx, payload, current_vm):
+    payload_fingerprint = configuration_fingerprint(payload)
+    if payload_fingerprint == \
+            ctx.instance.runtime_properties.get('configuration_fingerprint'):
+        ctx.logger.debug("configuration fingerprint unchanged.")
+    elif check_if_configuration_changed(
+            ctx, payload, ctx.instance.runtime_properties["resource"]):
         ctx.logger.info("configuration changed!!")
         _create_update_resource(resource_group_name,
                                 name,
                                 virtual_machine,
                                 payload)
+    else:
+        ctx.instance.runtime_properties['configuration_fingerprint'] = \
+            payload_fingerprint
+    _attach_related_data_disks(ctx,
+                               virtual_machine,
+                               resource_group_name,
+                               name)
 
 
 @operation(resumable=True)
@@ -430,84 +661,64 @@ def start(ctx, command_to_execute, file_uris, type_handler_version='1.9', **_):
         [net_rel.target.node.id for net_rel in rel_nics]))
 
     # No NIC? Exit and hope the user doesn't plan to install an agent
+    ips = {}
     if rel_nics:
-        vm_id = ctx.instance.runtime_properties.get("resource_id")
+        vm_id = ctx.instance.runtime_properties.get("resource_id") or \
+            utils.get_resource_id_from_name(
+                azure_config.get('subscription_id'),
+                resource_group_name,
+                'Microsoft.Compute',
+                'virtualMachines',
+                vm_name)
+        # Get the NIC data from the API directly (because of
+        # IPConfiguration), for all NICs at the same time.
+        with ThreadPoolExecutor(max_workers=min(
+                len(rel_nics), constants.NIC_RESOLVE_WORKERS)) as executor:
+            nics_data = list(executor.map(
+                utils.in_calling_context(
+                    lambda rel_nic: _get_nic_data(rel_nic, vm_id,
+                                                  ctx.logger)),
+                rel_nics))
+        ip_cfgs = [ip_cfg for nic_data in nics_data
+                   for ip_cfg in nic_data.get('ip_configurations', list())]
+        public_ips = _get_public_ips(
+            ip_cfgs, azure_config, resource_group_name, ctx.logger)
 
         public_ip_addresses = []
-        for rel_nic in rel_nics:
-            # Get the NIC data from the API directly
-            # (because of IPConfiguration)
-            nic_azure_config = utils.get_client_config(
-                rel_nic.target.node.properties)
-            nic_resource_group = utils.get_resource_group(rel_nic.target)
-            nic_name = utils.get_resource_name(rel_nic.target)
-            nic_iface = NetworkInterfaceCard(nic_azure_config, ctx.logger)
-            nic_data = nic_iface.get(nic_resource_group, nic_name)
-            nic_vm_id = nic_data.get('virtual_machine', {}).get('id')
-
-            if not nic_vm_id:
-                if not vm_id:
-                    nic_data['virtual_machine'] = {
-                        'id': utils.get_resource_id_from_name(
-                            azure_config.get('subscription_id'),
-                            resource_group_name,
-                            'Microsoft.Compute',
-                            'virtualMachines',
-                            vm_name
-                        )
-                    }
-                elif vm_id not in nic_vm_id:
-                    nic_data['virtual_machine'] = {
-                        'id': vm_id
-                    }
-                ctx.logger.info('nic_data {nic_data}'.format(
-                    nic_data=nic_data))
-                nic_data = nic_iface.create_or_update(nic_resource_group,
-                                                      nic_name,
-                                                      nic_data)
-            # Iterate over each IPConfiguration entry
-            for ip_cfg in nic_data.get('ip_configurations', list()):
-
-                # Get the Private IP Address endpoint
-                private_ip = ip_cfg.get('private_ip_address')
-                ctx.instance.runtime_properties['ip'] = private_ip
-                public_ip = ip_cfg.get('public_ip_address', {}).get(
-                    'ip_address')
-                if not public_ip:
-                    azure_config = utils.get_client_config(ctx.node.properties)
-                    resource_group_name = utils.get_resource_group(ctx)
-                    pip = PublicIPAddress(azure_config, ctx.logger)
-                    pip_cfg = ip_cfg.get('public_ip_address')
-                    if pip_cfg:
-                        pip_name = pip_cfg.get('id').rsplit('/', 1)[1]
-                        public_ip_data = pip.get(resource_group_name, pip_name)
-                        public_ip = public_ip_data.get("ip_address")
-                if not public_ip:
-                    # skip the public ip from this ip configuration
-                    # as it is None
-                    continue
-
-                ctx.instance.runtime_properties['public_ip'] = public_ip
-                # For consistency with other plugins.
-                ctx.instance.runtime_properties[PUBLIC_IP_PROPERTY] = public_ip
-                # We should also consider that maybe there will be many
-                # public ip addresses.
-                if public_ip not in public_ip_addresses:
-                    public_ip_addresses.append(public_ip)
-                ctx.instance.runtime_properties['public_ip_addresses'] = \
-                    public_ip_addresses
+        # Iterate over each IPConfiguration entry
+        for ip_cfg in ip_cfgs:
+            # Get the Private IP Address endpoint
+            ips['ip'] = ip_cfg.get('private_ip_address')
+            public_ip = ip_cfg.get('public_ip_address', {}).get(
+                'ip_address')
+            if not public_ip:
+                pip_id = (ip_cfg.get('public_ip_address') or {}).get('id')
+                public_ip = public_ips.get((pip_id or '').lower())
+            if not public_ip:
+                # skip the public ip from this ip configuration
+                # as it is None
+                continue
+
+            ips['public_ip'] = public_ip
+            # For consistency with other plugins.
+            ips[PUBLIC_IP_PROPERTY] = public_ip
+            # We should also consider that maybe there will be many
+            # public ip addresses.
+            if public_ip not in public_ip_addresses:
+                public_ip_addresses.append(public_ip)
+            ips['public_ip_addresses'] = public_ip_addresses
 
     # if no public_ip default to private_ip
-    public_ip = ctx.instance.runtime_properties.get('public_ip')
-    if not public_ip:
-        public_ip = ctx.instance.runtime_properties.get('ip')
-        ctx.instance.runtime_properties['public_ip'] = public_ip
+    if 'ip' not in ips:
+        ips['ip'] = ctx.instance.runtime_properties.get('ip')
+    if 'public_ip' not in ips:
+        ips['public_ip'] = \
+            ctx.instance.runtime_properties.get('public_ip') or ips['ip']
 
     # See if the user wants to use the public IP as primary IP
-    if ctx.node.properties.get('use_public_ip') and \
-            ctx.instance.runtime_properties.get('public_ip'):
-        ctx.instance.runtime_properties['ip'] = \
-            ctx.instance.runtime_properties.get('public_ip')
+    if ctx.node.properties.get('use_public_ip') and ips['public_ip']:
+        ips['ip'] = ips['public_ip']
+    ctx.instance.runtime_properties.update(ips)
     ctx.logger.info('OUTPUT {0}.{1} = "{2}"'.format(
         ctx.instance.id,
         'ip',
@@ -524,15 +735,57 @@ def start(ctx, command_to_execute, file_uris, type_handler_version='1.9', **_):
     if not get_instance_status(virtual_machine,
                                resource_group_name,
                                vm_name) == 'PowerState/running':
-        virtual_machine.start(resource_group_name, vm_name)
+        utils.run_task(virtual_machine, 'start', resource_group_name, vm_name)
         raise cfy_exc.OperationRetry('Waiting for PowerState/running status.')
 
 
+def _get_nic_data(rel_nic, vm_id, logger):
+    """
+        Gets a NIC connected to a Virtual Machine, and connects it to the
+        Virtual Machine if it is not connected yet.
+    """
+    nic_azure_config = utils.get_client_config(
+        rel_nic.target.node.properties)
+    nic_resource_group = utils.get_resource_group(rel_nic.target)
+    nic_name = utils.get_resource_name(rel_nic.target)
+    nic_iface = NetworkInterfaceCard(nic_azure_config, logger)
+    nic_data = nic_iface.get(nic_resource_group, nic_name)
+    if not (nic_data.get('virtual_machine') or {}).get('id'):
+        nic_data['virtual_machine'] = {'id': vm_id}
+        logger.info('nic_data {nic_data}'.format(nic_data=nic_data))
+        nic_data = nic_iface.create_or_update(nic_resource_group,
+                                              nic_name,
+                                              nic_data)
+    return nic_data
+
+
+def _get_public_ips(ip_cfgs, azure_config, resource_group_name, logger):
+    """
+        Gets the addresses of the Public IP Addresses of IP configurations,
+        with one list call per resource group.
+
+    :returns: A dict of lower case Public IP Address ID to address.
+    """
+    pip_ids = set(
+        ip_cfg['public_ip_address']['id'] for ip_cfg in ip_cfgs
+        if (ip_cfg.get('public_ip_address') or {}).get('id') and
+        not ip_cfg['public_ip_address'].get('ip_address'))
+    if not pip_ids:
+        return {}
+    pip = PublicIPAddress(azure_config, logger)
+    public_ips = {}
+    for group_name in set(
+            utils.get_resource_group_from_id(pip_id) or resource_group_name
+            for pip_id in pip_ids):
+        for public_ip_data in pip.list_by_scope(group_name):
+            public_ips[public_ip_data['id'].lower()] = \
+                public_ip_data.get('ip_address')
+    return public_ips
+
+
 def get_instance_status(virtual_machine, resource_group_name, vm_name):
     try:
-        response = virtual_machine.get_instance_view(resource_group_name,
-                                                     vm_name)
-        return response['instance_view']['statuses'][-1]['code']
+        return virtual_machine.get_power_state(resource_group_name, vm_name)
     except (KeyError, AttributeError) as e:
         ctx_from_imports.logger.info(str(e))
         raise cfy_exc.OperationRetry(
@@ -582,10 +835,18 @@ def delete(ctx, **_):
     api_version = \
         ctx.node.properties.get('api_version', constants.API_VER_COMPUTE)
     virtual_machine = VirtualMachine(azure_config, ctx.logger, api_version)
+    scale_set_name = ctx.instance.runtime_properties.get('scale_set_name')
+    scale_set_id = ctx.instance.runtime_properties.get('scale_set_id')
     utils.handle_delete(
         ctx, virtual_machine, resource_group_name, name)
     get_instance_status(
         virtual_machine, resource_group_name, name)
+    if scale_set_name:
+        # Delete the scale set with its last Virtual Machine.
+        scale_set_iface = VirtualMachineScaleSet(azure_config, ctx.logger)
+        if not scale_set_iface.list_virtual_machines(resource_group_name,
+                                                     scale_set_id):
+            scale_set_iface.delete(resource_group_name, scale_set_name)
 
 
 @operation(resumable=True)
@@ -623,91 +884,186 @@ def resize(ctx, vm_size, **_):
             'vm_size': vm_size
         }
     }
+    # The fingerprint describes the whole configuration, so configure can
+    # tell whether it still matches.
+    configuration = utils.dict_update(
+        _get_vm_create_or_update_payload(ctx, None, name), vm_params)
     try:
         _create_update_resource(resource_group_name,
                                 name,
                                 vm_iface,
-                                vm_params)
+                                vm_params,
+                                configuration)
     except CloudError as cr:
         raise cfy_exc.NonRecoverableError(
             "resizing virtual_machine '{0}' "
             "failed with this error : {1}".format(name, cr.message))
 
 
-@operation(resumable=True)
-def attach_data_disk(ctx, lun, **_):
-    """Attaches a data disk"""
-    azure_config = utils.get_client_config(ctx.source.node.properties)
-    api_version = \
-        ctx.source.node.properties.get('api_version',
-                                       constants.API_VER_COMPUTE)
-    resource_group_name = utils.get_resource_group(ctx.source)
-    name = ctx.source.instance.runtime_properties.get("name")
-    vm_iface = VirtualMachine(azure_config, ctx.logger, api_version)
-    vm_state = vm_iface.get(resource_group_name, name)
-    data_disks = vm_state.get('storage_profile', dict()).get(
-        'data_disks', list())
+def _attach_related_data_disks(ctx, vm_iface, resource_group_name, name):
+    """
+        Attaches the data disks of the vm_connected_to_datadisk relationships
+        of the Virtual Machine that have a lun property with a single Virtual
+        Machine update. Their establish operations run in separate
+        processes, so they would each update the Virtual Machine, and they
+        skip the disks attached here.
+    """
+    data_disks = []
+    for rel in utils.get_relationships_by_type(
+            ctx.instance.relationships, constants.REL_CONNECTED_TO_DATADISK):
+        lun = rel.target.node.properties.get('lun')
+        if isinstance(lun, int):
+            data_disks.append(_build_data_disk(rel.target, lun))
+    if not data_disks:
+        return
+    update_data_disks(vm_iface,
+                      resource_group_name,
+                      name,
+                      attach=data_disks,
+                      location=ctx.node.properties.get('location'))
+    ctx.instance.runtime_properties['attached_data_disks'] = \
+        [data_disk['vhd']['uri'] for data_disk in data_disks]
+
+
+def _build_data_disk(target, lun):
     # Get the createOption
     create_opt = 'Empty'
-    if ctx.target.node.properties.get('use_external_resource', False):
+    if target.node.properties.get('use_external_resource', False):
         create_opt = 'Attach'
-    # Add the disk to the list
-    data_disks.append({
-        'name': utils.get_resource_name(_ctx=ctx.target),
+    return {
+        'name': utils.get_resource_name(_ctx=target),
         'lun': lun,
-        'disk_size_gb': ctx.target.instance.runtime_properties['diskSizeGB'],
+        'disk_size_gb': target.instance.runtime_properties['diskSizeGB'],
         'vhd': {
-            'uri': ctx.target.instance.runtime_properties['uri']
+            'uri': target.instance.runtime_properties['uri']
         },
         'create_option': create_opt,
         'caching': 'None'
-    })
-    # Update the VM
-    vm_params = {
-        'location': ctx.source.node.properties.get('location'),
-        'storage_profile': {
-            'data_disks': data_disks
-        }
     }
+
+
+def update_data_disks(vm_iface,
+                      resource_group_name,
+                      name,
+                      attach=(),
+                      detach=(),
+                      location=None):
+    """
+        Attaches data disks to, or detaches them from, a Virtual Machine.
+        Changes to the data disks of the same Virtual Machine that are
+        submitted in this process while an update of it is in flight are
+        applied together with a single Virtual Machine update. The disks of
+        the data disk relationships are attached together by configure.
+
+    :param attach: Data disks to attach, each a dict with a lun.
+    :param detach: The VHD URIs of the data disks to detach.
+    :param location: The Virtual Machine location, if known.
+    :returns: The updated Virtual Machine.
+    """
+    mutation = (list(attach), list(detach), location)
+    key = (vm_iface.subscription_id, resource_group_name, name)
+    return utils.mutation_batcher.submit(
+        key,
+        mutation,
+        lambda mutations: _commit_data_disk_mutations(
+            vm_iface, resource_group_name, name, mutations),
+        vm_iface.creds.get('coalesce_window') or 0)
+
+
+def _commit_data_disk_mutations(vm_iface,
+                                resource_group_name,
+                                name,
+                                mutations):
+    def apply_mutations(vm_state):
+        vm_params = {}
+        data_disks = vm_state.get('storage_profile', dict()).get(
+            'data_disks', list())
+        for attach, detach, location in mutations:
+            data_disks = [
+                x for x in data_disks
+                if x.get('vhd', dict()).get('uri') not in detach and
+                x.get('lun') not in [disk['lun'] for disk in attach]]
+            data_disks.extend(attach)
+            if location:
+                vm_params['location'] = location
+        vm_params['location'] = \
+            vm_params.get('location') or vm_state.get('location')
+        vm_params['storage_profile'] = {'data_disks': data_disks}
+        return vm_params
+
+    vm_iface.logger.debug(
+        'Applying {0} data disk change(s) to virtual_machine {1}.'.format(
+            len(mutations), name))
     try:
-        vm_iface.create_or_update(resource_group_name, name, vm_params)
+        return utils.read_modify_write(
+            vm_iface, resource_group_name, name, apply_mutations)
     except CloudError as cr:
         raise cfy_exc.NonRecoverableError(
-            "attach disk to virtual_machine '{0}' "
+            "update data disks of virtual_machine '{0}' "
             "failed with this error : {1}".format(name, cr.message))
 
 
+def _get_data_disk_iface(_ctx):
+    azure_config = utils.get_client_config(_ctx.node.properties)
+    api_version = \
+        _ctx.node.properties.get('api_version', constants.API_VER_COMPUTE)
+    return VirtualMachine(azure_config, ctx_from_imports.logger, api_version)
+
+
+@operation(resumable=True)
+def attach_data_disk(ctx, lun, **_):
+    """Attaches a data disk"""
+    if ctx.target.instance.runtime_properties['uri'] in \
+            ctx.source.instance.runtime_properties.get(
+                'attached_data_disks', []):
+        ctx.logger.debug('The data disk was attached by configure.')
+        return
+    resource_group_name = utils.get_resource_group(ctx.source)
+    name = ctx.source.instance.runtime_properties.get("name")
+    update_data_disks(_get_data_disk_iface(ctx.source),
+                      resource_group_name,
+                      name,
+                      attach=[_build_data_disk(ctx.target, lun)],
+                      location=ctx.source.node.properties.get('location'))
+
+
+@operation(resumable=True)
+def attach_data_disks(ctx, disks, **_):
+    """Attaches data disks with a single Virtual Machine update
+
+    :param disks: A list of dicts, each with the lun and the disk, in the
+        format of storageProfile::dataDisks.
+    """
+    resource_group_name = utils.get_resource_group(ctx)
+    name = ctx.instance.runtime_properties.get("name")
+    data_disks = []
+    for disk in disks:
+        data_disk = dict(disk['disk'])
+        data_disk['lun'] = disk['lun']
+        data_disks.append(data_disk)
+    update_data_disks(_get_data_disk_iface(ctx),
+                      resource_group_name,
+                      name,
+                      attach=data_disks,
+                      location=ctx.node.properties.get('location'))
+
+
 @operation(resumable=True)
 def detach_data_disk(ctx, **_):
     """Detaches a data disk"""
-    azure_config = utils.get_client_config(ctx.source.node.properties)
-    api_version = \
-        ctx.source.node.properties.get('api_version',
-                                       constants.API_VER_COMPUTE)
     resource_group_name = utils.get_resource_group(ctx.source)
     name = ctx.source.instance.runtime_properties.get("name")
-    vm_iface = VirtualMachine(azure_config, ctx.logger, api_version)
-    vm_state = vm_iface.get(resource_group_name, name)
-    data_disks = [
-        x for x in vm_state.get('storage_profile', dict()).get(
-            'data_disks', list())
-        if x.get('vhd',
-                 dict()
-                 ).get('uri') != ctx.target.instance.runtime_properties['uri']]
-
-    # Update the VM
-    vm_params = {
-        'location': ctx.source.node.properties.get('location'),
-        'storage_profile': {
-            'data_disks': data_disks
-        }
-    }
-    try:
-        vm_iface.create_or_update(resource_group_name, name, vm_params)
-    except CloudError as cr:
-        raise cfy_exc.NonRecoverableError(
-            "detach disk from virtual_machine '{0}' "
-            "failed with this error : {1}".format(name, cr.message))
+    uri = ctx.target.instance.runtime_properties['uri']
+    update_data_disks(_get_data_disk_iface(ctx.source),
+                      resource_group_name,
+                      name,
+                      detach=[uri],
+                      location=ctx.source.node.properties.get('location'))
+    attached_data_disks = ctx.source.instance.runtime_properties.get(
+        'attached_data_disks')
+    if attached_data_disks and uri in attached_data_disks:
+        ctx.source.instance.runtime_properties['attached_data_disks'] = \
+            [x for x in attached_data_disks if x != uri]
 
 
 @operation(resumable=True)
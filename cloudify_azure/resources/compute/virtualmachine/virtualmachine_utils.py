@@ -13,78 +13,92 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from cloudify import ctx
+import json
 
+from azure_sdk.common import fingerprint
 
-def check_if_configuration_changed(ctx, update_payload, current_vm):
-    for prop in ['location', 'tags', 'plan', 'availability_set',
-                 'eviction_policy', 'billing_profile', 'priority',
-                 'hardware_profile']:
-        update_property_value = update_payload.get(prop)
-        current_vm_property_value = current_vm.get(prop)
-        if update_property_value and ordered(
-                update_property_value) != ordered(current_vm_property_value):
-            ctx.logger.info("{prop} changed.".format(prop=prop))
-            ctx.logger.info("update payload: {content}.".format(
-                content=update_property_value))
-            ctx.logger.info("current configuration: {content}.".format(
-                content=current_vm_property_value))
-            return True
 
-    for prop in ['os_profile', 'storage_profile', 'network_profile']:
-        if prop == 'network_profile' and update_payload.get(prop):
-            update_property_value = update_payload.get(prop).as_dict()
-        else:
-            update_property_value = update_payload.get(prop, {})
+# Properties that are compared as a whole, and only if they are set in the
+# update payload.
+WHOLE_PROPERTIES = ['location', 'tags', 'plan', 'availability_set',
+                    'eviction_policy', 'billing_profile', 'priority',
+                    'hardware_profile']
+# Properties that are compared key by key, ignoring the keys that only the
+# current configuration has.
+PROFILE_PROPERTIES = ['os_profile', 'storage_profile', 'network_profile']
 
-        current_vm_property_value = current_vm.get(prop, {})
-        if diff_dictionaries(update_property_value, current_vm_property_value):
-            ctx.logger.info("{prop} changed.".format(prop=prop))
-            return True
 
+def check_if_configuration_changed(ctx, update_payload, current_vm):
+    changes = get_configuration_changes(update_payload, current_vm)
+    if changes:
+        ctx.logger.info("{props} changed.".format(props=', '.join(changes)))
+        return True
     return False
 
 
-def diff_dictionaries(update_dict, current_conf_dict):
+def get_configuration_changes(update_payload, current_vm):
     """
-    Returns True if update_dict has changes in a key that doesn't appear in
-    current_conf_dict.
-    current_conf_dict can have additional keys and its not considered as a
-    diff.
+    Returns the paths, e.g. os_profile.computer_name, of the values in
+    update_payload that are different in current_vm. Both are normalized
+    once, so the comparison is a single pass.
     """
-    for key in update_dict:
-        if isinstance(update_dict.get(key), dict):
-            res = diff_dictionaries(update_dict.get(key),
-                                    current_conf_dict.get(key, {}))
-            if res:
-                return True
-        elif ordered(update_dict.get(key)) != ordered(
-                current_conf_dict.get(key)):
-            ctx.logger.info(
-                'Changes found in diff_dictionaries: key={key}\n'.format(
-                    key=key))
-            ctx.logger.info(
-                'update_dict: {}'.format(ordered(update_dict.get(key))))
-            ctx.logger.info(
-                'current_conf_dict: {}'.format(ordered(
-                    current_conf_dict.get(key))))
-            return True
-    return False
+    update_payload = normalize(update_payload)
+    current_vm = normalize(current_vm)
+    changes = []
+    for prop in WHOLE_PROPERTIES:
+        update_property_value = update_payload.get(prop)
+        if update_property_value and \
+                update_property_value != current_vm.get(prop):
+            changes.append(prop)
+    for prop in PROFILE_PROPERTIES:
+        changes.extend(diff_paths(update_payload.get(prop) or {},
+                                  current_vm.get(prop) or {},
+                                  prop))
+    return changes
 
 
-def ordered(obj):
+def diff_paths(update_dict, current_conf_dict, path):
     """
-    This function will recursively sort any lists it finds
-    (and convert dictionaries to lists of (key, value) pairs so that they're
-    orderable)
+    Returns the paths of the keys in the normalized update_dict that have a
+    different value in the normalized current_conf_dict.
     """
+    changes = []
+    for key, value in update_dict.items():
+        key_path = '{0}.{1}'.format(path, key)
+        if isinstance(value, dict):
+            current_value = current_conf_dict.get(key)
+            changes.extend(diff_paths(
+                value,
+                current_value if isinstance(current_value, dict) else {},
+                key_path))
+        elif value != current_conf_dict.get(key):
+            changes.append(key_path)
+    return changes
+
+
+def normalize(obj):
+    """
+    Returns a canonical copy of obj: lists are sorted, strings are lower case
+    and numbers are strings. Dictionaries stay dictionaries, so they can be
+    compared key by key.
+    """
+    if hasattr(obj, 'as_dict'):
+        obj = obj.as_dict()
     if isinstance(obj, dict):
-        return sorted((k, ordered(v)) for k, v in obj.items())
+        return dict((k, normalize(v)) for k, v in obj.items())
     if isinstance(obj, list):
-        return sorted(ordered(x) for x in obj)
+        return sorted((normalize(x) for x in obj),
+                      key=lambda x: json.dumps(x, sort_keys=True, default=str))
     if isinstance(obj, str):
         return obj.lower()
     if isinstance(obj, (int, float)):
         return str(obj)
-    else:
-        return obj
+    return obj
+
+
+def configuration_fingerprint(payload):
+    """
+    Returns a stable hash of the normalized create or update payload of a
+    virtual machine.
+    """
+    return fingerprint(normalize(payload))
@@ -18,10 +18,12 @@
     Microsoft Azure Load Balancer interface
 """
 from uuid import uuid4
+from functools import wraps
 from msrestazure.azure_exceptions import CloudError
 
 from cloudify import exceptions as cfy_exc
 from cloudify.decorators import operation
+from cloudify_common_sdk.utils import with_rest_client
 
 from cloudify_azure import (constants, decorators, utils)
 from cloudify_azure.resources.network.ipconfiguration \
@@ -39,6 +41,24 @@ from azure_sdk.resources.network.load_balancer import\
 
 
 LB_ADDRPOOLS_KEY = 'load_balancer_backend_address_pools'
+LB_SUB_RESOURCES_KEY = 'load_balancer_sub_resources'
+# Sub-resource node type, Load Balancer property and ID path segment, in
+# the order they are collected: rules refer to pools and probes.
+LB_SUB_RESOURCE_TYPES = [
+    ('cloudify.azure.nodes.network.LoadBalancer.BackendAddressPool',
+     'backend_address_pools', 'backendAddressPools'),
+    ('cloudify.azure.nodes.network.LoadBalancer.Probe',
+     'probes', 'probes'),
+    ('cloudify.azure.nodes.network.LoadBalancer.IncomingNATRule',
+     'inbound_nat_rules', 'inboundNatRules'),
+    ('cloudify.azure.nodes.network.LoadBalancer.Rule',
+     'load_balancing_rules', 'loadBalancingRules'),
+]
+LB_SUB_RESOURCE_REFS = [
+    ('frontend_ip_configuration', constants.REL_CONNECTED_TO_IPC),
+    ('backend_address_pool', constants.REL_CONNECTED_TO_LB_BE_POOL),
+    ('probe', constants.REL_CONNECTED_TO_LB_PROBE),
+]
 
 
 def get_unique_lb_prop_name(load_balancer, resource_group_name, lb_name,
@@ -60,6 +80,153 @@ def get_unique_lb_prop_name(load_balancer, resource_group_name, lb_name,
         return name
 
 
+def update_load_balancer(load_balancer,
+                         resource_group_name,
+                         lb_name,
+                         collection,
+                         item=None,
+                         name=None,
+                         location=None):
+    """
+        Adds an item to, or removes it from, a collection of Load Balancer
+        sub-resources, e.g. probes. Changes to the same Load Balancer that
+        are submitted in this process while an update of it is in flight are
+        applied together with a single Load Balancer update. Operations in
+        separate processes are not merged; set batch_sub_resources on the
+        Load Balancer to create its sub-resources with it instead.
+
+    :param collection: The Load Balancer property, e.g. inbound_nat_rules.
+    :param item: The item to add or replace. None removes the item.
+    :param name: The name of the item, if item is None.
+    :param location: The Load Balancer location, if known.
+    :returns: The updated Load Balancer.
+    """
+    mutation = (collection, item, name or item.get('name'), location)
+    key = (load_balancer.subscription_id, resource_group_name, lb_name)
+    return utils.mutation_batcher.submit(
+        key,
+        mutation,
+        lambda mutations: _commit_lb_mutations(
+            load_balancer, resource_group_name, lb_name, mutations),
+        load_balancer.creds.get('coalesce_window') or 0)
+
+
+def _commit_lb_mutations(load_balancer,
+                         resource_group_name,
+                         lb_name,
+                         mutations):
+    def apply_mutations(lb_data):
+        lb_params = {}
+        for collection, item, name, location in mutations:
+            items = lb_params.get(collection, lb_data.get(collection, list()))
+            items = [i for i in items if i.get('name') != name]
+            if item:
+                items.append(item)
+            lb_params[collection] = items
+            if location:
+                lb_params['location'] = location
+        return lb_params
+
+    load_balancer.logger.debug(
+        'Applying {0} change(s) to Load Balancer {1}.'.format(
+            len(mutations), lb_name))
+    return utils.read_modify_write(
+        load_balancer, resource_group_name, lb_name, apply_mutations)
+
+
+@with_rest_client
+def collect_sub_resources(ctx, lb_id, rest_client):
+    """
+        Builds the sub-resources of the Load Balancer that are defined by
+        the node instances contained in it, so that the Load Balancer is
+        created with all of them at once. Sub-resources that use an
+        existing resource, that already exist, or that refer to something
+        other than this Load Balancer's frontends, pools and probes are
+        left for their own create operation.
+
+    :param lb_id: The resource ID of the Load Balancer.
+    :returns: The sub-resources by Load Balancer property, and the
+        Load Balancer property and name of each collected node instance.
+    """
+    nodes = dict((node.id, node) for node in rest_client.nodes.list(
+        deployment_id=ctx.deployment.id, _get_all_results=True))
+    children = [
+        instance for instance in rest_client.node_instances.list(
+            deployment_id=ctx.deployment.id, _get_all_results=True)
+        if any(rel['type'] in constants.REL_CONTAINED_IN_LB and
+               rel['target_id'] == ctx.instance.id
+               for rel in instance.relationships)]
+    ids = {}
+    for rel in ctx.instance.relationships:
+        if any(x in rel.type_hierarchy
+               for x in constants.REL_LB_CONNECTED_TO_IPC):
+            ids[rel.target.instance.id] = \
+                '{0}/frontendIPConfigurations/{1}'.format(
+                    lb_id, utils.get_resource_name(rel.target))
+    sub_resources = {}
+    collected = {}
+    for node_type, collection, segment in LB_SUB_RESOURCE_TYPES:
+        for instance in children:
+            node = nodes[instance.node_id]
+            if node_type not in node.type_hierarchy or \
+                    node.properties.get('use_external_resource') or \
+                    instance.runtime_properties.get('resource_id'):
+                continue
+            refs = {}
+            for rel in instance.relationships:
+                for key, rel_type in LB_SUB_RESOURCE_REFS:
+                    if rel['type'] in rel_type:
+                        refs[key] = rel['target_id']
+            if any(target not in ids for target in refs.values()):
+                continue
+            name = instance.runtime_properties.get('name') or \
+                node.properties.get('name') or '{0}'.format(uuid4())
+            item = dict((key, {'id': ids[target]})
+                        for key, target in refs.items())
+            item['name'] = name
+            item = utils.cleanup_empty_params(
+                utils.handle_resource_config_params(
+                    item, node.properties.get('resource_config', {})))
+            sub_resources.setdefault(collection, list()).append(item)
+            ids[instance.id] = '{0}/{1}/{2}'.format(lb_id, segment, name)
+            collected[instance.id] = [collection, name]
+    return sub_resources, collected
+
+
+def with_collected_sub_resource(func):
+    """
+        Records a Load Balancer sub-resource that its Load Balancer
+        created in its configure operation, instead of adding it again.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        ctx = kwargs['ctx']
+        lb_rel = utils.get_relationship_by_type(
+            ctx.instance.relationships,
+            constants.REL_CONTAINED_IN_LB)
+        lb_props = lb_rel.target.instance.runtime_properties if lb_rel \
+            else {}
+        collected = lb_props.get(LB_SUB_RESOURCES_KEY, {}).get(
+            ctx.instance.id)
+        if not collected:
+            return func(*args, **kwargs)
+        collection, name = collected
+        ctx.instance.runtime_properties['name'] = name
+        for item in lb_props.get('resource', {}).get(collection, list()):
+            if item.get('name') == name:
+                ctx.logger.info(
+                    'Load Balancer {0} {1} was created with the '
+                    'Load Balancer.'.format(collection, name))
+                ctx.instance.runtime_properties['resource_id'] = \
+                    item.get('id')
+                ctx.instance.runtime_properties['resource'] = item
+                ctx.instance.runtime_properties['resource_group'] = \
+                    lb_props.get('resource_group')
+                return
+        return func(*args, **kwargs)
+    return wrapper
+
+
 @operation(resumable=True)
 @decorators.with_generate_name(LoadBalancer)
 def create(ctx, **_):
@@ -117,6 +284,14 @@ def configure(ctx, **_):
     # clean empty values from params
     lb_params = \
         utils.cleanup_empty_params(lb_params)
+    if ctx.node.properties.get('batch_sub_resources'):
+        lb_id = '/subscriptions/{0}/resourceGroups/{1}/providers/' \
+                'Microsoft.Network/loadBalancers/{2}'.format(
+                    load_balancer.subscription_id, resource_group_name, name)
+        sub_resources, collected = collect_sub_resources(ctx, lb_id)
+        for collection, items in sub_resources.items():
+            lb_params[collection] = lb_params.get(collection, list()) + items
+        ctx.instance.runtime_properties[LB_SUB_RESOURCES_KEY] = collected
     result = utils.handle_create(
         load_balancer,
         resource_group_name,
@@ -173,6 +348,7 @@ def attach_ip_configuration(ctx, **_):
 
 
 @operation(resumable=True)
+@with_collected_sub_resource
 @decorators.with_generate_name(LoadBalancerBackendAddressPool)
 @decorators.with_azure_resource(LoadBalancerBackendAddressPool)
 def create_backend_pool(ctx, **_):
@@ -189,25 +365,14 @@ def create_backend_pool(ctx, **_):
     lb_rel = utils.get_relationship_by_type(
         ctx.instance.relationships,
         constants.REL_CONTAINED_IN_LB)
-    lb_name = utils.get_resource_name(lb_rel.target)
-    # Get the existing pools
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_pools = lb_data.get('backend_address_pools', list())
-    lb_pools.append({
-        'name': backend_pool_name,
-    })
-    load_balancer_params = {
-        'backend_address_pools': lb_pools,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    # clean empty values from params
-    load_balancer_params = \
-        utils.cleanup_empty_params(load_balancer_params)
-    result = utils.handle_create(
+    # Add the pool to the Load Balancer
+    result = update_load_balancer(
         load_balancer,
         resource_group_name,
         load_balancer_name,
-        additional_params=load_balancer_params)
+        'backend_address_pools',
+        item={'name': backend_pool_name},
+        location=lb_rel.target.node.properties.get('location'))
     for item in result.get("backend_address_pools"):
         if item.get("name") == backend_pool_name:
             ctx.instance.runtime_properties['resource_id'] = item.get("id")
@@ -228,25 +393,18 @@ def delete_backend_pool(ctx, **_):
     lb_name = utils.get_resource_name(lb_rel.target)
     load_balancer = LoadBalancer(azure_config, ctx.logger)
     name = ctx.instance.runtime_properties.get('name')
-    # Get the existing pools
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_pools = lb_data.get('backend_address_pools', list())
-    for idx, pool in enumerate(lb_pools):
-        if pool.get('name') == name:
-            del lb_pools[idx]
-    # Update the Load Balancer with the new pool list
-    lb_params = {
-        'backend_address_pools': lb_pools,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    utils.handle_create(
+    # Remove the pool from the Load Balancer
+    update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'backend_address_pools',
+        name=name,
+        location=lb_rel.target.node.properties.get('location'))
 
 
 @operation(resumable=True)
+@with_collected_sub_resource
 @decorators.with_generate_name(LoadBalancerProbe)
 @decorators.with_azure_resource(LoadBalancerProbe)
 def create_probe(ctx, **_):
@@ -262,29 +420,20 @@ def create_probe(ctx, **_):
         ctx.instance.relationships,
         constants.REL_CONTAINED_IN_LB)
     lb_name = utils.get_resource_name(lb_rel.target)
-    # Get the existing probes
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_probes = lb_data.get('probes', list())
     lb_probe = \
         utils.handle_resource_config_params({
             'name': probe_name,
         },
             ctx.node.properties.get(
                 'resource_config', {}))
-    lb_probes.append(lb_probe)
     # Update the Load Balancer with the new probe
-    lb_params = {
-        'probes': lb_probes,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    # clean empty values from params
-    lb_params = \
-        utils.cleanup_empty_params(lb_params)
-    result = utils.handle_create(
+    result = update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'probes',
+        item=utils.cleanup_empty_params(lb_probe),
+        location=lb_rel.target.node.properties.get('location'))
     for item in result.get("probes"):
         if item.get("name") == probe_name:
             ctx.instance.runtime_properties['resource_id'] = item.get("id")
@@ -305,25 +454,18 @@ def delete_probe(ctx, **_):
     lb_name = utils.get_resource_name(lb_rel.target)
     load_balancer = LoadBalancer(azure_config, ctx.logger)
     name = ctx.instance.runtime_properties.get('name')
-    # Get the existing probes
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_probes = lb_data.get('probes', list())
-    for idx, probe in enumerate(lb_probes):
-        if probe.get('name') == name:
-            del lb_probes[idx]
-    # Update the Load Balancer with the new probes list
-    lb_params = {
-        'probes': lb_probes,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    utils.handle_create(
+    # Remove the probe from the Load Balancer
+    update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'probes',
+        name=name,
+        location=lb_rel.target.node.properties.get('location'))
 
 
 @operation(resumable=True)
+@with_collected_sub_resource
 @decorators.with_generate_name(LoadBalancerInboundNatRule)
 @decorators.with_azure_resource(LoadBalancerInboundNatRule)
 def create_incoming_nat_rule(ctx, **_):
@@ -339,9 +481,6 @@ def create_incoming_nat_rule(ctx, **_):
         ctx.instance.relationships,
         constants.REL_CONTAINED_IN_LB)
     lb_name = utils.get_resource_name(lb_rel.target)
-    # Get the existing rules
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_rules = lb_data.get('inbound_nat_rules', list())
     # Get the Load Balancer Frontend IP Configuration
     lb_fe_ipc_id = ""
     rel_type = constants.REL_CONNECTED_TO_IPC
@@ -362,20 +501,14 @@ def create_incoming_nat_rule(ctx, **_):
     },
         ctx.node.properties.get(
             'resource_config', {}))
-    lb_rules.append(lb_rule)
     # Update the Load Balancer with the new NAT rule
-    lb_params = {
-        'inbound_nat_rules': lb_rules,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    # clean empty values from params
-    lb_params = \
-        utils.cleanup_empty_params(lb_params)
-    result = utils.handle_create(
+    result = update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'inbound_nat_rules',
+        item=utils.cleanup_empty_params(lb_rule),
+        location=lb_rel.target.node.properties.get('location'))
     for item in result.get("inbound_nat_rules"):
         if item.get("name") == incoming_nat_rule_name:
             ctx.instance.runtime_properties['resource_id'] = item.get("id")
@@ -395,24 +528,17 @@ def delete_incoming_nat_rule(ctx, **_):
     lb_name = utils.get_resource_name(lb_rel.target)
     load_balancer = LoadBalancer(azure_config, ctx.logger)
     name = ctx.instance.runtime_properties.get('name')
-    # Get the existing probes
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_rules = lb_data.get('inbound_nat_rules', list())
-    for idx, rule in enumerate(lb_rules):
-        if rule.get('name') == name:
-            del lb_rules[idx]
-    # Update the Load Balancer with the new NAT rule list
-    lb_params = {
-        'inbound_nat_rules': lb_rules
-    }
-    utils.handle_create(
+    # Remove the NAT rule from the Load Balancer
+    update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'inbound_nat_rules',
+        name=name)
 
 
 @operation(resumable=True)
+@with_collected_sub_resource
 @decorators.with_generate_name(LoadBalancerLoadBalancingRule)
 @decorators.with_azure_resource(LoadBalancerLoadBalancingRule)
 def create_rule(ctx, **_):
@@ -428,7 +554,6 @@ def create_rule(ctx, **_):
         constants.REL_CONTAINED_IN_LB)
     lb_name = utils.get_resource_name(lb_rel.target)
     load_balancer = LoadBalancer(azure_config, ctx.logger)
-    lb_data = load_balancer.get(resource_group_name, lb_name)
     # Get the Load Balancer Backend Pool/ Probe/ Frontend IP Configuration
     lb_be_pool_id = ""
     lb_probe_id = ""
@@ -455,9 +580,7 @@ def create_rule(ctx, **_):
         else:
             if constants.REL_CONNECTED_TO_IPC in rel.type_hierarchy:
                 lb_fe_ipc_id = utils.get_resource_name(rel.target)
-    # Get the existing Load Balancer Rules
     # fe_ip_cfg = get_frontend_ip_configuration(constants.REL_CONNECTED_TO_IPC)
-    lb_rules = lb_data.get('load_balancing_rules', list())
     lb_rule = \
         utils.handle_resource_config_params({
             'name': lb_rule_name,
@@ -467,20 +590,14 @@ def create_rule(ctx, **_):
         },
             ctx.node.properties.get(
                 'resource_config', {}))
-    raise Exception(lb_rule)
-    lb_rules.append(lb_rule)
     # Update the Load Balancer with the new rule
-    lb_params = {
-        'load_balancing_rules': lb_rules,
-        'location': lb_rel.target.node.properties.get('location')
-    }
-    # clean empty values from params
-    lb_params = utils.cleanup_empty_params(lb_params)
-    result = utils.handle_create(
+    result = update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'load_balancing_rules',
+        item=utils.cleanup_empty_params(lb_rule),
+        location=lb_rel.target.node.properties.get('location'))
     for item in result.get("load_balancing_rules"):
         if item.get("name") == lb_rule_name:
             ctx.instance.runtime_properties['resource_id'] = item.get("id")
@@ -504,21 +621,13 @@ def delete_rule(ctx, **_):
     lb_name = utils.get_resource_name(lb_rel.target)
     load_balancer = LoadBalancer(azure_config, ctx.logger)
     name = ctx.instance.runtime_properties.get('name')
-    # Get the existing rules
-    lb_data = load_balancer.get(resource_group_name, lb_name)
-    lb_rules = lb_data.get('load_balancing_rules', list())
-    for idx, rule in enumerate(lb_rules):
-        if rule.get('name') == name:
-            del lb_rules[idx]
-    # Update the Load Balancer with the new rules list
-    lb_params = {
-        'load_balancing_rules': lb_rules
-    }
-    utils.handle_create(
+    # Remove the rule from the Load Balancer
+    update_load_balancer(
         load_balancer,
         resource_group_name,
         lb_name,
-        additional_params=lb_params)
+        'load_balancing_rules',
+        name=name)
 
 
 @operation(resumable=True)
@@ -534,24 +643,22 @@ def attach_nic_to_backend_pool(ctx, **_):
     resource_group_name = utils.get_resource_group(ctx.source)
     name = ctx.source.instance.runtime_properties['name']
     network_interface_card = NetworkInterfaceCard(azure_config, ctx.logger)
-    # Get the existing NIC IPConfigurations
-    nic_data = network_interface_card.get(resource_group_name, name)
-    nic_ip_cfgs = nic_data.get('ip_configurations', list())
-    # Add the Backend Pool to the NIC IPConfigurations
-    for ip_idx, _ in enumerate(nic_ip_cfgs):
-        nic_pools = nic_ip_cfgs[ip_idx].get(LB_ADDRPOOLS_KEY, list())
-        nic_pools.append(be_pool_id)
-        nic_ip_cfgs[ip_idx][LB_ADDRPOOLS_KEY] = nic_pools
+
+    def add_pool(nic_data):
+        nic_ip_cfgs = nic_data.get('ip_configurations', list())
+        # Add the Backend Pool to the NIC IPConfigurations
+        for ip_idx, _ in enumerate(nic_ip_cfgs):
+            nic_pools = nic_ip_cfgs[ip_idx].get(LB_ADDRPOOLS_KEY, list())
+            if be_pool_id['id'] not in [p.get('id') for p in nic_pools]:
+                nic_pools.append(be_pool_id)
+            nic_ip_cfgs[ip_idx][LB_ADDRPOOLS_KEY] = nic_pools
+        return {
+            'ip_configurations': nic_ip_cfgs,
+            'location': ctx.source.node.properties.get('location')
+        }
     # Update the NIC IPConfigurations
-    nic_params = {
-        'ip_configurations': nic_ip_cfgs,
-        'location': ctx.source.node.properties.get('location')
-    }
-    utils.handle_create(
-        network_interface_card,
-        resource_group_name,
-        name,
-        additional_params=nic_params)
+    utils.read_modify_write(
+        network_interface_card, resource_group_name, name, add_pool)
 
 
 @operation(resumable=True)
@@ -567,24 +674,19 @@ def detach_nic_from_backend_pool(ctx, **_):
     resource_group_name = utils.get_resource_group(ctx.source)
     name = ctx.source.instance.runtime_properties['name']
     network_interface_card = NetworkInterfaceCard(azure_config, ctx.logger)
-    # Get the existing NIC IPConfigurations
-    nic_data = network_interface_card.get(resource_group_name, name)
-    nic_ip_cfgs = nic_data.get('ip_configurations', list())
-    # Remove the Backend Pool from the NIC IPConfigurations
-    for ip_idx, _ in enumerate(nic_ip_cfgs):
-        nic_pools = nic_ip_cfgs[ip_idx].get(LB_ADDRPOOLS_KEY, list())
-        for pool_idx, nic_pool in enumerate(nic_pools):
-            if nic_pool != be_pool_id:
-                continue
-            del nic_pools[pool_idx]
-            nic_ip_cfgs[ip_idx][LB_ADDRPOOLS_KEY] = nic_pools
+
+    def remove_pool(nic_data):
+        nic_ip_cfgs = nic_data.get('ip_configurations', list())
+        # Remove the Backend Pool from the NIC IPConfigurations
+        for ip_idx, _ in enumerate(nic_ip_cfgs):
+            nic_pools = nic_ip_cfgs[ip_idx].get(LB_ADDRPOOLS_KEY, list())
+            nic_ip_cfgs[ip_idx][LB_ADDRPOOLS_KEY] = [
+                nic_pool for nic_pool in nic_pools
+                if nic_pool.get('id') != be_pool_id['id']]
+        return {
+            'ip_configurations': nic_ip_cfgs,
+            'location': ctx.source.node.properties.get('location')
+        }
     # Update the NIC IPConfigurations
-    nic_params = {
-        'ip_configurations': nic_ip_cfgs,
-        'location': ctx.source.node.properties.get('location')
-    }
-    utils.handle_create(
-        network_interface_card,
-        resource_group_name,
-        name,
-        additional_params=nic_params)
+    utils.read_modify_write(
+        network_interface_card, resource_group_name, name, remove_pool)
@@ -13,18 +13,31 @@
 # limitations under the License.
 
 import mock
+import shutil
+import tempfile
 import unittest
 import requests
+import threading
+import time
 
 from cloudify import constants
 from cloudify.state import current_ctx
 from cloudify import mocks as cfy_mocks
 from cloudify.exceptions import OperationRetry
 from msrestazure.azure_exceptions import CloudError
+from azure.core.exceptions import ResourceNotFoundError
 
 from cloudify_azure import utils
+from cloudify_azure.constants import SCALE_SET_INSTANCE_TAG
 from cloudify_azure.resources.compute import (availabilityset)
 from cloudify_azure.resources.compute.virtualmachine import virtualmachine
+from cloudify_azure.resources.compute.virtualmachine.virtualmachine_utils \
+    import configuration_fingerprint
+from azure_sdk.resources.compute.virtual_machine import (
+    VirtualMachine,
+    power_state_cache)
+from azure_sdk.resources.compute.virtual_machine_scale_set import \
+    VirtualMachineScaleSet
 
 
 def return_none(foo):
@@ -187,6 +200,11 @@ class VirtualMachineTest(unittest.TestCase):
     def setUp(self):
         self.fake_ctx, self.node, self.instance = \
             self._get_mock_context_for_run()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        patcher = mock.patch.object(power_state_cache, 'cache_dir', cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.dummy_azure_credentials = {
             'client_id': 'dummy',
             'client_secret': 'dummy',
@@ -266,7 +284,8 @@ class VirtualMachineTest(unittest.TestCase):
                 .virtual_machines.begin_create_or_update.assert_called_with(
                 resource_group_name=resource_group,
                 vm_name=name,
-                parameters=vm_params
+                parameters=vm_params,
+                polling=mock.ANY
             )
             self.assertEquals(
                 self.fake_ctx.instance.runtime_properties.get("name"),
@@ -380,12 +399,15 @@ class VirtualMachineTest(unittest.TestCase):
         name = 'mockvm'
         fake_ctx.instance.runtime_properties['resource_group'] = resource_group
         fake_ctx.instance.runtime_properties['name'] = name
+        client().virtual_machines.instance_view.side_effect = \
+            ResourceNotFoundError('not found')
         with mock.patch('cloudify_azure.utils.secure_logging_content',
                         mock.Mock()):
             virtualmachine.delete(ctx=fake_ctx)
             client().virtual_machines.begin_delete.assert_called_with(
                 resource_group_name=resource_group,
-                vm_name=name
+                vm_name=name,
+                polling=mock.ANY
             )
 
     def test_delete_do_not_exist(self, client, credentials):
@@ -399,6 +421,8 @@ class VirtualMachineTest(unittest.TestCase):
         message = 'resource not found'
         client().virtual_machines.get.side_effect = \
             CloudError(response, message)
+        client().virtual_machines.instance_view.side_effect = \
+            ResourceNotFoundError('not found')
         with mock.patch('cloudify_azure.utils.secure_logging_content',
                         mock.Mock()):
             virtualmachine.delete(ctx=self.fake_ctx)
@@ -422,13 +446,16 @@ class VirtualMachineTest(unittest.TestCase):
             }
             response.as_dict.return_value = message
             client().virtual_machines.get.return_value = response
+            client().virtual_machines.instance_view().as_dict\
+                .return_value = message['instance_view']
             with self.assertRaisesRegexp(
                     OperationRetry, 'Waiting for PowerState/running status'):
                 virtualmachine.start(
                     command_to_execute='', file_uris=[], ctx=fake_ctx)
             client().virtual_machines.begin_start.assert_called_with(
                 resource_group_name=resource_group,
-                vm_name=name
+                vm_name=name,
+                polling=mock.ANY
             )
 
     def test_start_started(self, client, credentials):
@@ -449,10 +476,80 @@ class VirtualMachineTest(unittest.TestCase):
             }
             response.as_dict.return_value = message
             client().virtual_machines.get.return_value = response
+            client().virtual_machines.instance_view().as_dict\
+                .return_value = message['instance_view']
             virtualmachine.start(
                 command_to_execute='', file_uris=[], ctx=fake_ctx)
             client().virtual_machines.begin_start.assert_not_called()
 
+    @mock.patch('azure_sdk.resources.network.public_ip_address.'
+                'NetworkManagementClient')
+    @mock.patch('azure_sdk.resources.network.network_interface_card.'
+                'NetworkManagementClient')
+    def test_start_nics(self, nic_client, pip_client, client, credentials):
+
+        fake_ctx, _, __ = self._get_mock_context_for_run(
+            operation={'name': 'cloudify.interfaces.lifecycle.start'})
+        fake_ctx.node.properties['azure_config'] = self.dummy_azure_credentials
+        resource_group = 'sample_resource_group'
+        name = 'mockvm'
+        fake_ctx.instance.runtime_properties['resource_group'] = resource_group
+        fake_ctx.instance.runtime_properties['name'] = name
+        rel_nics = []
+        for nic_name in ['nic0', 'nic1']:
+            rel_nic = mock.Mock()
+            rel_nic.type_hierarchy = [
+                'cloudify.relationships.azure.connected_to_nic']
+            rel_nic.target.node.properties = {
+                'azure_config': self.dummy_azure_credentials}
+            rel_nic.target.instance.runtime_properties = {
+                'resource_group': resource_group, 'name': nic_name}
+            rel_nics.append(rel_nic)
+        fake_ctx.instance.relationships = rel_nics
+        pip_id = '/subscriptions/dummy/resourceGroups/{0}/providers/' \
+                 'Microsoft.Network/publicIPAddresses/pip'.format(
+                     resource_group)
+        nics = {
+            'nic0': {
+                'virtual_machine': {'id': 'vm'},
+                'ip_configurations': [{'private_ip_address': '10.0.0.4',
+                                       'public_ip_address': {'id': pip_id}}]
+            },
+            'nic1': {
+                'virtual_machine': {'id': 'vm'},
+                'ip_configurations': [{'private_ip_address': '10.0.1.4'}]
+            },
+        }
+
+        def get_nic(resource_group_name, network_interface_name):
+            response = mock.MagicMock()
+            response.as_dict.return_value = nics[network_interface_name]
+            return response
+
+        nic_client().network_interfaces.get.side_effect = get_nic
+        public_ip = mock.MagicMock()
+        public_ip.as_dict.return_value = {
+            'id': pip_id.upper(), 'ip_address': '1.2.3.4'}
+        pip_client().public_ip_addresses.list.return_value = [public_ip]
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()):
+            client().virtual_machines.instance_view().as_dict\
+                .return_value = {'statuses': [{'code': 'PowerState/running'}]}
+            virtualmachine.start(
+                command_to_execute='', file_uris=[], ctx=fake_ctx)
+        nic_client().network_interfaces.begin_create_or_update.\
+            assert_not_called()
+        pip_client().public_ip_addresses.list.assert_called_once_with(
+            resource_group)
+        pip_client().public_ip_addresses.get.assert_not_called()
+        self.assertEqual(fake_ctx.instance.runtime_properties['ip'],
+                         '10.0.1.4')
+        self.assertEqual(fake_ctx.instance.runtime_properties['public_ip'],
+                         '1.2.3.4')
+        self.assertEqual(
+            fake_ctx.instance.runtime_properties['public_ip_addresses'],
+            ['1.2.3.4'])
+
     def test_stopped(self, client, credentials):
 
         fake_ctx, _, __ = self._get_mock_context_for_run(
@@ -469,6 +566,8 @@ class VirtualMachineTest(unittest.TestCase):
         }
         response.as_dict.return_value = message
         client().virtual_machines.get.return_value = response
+        client().virtual_machines.instance_view().as_dict\
+            .return_value = message['instance_view']
         with mock.patch('cloudify_azure.utils.secure_logging_content',
                         mock.Mock()):
             virtualmachine.stop(ctx=fake_ctx)
@@ -489,6 +588,8 @@ class VirtualMachineTest(unittest.TestCase):
             'instance_view': {'statuses': [{'code': 'PowerState/running'}]}}
         response.as_dict.return_value = message
         client().virtual_machines.get.return_value = response
+        client().virtual_machines.instance_view().as_dict\
+            .return_value = message['instance_view']
         with mock.patch('cloudify_azure.utils.secure_logging_content',
                         mock.Mock()):
             with self.assertRaisesRegexp(
@@ -499,7 +600,8 @@ class VirtualMachineTest(unittest.TestCase):
                     command_to_execute='', file_uris=[], ctx=fake_ctx)
             client().virtual_machines.begin_power_off.assert_called_with(
                 resource_group_name=resource_group,
-                vm_name=name
+                vm_name=name,
+                polling=mock.ANY
             )
 
     def test_restart(self, client, credentials):
@@ -516,10 +618,13 @@ class VirtualMachineTest(unittest.TestCase):
             response = mock.MagicMock()
             response.status_code = 200
             client().virtual_machines.get.return_value = response
+            client().virtual_machines.instance_view().as_dict\
+                .return_value = {'statuses': [{'code': 'PowerState/running'}]}
             virtualmachine.restart(ctx=fake_ctx)
             client().virtual_machines.begin_restart.assert_called_with(
                 resource_group_name=resource_group,
-                vm_name=name
+                vm_name=name,
+                polling=mock.ANY
             )
 
     def test_resize(self, client, credentials):
@@ -527,6 +632,7 @@ class VirtualMachineTest(unittest.TestCase):
         fake_ctx, _, __ = self._get_mock_context_for_run(
             operation={'name': 'cloudify.interfaces.operations.resize'})
         fake_ctx.node.properties['azure_config'] = self.dummy_azure_credentials
+        fake_ctx.node.properties['os_family'] = 'linux'
         resource_group = 'sample_resource_group'
         name = 'mockvm'
         vm_size = 'Standard_B2s'
@@ -548,8 +654,263 @@ class VirtualMachineTest(unittest.TestCase):
                 .assert_called_with(
                     resource_group_name=resource_group,
                     vm_name=name,
-                    parameters=params
+                    parameters=params,
+                    polling=mock.ANY
                 )
+            # The fingerprint is that of the resized configuration, not of
+            # the partial update.
+            configuration = virtualmachine._get_vm_create_or_update_payload(
+                fake_ctx, None, name)
+            configuration.update(params)
+            self.assertEqual(
+                fake_ctx.instance.runtime_properties[
+                    'configuration_fingerprint'],
+                configuration_fingerprint(configuration))
+            self.assertNotEqual(
+                fake_ctx.instance.runtime_properties[
+                    'configuration_fingerprint'],
+                configuration_fingerprint(params))
+
+    def test_attach_data_disks(self, client, credentials):
+
+        fake_ctx, _, __ = self._get_mock_context_for_run(
+            operation={
+                'name': 'cloudify.interfaces.operations.attach_data_disks'})
+        fake_ctx.node.properties['azure_config'] = self.dummy_azure_credentials
+        fake_ctx.node.properties['location'] = 'eastus'
+        resource_group = 'sample_resource_group'
+        name = 'mockvm'
+        fake_ctx.instance.runtime_properties['resource_group'] = resource_group
+        fake_ctx.instance.runtime_properties['name'] = name
+        client().virtual_machines.get().as_dict.return_value = {
+            'storage_profile': {'data_disks': [{'lun': 0, 'name': 'd0'},
+                                               {'lun': 1, 'name': 'old'}]}}
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()):
+            virtualmachine.attach_data_disks(
+                ctx=fake_ctx,
+                disks=[{'lun': 1, 'disk': {'name': 'd1'}},
+                       {'lun': 2, 'disk': {'name': 'd2'}}])
+        client().virtual_machines.begin_create_or_update.assert_called_with(
+            resource_group_name=resource_group,
+            vm_name=name,
+            parameters={
+                'location': 'eastus',
+                'storage_profile': {'data_disks': [
+                    {'lun': 0, 'name': 'd0'},
+                    {'lun': 1, 'name': 'd1'},
+                    {'lun': 2, 'name': 'd2'}]}},
+            polling=mock.ANY)
+
+    def test_configure_data_disks(self, client, credentials):
+
+        fake_ctx, node, instance = self._get_mock_context_for_run(
+            operation={'name': 'cloudify.interfaces.lifecycle.configure'})
+        node.properties['azure_config'] = self.dummy_azure_credentials
+        node.properties['location'] = 'eastus'
+        instance.runtime_properties['resource_group'] = 'rg'
+        instance.runtime_properties['name'] = 'vm'
+        instance.runtime_properties['configuration_fingerprint'] = \
+            configuration_fingerprint({})
+        rel_type = 'cloudify.azure.relationships.vm_connected_to_datadisk'
+        instance.relationships = []
+        # disk2 has no lun, so its relationship attaches it.
+        for i, lun in enumerate([0, 1, None]):
+            rel = mock.Mock(type=rel_type, type_hierarchy=[
+                'cloudify.relationships.connected_to', rel_type])
+            rel.target.node.properties = {'lun': lun}
+            rel.target.instance.runtime_properties = {
+                'name': 'disk{0}'.format(i),
+                'diskSizeGB': 10,
+                'uri': 'uri{0}'.format(i)}
+            instance.relationships.append(rel)
+        client().virtual_machines.get().as_dict.return_value = {
+            'storage_profile': {'data_disks': []}}
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()), \
+                mock.patch.object(virtualmachine,
+                                  '_get_vm_create_or_update_payload',
+                                  return_value={}):
+            virtualmachine.configure(ctx=fake_ctx)
+        # Both disks are attached with one update.
+        client().virtual_machines.begin_create_or_update.assert_called_once()
+        parameters = client().virtual_machines.begin_create_or_update\
+            .call_args[1]['parameters']
+        self.assertEqual(
+            [(disk['lun'], disk['vhd']['uri'])
+             for disk in parameters['storage_profile']['data_disks']],
+            [(0, 'uri0'), (1, 'uri1')])
+        self.assertEqual(instance.runtime_properties['attached_data_disks'],
+                         ['uri0', 'uri1'])
+
+        # The relationship operations have nothing left to attach.
+        rel_ctx = mock.Mock()
+        rel_ctx.source.instance.runtime_properties = \
+            instance.runtime_properties
+        rel_ctx.target = instance.relationships[0].target
+        virtualmachine.attach_data_disk(ctx=rel_ctx, lun=0)
+        client().virtual_machines.begin_create_or_update.assert_called_once()
+
+    def test_coalesced_data_disks(self, client, credentials):
+        azure_config = dict(self.dummy_azure_credentials, coalesce_window=1)
+        client().virtual_machines.get().as_dict.return_value = {
+            'etag': 'W/"1"',
+            'location': 'eastus',
+            'storage_profile': {'data_disks': [
+                {'lun': 0, 'vhd': {'uri': 'old'}}]}}
+        poller = mock.Mock()
+        poller.result().as_dict.return_value = {}
+        committing = threading.Event()
+        release = threading.Event()
+
+        def create_or_update(**_):
+            committing.set()
+            release.wait(5)
+            return poller
+
+        client().virtual_machines.begin_create_or_update.side_effect = \
+            create_or_update
+
+        def submit(**kwargs):
+            current_ctx.set(cfy_mocks.MockCloudifyContext())
+            virtualmachine.update_data_disks(
+                VirtualMachine(azure_config, mock.Mock()),
+                'rg', 'vm', **kwargs)
+
+        first = threading.Thread(target=submit, kwargs={
+            'attach': [{'lun': 3}]})
+        threads = [
+            threading.Thread(target=submit, kwargs={
+                'attach': [{'lun': lun}]}) for lun in [1, 2]] + [
+            threading.Thread(target=submit, kwargs={'detach': ['old']})]
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()):
+            first.start()
+            self.assertTrue(committing.wait(5))
+            for thread in threads:
+                thread.start()
+            key = ('dummy', 'rg', 'vm')
+            while len((utils.mutation_batcher._targets[key]['batch'] or
+                       {}).get('mutations', [])) < 3:
+                time.sleep(0.01)
+            release.set()
+            for thread in [first] + threads:
+                thread.join()
+        calls = client().virtual_machines.begin_create_or_update\
+            .call_args_list
+        self.assertEqual(len(calls), 2)
+        parameters = calls[1][1]['parameters']
+        self.assertEqual(
+            sorted(disk['lun'] for disk in
+                   parameters['storage_profile']['data_disks']), [1, 2])
+        self.assertEqual(parameters['location'], 'eastus')
+
+    @mock.patch('azure_sdk.resources.compute.virtual_machine_scale_set.'
+                'ComputeManagementClient')
+    def test_scale_out(self, vmss_client, client, credentials):
+        self.node.properties['scale_set'] = {
+            'enabled': True,
+            'virtual_machine_profile': {'network_profile': {
+                'network_api_version': '2020-11-01'}}}
+        params = virtualmachine.build_scale_set_params(self.fake_ctx, {
+            'location': 'eastus',
+            'hardware_profile': {'vm_size': 'Standard_B1s'},
+            'storage_profile': {'os_disk': {'name': 'disk',
+                                            'vhd': {'uri': 'uri'},
+                                            'create_option': 'FromImage'}},
+            'os_profile': {'computer_name': 'vm'}})
+        self.assertEqual(params['sku'], {'name': 'Standard_B1s'})
+        self.assertEqual(params['orchestration_mode'], 'Flexible')
+        self.assertEqual(
+            params['virtual_machine_profile'],
+            {'storage_profile': {'os_disk': {'create_option': 'FromImage'}},
+             'os_profile': {'computer_name_prefix': 'vm'},
+             'network_profile': {'network_api_version': '2020-11-01'}})
+
+        scale_set_id = 'vmss-id'
+        tag = SCALE_SET_INSTANCE_TAG
+        tags = {'vm0': {tag: 'old'}, 'vm1': {tag: 'other'}, 'vm2': {tag: 'b'}}
+
+        def list_vm(name):
+            vm = mock.MagicMock()
+            vm.virtual_machine_scale_set.id = scale_set_id
+            # vm1 is claimed by another process after it is listed.
+            vm.as_dict.return_value = {
+                'id': name, 'name': name,
+                'tags': {} if name == 'vm1' else tags.get(name, {})}
+            return vm
+
+        def get_vm(resource_group_name, vm_name):
+            vm = mock.Mock()
+            vm.as_dict.return_value = {
+                'name': vm_name, 'location': 'eastus',
+                'etag': 'etag-' + vm_name, 'tags': tags.get(vm_name, {})}
+            return vm
+
+        def update_vm(resource_group_name, vm_name, parameters, **_):
+            poller = mock.Mock()
+            poller.result().as_dict.return_value = dict(
+                parameters, name=vm_name)
+            return poller
+
+        vmss_client().virtual_machine_scale_sets.get().as_dict\
+            .return_value = {'id': scale_set_id, 'etag': 'W/"1"',
+                             'sku': {'capacity': 3}}
+        vmss_client().virtual_machine_scale_sets.begin_create_or_update()\
+            .result().as_dict.return_value = {'id': scale_set_id}
+        vmss_client().virtual_machine_scale_sets.begin_create_or_update\
+            .reset_mock()
+        vmss_client().virtual_machines.list.return_value = [
+            list_vm(name) for name in ['vm3', 'vm2', 'vm1', 'vm0']]
+        client().virtual_machines.get.side_effect = get_vm
+        client().virtual_machines.begin_create_or_update.side_effect = \
+            update_vm
+        scale_set_iface = VirtualMachineScaleSet(
+            self.dummy_azure_credentials, mock.Mock())
+        vm_iface = VirtualMachine(self.dummy_azure_credentials, mock.Mock())
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()):
+            result = virtualmachine._get_scale_set_virtual_machine(
+                scale_set_iface, vm_iface, 'rg', 'vmss', params, 'a', 5)
+            # a claims the first virtual machine that is still untagged.
+            self.assertEqual(result,
+                             {'name': 'vm3', 'location': 'eastus',
+                              'tags': {tag: 'a'}})
+            client().virtual_machines.begin_create_or_update\
+                .assert_called_once_with(
+                    resource_group_name='rg',
+                    vm_name='vm3',
+                    parameters={'location': 'eastus', 'tags': {tag: 'a'}},
+                    polling=mock.ANY,
+                    headers={'If-Match': 'etag-vm3'})
+            # The capacity is set to the number of node instances, with the
+            # ETag of the scale set.
+            vmss_client().virtual_machine_scale_sets.begin_create_or_update\
+                .assert_called_once()
+            kwargs = vmss_client().virtual_machine_scale_sets\
+                .begin_create_or_update.call_args[1]
+            self.assertEqual(kwargs['parameters']['sku'],
+                             {'name': 'Standard_B1s', 'capacity': 5})
+            self.assertEqual(kwargs['headers'], {'If-Match': 'W/"1"'})
+
+            tags['vm3'] = {tag: 'a'}
+            vmss_client().virtual_machine_scale_sets.get().as_dict\
+                .return_value['sku']['capacity'] = 5
+            vmss_client().virtual_machine_scale_sets.begin_create_or_update\
+                .reset_mock()
+            client().virtual_machines.begin_create_or_update.reset_mock()
+            # b already has a tagged virtual machine.
+            result = virtualmachine._get_scale_set_virtual_machine(
+                scale_set_iface, vm_iface, 'rg', 'vmss', params, 'b', 5)
+            self.assertEqual(result['name'], 'vm2')
+            # c waits for a virtual machine, without scaling out again.
+            self.assertRaises(
+                OperationRetry,
+                virtualmachine._get_scale_set_virtual_machine,
+                scale_set_iface, vm_iface, 'rg', 'vmss', params, 'c', 5)
+        vmss_client().virtual_machine_scale_sets.begin_create_or_update\
+            .assert_not_called()
+        client().virtual_machines.begin_create_or_update.assert_not_called()
 
     def test_run_command(self, client, credentials):
 
@@ -578,5 +939,6 @@ class VirtualMachineTest(unittest.TestCase):
                 .assert_called_with(
                     resource_group_name=resource_group,
                     vm_name=name,
-                    parameters=params
+                    parameters=params,
+                    polling=mock.ANY
                 )
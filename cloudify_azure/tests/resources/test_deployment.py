@@ -138,6 +138,7 @@ class DeploymentTest(unittest.TestCase):
             resource_group_name=TEST_RESOURCE_GROUP_NAME,
             deployment_name=TEST_RESOURCE_GROUP_NAME,
             parameters=AzDeployment(properties=deployment_properties),
+            polling=mock.ANY
             # verify=True
         )
         self.assertEquals(
@@ -180,6 +181,7 @@ class DeploymentTest(unittest.TestCase):
                 resource_group_name=resource_group,
                 deployment_name=resource_group,
                 parameters=AzDeployment(properties=deployment_properties),
+                polling=mock.ANY
                 # verify=True
             )
 
@@ -243,6 +245,7 @@ class DeploymentTest(unittest.TestCase):
                     resource_group_name=resource_group,
                     deployment_name=resource_group,
                     parameters=AzDeployment(properties=deployment_properties),
+                    polling=mock.ANY
                     # verify=True
                 )
             async_call = deployment_client(
@@ -289,6 +292,7 @@ class DeploymentTest(unittest.TestCase):
                 resource_group_name=resource_group,
                 deployment_name=resource_group,
                 parameters=AzDeployment(properties=deployment_properties),
+                polling=mock.ANY
                 # verify=True
             )
             async_call = deployment_client(
@@ -304,7 +308,8 @@ class DeploymentTest(unittest.TestCase):
                         mock.Mock()):
             deployment.delete(ctx=self.fake_ctx)
             rg_client().resource_groups.begin_delete.assert_called_with(
-                resource_group_name=resource_group
+                resource_group_name=resource_group,
+                polling=mock.ANY
             )
 
     def test_delete_do_not_exist(self, rg_client, deployment_client,
@@ -418,7 +423,8 @@ class DeploymentTest(unittest.TestCase):
             deployment_client().deployments.begin_what_if.assert_called_with(
                 resource_group_name=TEST_RESOURCE_GROUP_NAME,
                 deployment_name=TEST_RESOURCE_GROUP_NAME,
-                parameters=begin_what_if_properties)
+                parameters=begin_what_if_properties,
+                polling=mock.ANY)
             calculate_state_mock.assert_called_once()
 
     def test_calculate_state_no_drifts(self, *_):
@@ -96,7 +96,8 @@ class ManagedClusterTest(unittest.TestCase):
                 .managed_clusters.begin_create_or_update.assert_called_with(
                 resource_group_name=resource_group,
                 resource_name=cluster_name,
-                parameters=cluster_payload
+                parameters=cluster_payload,
+                polling=mock.ANY
             )
             self.assertEquals(
                 self.fake_ctx.instance.runtime_properties.get("name"),
@@ -150,7 +151,8 @@ class ManagedClusterTest(unittest.TestCase):
                 .managed_clusters.begin_create_or_update.assert_called_with(
                 resource_group_name=resource_group,
                 resource_name=cluster_name,
-                parameters=cluster_payload
+                parameters=cluster_payload,
+                polling=mock.ANY
             )
             self.assertEquals(
                 self.fake_ctx.instance.runtime_properties.get("name"),
@@ -253,7 +255,8 @@ class ManagedClusterTest(unittest.TestCase):
             managed_cluster.delete(ctx=fake_ctx)
             client().managed_clusters.begin_delete.assert_called_with(
                 resource_group_name=resource_group,
-                resource_name=cluster_name
+                resource_name=cluster_name,
+                polling=mock.ANY
             )
 
     def test_delete_do_not_exist(self, client, credentials):
@@ -14,12 +14,16 @@
 
 import mock
 import unittest
+import threading
+import time
 
 from cloudify.state import current_ctx
 from cloudify import mocks as cfy_mocks
 
 from . import compose_not_found_cloud_error
-from cloudify_azure.resources.network import virtualnetwork
+from cloudify_azure import utils
+from cloudify_azure.resources.network import virtualnetwork, loadbalancer
+from azure_sdk.resources.network.load_balancer import LoadBalancer
 
 
 @mock.patch('azure_sdk.common.ClientSecretCredential')
@@ -82,7 +86,8 @@ class VirtualNetworkTest(unittest.TestCase):
                 .virtual_networks.begin_create_or_update.assert_called_with(
                 resource_group_name=resource_group,
                 virtual_network_name=vnet_name,
-                parameters=vnet_params
+                parameters=vnet_params,
+                polling=mock.ANY
             )
             self.assertEquals(
                 self.fake_ctx.instance.runtime_properties.get("name"),
@@ -124,7 +129,8 @@ class VirtualNetworkTest(unittest.TestCase):
                 .virtual_networks.begin_create_or_update.assert_called_with(
                 resource_group_name=resource_group,
                 virtual_network_name=vnet_name,
-                parameters=vnet_params
+                parameters=vnet_params,
+                polling=mock.ANY
             )
             self.assertEquals(
                 self.fake_ctx.instance.runtime_properties.get("name"),
@@ -171,7 +177,8 @@ class VirtualNetworkTest(unittest.TestCase):
             virtualnetwork.delete(ctx=fake_ctx)
             client().virtual_networks.begin_delete.assert_called_with(
                 resource_group_name=resource_group,
-                virtual_network_name=vnet_name
+                virtual_network_name=vnet_name,
+                polling=mock.ANY
             )
 
     def test_delete_do_not_exist(self, client, credentials):
@@ -186,3 +193,169 @@ class VirtualNetworkTest(unittest.TestCase):
                         mock.Mock()):
             virtualnetwork.delete(ctx=self.fake_ctx)
             client().virtual_networks.begin_delete.assert_not_called()
+
+
+@mock.patch('azure_sdk.common.ClientSecretCredential')
+@mock.patch('azure_sdk.resources.network.load_balancer.'
+            'NetworkManagementClient')
+class LoadBalancerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dummy_azure_credentials = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy',
+            'coalesce_window': 1
+        }
+
+    def test_coalesced_updates(self, client, credentials):
+        client().load_balancers.get().as_dict.return_value = {
+            'etag': 'W/"1"',
+            'probes': [{'name': 'existing'}, {'name': 'old'}]}
+        poller = mock.Mock()
+        poller.result().as_dict.return_value = {'probes': []}
+        committing = threading.Event()
+        release = threading.Event()
+
+        def create_or_update(**_):
+            committing.set()
+            release.wait(5)
+            return poller
+
+        client().load_balancers.begin_create_or_update.side_effect = \
+            create_or_update
+        results = []
+
+        def submit(**kwargs):
+            current_ctx.set(cfy_mocks.MockCloudifyContext())
+            load_balancer = LoadBalancer(
+                self.dummy_azure_credentials, mock.Mock())
+            results.append(loadbalancer.update_load_balancer(
+                load_balancer, 'rg', 'lb', 'probes', **kwargs))
+
+        first = threading.Thread(target=submit, kwargs={
+            'item': {'name': 'first'}})
+        threads = [
+            threading.Thread(target=submit, kwargs={
+                'item': {'name': 'new'}, 'location': 'westus'}),
+            threading.Thread(target=submit, kwargs={'name': 'old'})
+        ]
+        with mock.patch('cloudify_azure.utils.secure_logging_content',
+                        mock.Mock()):
+            # A change with no commit in flight is committed right away.
+            first.start()
+            self.assertTrue(committing.wait(5))
+            # The changes submitted meanwhile wait for it, and are
+            # committed together.
+            for thread in threads:
+                thread.start()
+            key = ('dummy', 'rg', 'lb')
+            while len((utils.mutation_batcher._targets[key]['batch'] or
+                       {}).get('mutations', [])) < 2:
+                time.sleep(0.01)
+            release.set()
+            for thread in [first] + threads:
+                thread.join()
+        calls = client().load_balancers.begin_create_or_update.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(
+            calls[0][1]['parameters'],
+            {'probes': [{'name': 'existing'}, {'name': 'old'},
+                        {'name': 'first'}]})
+        self.assertEqual(
+            calls[1][1],
+            {'resource_group_name': 'rg',
+             'load_balancer_name': 'lb',
+             'parameters': {
+                 'probes': [{'name': 'existing'}, {'name': 'new'}],
+                 'location': 'westus'},
+             'headers': {'If-Match': 'W/"1"'},
+             'polling': mock.ANY})
+        self.assertEqual(results, [{'probes': []}] * 3)
+
+    @mock.patch('cloudify_common_sdk.utils.get_rest_client')
+    def test_collect_sub_resources(self, get_rest_client, *_):
+        lb_id = '/subscriptions/dummy/resourceGroups/rg/providers/' \
+                'Microsoft.Network/loadBalancers/lb'
+        rel_type = 'cloudify.azure.relationships.{0}'.format
+        node_type = 'cloudify.azure.nodes.network.LoadBalancer.{0}'.format
+
+        def node(node_id, type_name, **properties):
+            return mock.Mock(id=node_id, properties=properties,
+                             type_hierarchy=['cloudify.nodes.Root',
+                                             node_type(type_name)])
+
+        def instance(node_id, *rels, **runtime_properties):
+            rels = [('contained_in_load_balancer', 'lb_1')] + list(rels)
+            return mock.Mock(
+                id='{0}_1'.format(node_id), node_id=node_id,
+                runtime_properties=runtime_properties,
+                relationships=[{'type': rel_type(name), 'target_id': target}
+                               for name, target in rels])
+
+        get_rest_client().nodes.list.return_value = [
+            node('pool', 'BackendAddressPool'),
+            node('probe', 'Probe', name='hp',
+                 resource_config={'protocol': 'Tcp', 'port': 22}),
+            node('rule', 'Rule'),
+            node('nat', 'IncomingNATRule'),
+            node('external', 'BackendAddressPool',
+                 use_external_resource=True),
+        ]
+        get_rest_client().node_instances.list.return_value = [
+            instance('rule',
+                     ('connected_to_ip_configuration', 'ipc_1'),
+                     ('connected_to_lb_be_pool', 'pool_1'),
+                     ('connected_to_lb_probe', 'probe_1'), name='r'),
+            instance('nat', ('connected_to_ip_configuration', 'other_1')),
+            instance('probe'),
+            instance('pool', name='p'),
+            instance('external'),
+        ]
+        ipc = mock.Mock(type_hierarchy=[
+            rel_type('lb_connected_to_ip_configuration')])
+        ipc.target.instance.id = 'ipc_1'
+        ipc.target.instance.runtime_properties = {'name': 'fe'}
+        ctx = cfy_mocks.MockCloudifyContext(
+            node_id='lb_1', deployment_id='dep')
+        ctx.instance._relationships = [ipc]
+        current_ctx.set(ctx)
+        sub_resources, collected = loadbalancer.collect_sub_resources(
+            ctx, lb_id)
+        self.assertEqual(sub_resources, {
+            'backend_address_pools': [{'name': 'p'}],
+            'probes': [{'name': 'hp', 'protocol': 'Tcp', 'port': 22}],
+            'load_balancing_rules': [{
+                'name': 'r',
+                'frontend_ip_configuration': {
+                    'id': lb_id + '/frontendIPConfigurations/fe'},
+                'backend_address_pool': {
+                    'id': lb_id + '/backendAddressPools/p'},
+                'probe': {'id': lb_id + '/probes/hp'}}]})
+        self.assertEqual(collected, {
+            'pool_1': ['backend_address_pools', 'p'],
+            'probe_1': ['probes', 'hp'],
+            'rule_1': ['load_balancing_rules', 'r']})
+
+    def test_create_collected_sub_resource(self, *_):
+        lb = mock.Mock()
+        lb.type_hierarchy = [
+            'cloudify.azure.relationships.contained_in_load_balancer']
+        lb.target.instance.runtime_properties = {
+            'resource_group': 'rg',
+            'resource': {'probes': [{'name': 'hp', 'id': 'hp_id'}]},
+            loadbalancer.LB_SUB_RESOURCES_KEY: {'probe_1': ['probes', 'hp']}
+        }
+        ctx = cfy_mocks.MockCloudifyContext(node_id='probe_1')
+        ctx.instance._relationships = [lb]
+        current_ctx.set(ctx)
+        with mock.patch('cloudify_azure.resources.network.loadbalancer.'
+                        'update_load_balancer') as update:
+            loadbalancer.create_probe(ctx=ctx)
+        update.assert_not_called()
+        self.assertEqual(ctx.instance.runtime_properties, {
+            'name': 'hp',
+            'resource_id': 'hp_id',
+            'resource': {'name': 'hp', 'id': 'hp_id'},
+            'resource_group': 'rg'})
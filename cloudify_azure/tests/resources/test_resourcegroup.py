@@ -134,7 +134,8 @@ class ResourceGroupTest(unittest.TestCase):
                         mock.Mock()):
             resourcegroup.delete(ctx=fake_ctx)
             client().resource_groups.begin_delete.assert_called_with(
-                resource_group_name=resource_group)
+                resource_group_name=resource_group,
+                polling=mock.ANY)
 
     def test_delete_do_not_exist(self, client, credentials):
         self.node.properties['azure_config'] = self.dummy_azure_credentials
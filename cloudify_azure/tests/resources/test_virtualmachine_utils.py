@@ -19,8 +19,10 @@ from cloudify.state import current_ctx
 from cloudify import mocks as cfy_mocks
 
 from cloudify_azure.resources.compute.virtualmachine.virtualmachine_utils \
-    import (ordered,
-            diff_dictionaries,
+    import (normalize,
+            diff_paths,
+            configuration_fingerprint,
+            get_configuration_changes,
             check_if_configuration_changed)
 
 
@@ -82,56 +84,68 @@ class VirtualMachineTest(unittest.TestCase):
                                'disable_password_authentication': True}},
             'hardware_profile': {'vm_size': 'Standard_B1s'}}
 
-    def test_ordered_simple_dict(self):
+    def test_normalize_simple_dict(self):
         dict_a = {'a': 1, 'b': 2}
         dict_b = {'b': 2, 'a': 1}
-        self.assertEquals(ordered(dict_a), ordered(dict_b))
+        self.assertEquals(normalize(dict_a), normalize(dict_b))
 
-    def test_ordered_dict_with_list(self):
+    def test_normalize_dict_with_list(self):
         dict_a = {'a': [1, 2, 3]}
         dict_b = {'a': [3, 2, 1]}
         self.assertNotEquals(dict_a, dict_b)
-        self.assertEquals(ordered(dict_a), ordered(dict_b))
+        self.assertEquals(normalize(dict_a), normalize(dict_b))
 
-    def test_ordered_recursive_integers_to_str(self):
+    def test_normalize_recursive_integers_to_str(self):
         dict_a = {'a': {'b': '2', 'c': '3'}}
         dict_b = {'a': {'c': 3, 'b': 2}}
         self.assertNotEquals(dict_a, dict_b)
-        self.assertEquals(ordered(dict_a), ordered(dict_b))
+        self.assertEquals(normalize(dict_a), normalize(dict_b))
 
-    def test_ordered_recursive_list_in_list(self):
+    def test_normalize_recursive_list_in_list(self):
         dict_a = {'a': [[1, 2, 3], [4, 5, 6]]}
         dict_b = {'a': [[5, 4, 6], [2, 1, 3]]}
         self.assertNotEquals(dict_a, dict_b)
-        self.assertEquals(ordered(dict_a), ordered(dict_b))
+        self.assertEquals(normalize(dict_a), normalize(dict_b))
 
-    def test_diff_dictionaries(self):
+    def test_diff_paths(self):
         update_conf = {'a': {'b': 2}}
         current_conf = {'a': {'b': 2}}
-        self.assertEquals(diff_dictionaries(update_conf, current_conf), False)
+        self.assertEquals(
+            diff_paths(normalize(update_conf), normalize(current_conf),
+                       'conf'),
+            [])
 
-    def test_diff_dictionaries_current_conf_has_more_fields(self):
+    def test_diff_paths_current_conf_has_more_fields(self):
         update_conf = {'a': {'b': 2}}
         current_conf = {'a': {'b': 2, 'c': 3}}
-        self.assertEquals(diff_dictionaries(update_conf, current_conf), False)
+        self.assertEquals(
+            diff_paths(normalize(update_conf), normalize(current_conf),
+                       'conf'),
+            [])
 
-    def test_diff_dictionaries_update_conf_has_more_fields(self):
+    def test_diff_paths_update_conf_has_more_fields(self):
         update_conf = {'a': {'b': 2}, 'c': 3}
         current_conf = {'a': {'b': 2}}
-        self.assertEquals(diff_dictionaries(update_conf, current_conf),
-                          True)
+        self.assertEquals(
+            diff_paths(normalize(update_conf), normalize(current_conf),
+                       'conf'),
+            ['conf.c'])
 
-    def test_diff_dictionaries_update_conf_has_more_fields_recursive(self):
+    def test_diff_paths_update_conf_has_more_fields_recursive(self):
         update_conf = {'a': {'b': {'c': {'d': 4, 'e': 5}}}}
         current_conf = {'a': {'b': {'c': {'d': 4}}}}
-        self.assertEquals(diff_dictionaries(update_conf, current_conf),
-                          True)
+        self.assertEquals(
+            diff_paths(normalize(update_conf), normalize(current_conf),
+                       'conf'),
+            ['conf.a.b.c.e'])
 
-    def test_diff_dictionaries_with_list(self):
+    def test_diff_paths_with_list(self):
         update_conf = {'a': {'b': [1, 2, 3]}}
         current_conf = {'a': {'b': [3, 2, 1]}}
-        self.assertEquals(diff_dictionaries(update_conf, current_conf),
-                          False)
+        self.assertEquals(
+            diff_paths(normalize(update_conf), normalize(current_conf),
+                       'conf'),
+            [])
 
     def test_if_configuration_changed_same_conf(self):
         self.assertEquals(
@@ -167,3 +181,28 @@ class VirtualMachineTest(unittest.TestCase):
         self.assertEquals(check_if_configuration_changed(self.fake_ctx,
                                                          self.update_vm_config,
                                                          current_conf), True)
+
+    def test_configuration_changes_paths(self):
+        current_conf = deepcopy(self.update_vm_config)
+        current_conf['storage_profile']['os_disk']['disk_size_gb'] = 30
+        self.assertEqual(
+            get_configuration_changes(self.update_vm_config, current_conf),
+            [])
+        self.update_vm_config['availability_set']['id'] = 'foo'
+        self.update_vm_config['os_profile']['linux_configuration'][
+            'disable_password_authentication'] = False
+        self.assertEqual(
+            get_configuration_changes(self.update_vm_config, current_conf),
+            ['availability_set',
+             'os_profile.linux_configuration.'
+             'disable_password_authentication'])
+
+    def test_configuration_fingerprint(self):
+        other_conf = deepcopy(self.update_vm_config)
+        other_conf['tags'] = {'c': 'D', 'a': 'b'}
+        other_conf['storage_profile']['image_reference']['sku'] = '7.6'
+        self.assertEqual(configuration_fingerprint(self.update_vm_config),
+                         configuration_fingerprint(other_conf))
+        other_conf['hardware_profile']['vm_size'] = 'Standard_B2s'
+        self.assertNotEqual(configuration_fingerprint(self.update_vm_config),
+                            configuration_fingerprint(other_conf))
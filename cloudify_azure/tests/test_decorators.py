@@ -2,7 +2,11 @@ import mock
 import logging
 from unittest import TestCase
 
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
 from .. import decorators
+from azure_sdk.resources.network.subnet import Subnet
+from azure_sdk.resources.storage.storage_account import StorageAccount
 
 
 class DecoratorTests(TestCase):
@@ -76,3 +80,61 @@ class DecoratorTests(TestCase):
                 {}
             )
         )
+
+    @mock.patch('azure_sdk.resources.network.subnet.NetworkManagementClient')
+    @mock.patch('azure_sdk.common.ClientSecretCredential')
+    def test_get_unique_name(self, _, client):
+        azure_config = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+        subnet = Subnet(azure_config, self.get_logger())
+        self.assertEqual(
+            decorators.get_unique_name(subnet, 'rg', 'name', vnet_name='vnet'),
+            'name')
+
+        used = mock.Mock()
+        used.name = 'used'
+        client().subnets.list.return_value = [used]
+        with mock.patch.object(decorators, 'uuid4',
+                               side_effect=['used', 'free'] + [''] * 13):
+            self.assertEqual(
+                decorators.get_unique_name(
+                    subnet, 'rg', None, vnet_name='vnet'),
+                'free')
+        client().subnets.list.assert_called_once_with('rg', 'vnet')
+        client().subnets.get.assert_not_called()
+
+        # Fall back to checking the names one by one.
+        client().subnets.list.side_effect = HttpResponseError('Forbidden')
+        client().subnets.get.side_effect = [
+            mock.Mock(**{'as_dict.return_value': {'name': 'used'}}),
+            ResourceNotFoundError('Not found')]
+        with mock.patch.object(decorators, 'uuid4',
+                               side_effect=['used', 'free'] + [''] * 13):
+            self.assertEqual(
+                decorators.get_unique_name(
+                    subnet, 'rg', None, vnet_name='vnet'),
+                'free')
+        self.assertEqual(client().subnets.get.call_count, 2)
+
+    @mock.patch('azure_sdk.resources.storage.storage_account.'
+                'StorageManagementClient')
+    @mock.patch('azure_sdk.common.ClientSecretCredential')
+    def test_get_unique_storage_account_name(self, _, client):
+        storage_account = StorageAccount({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }, self.get_logger())
+        client().storage_accounts.check_name_availability.return_value = \
+            mock.Mock(name_available=True)
+        name = decorators.get_unique_name(storage_account, 'rg', None)
+        self.assertEqual(len(name), 21)
+        client().storage_accounts.check_name_availability\
+            .assert_called_once_with(account_name={
+                'name': name, 'type': 'Microsoft.Storage/storageAccounts'})
+        client().storage_accounts.get_properties.assert_not_called()
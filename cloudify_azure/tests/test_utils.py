@@ -2,8 +2,13 @@ import mock
 import unittest
 
 from msrestazure.azure_exceptions import CloudError
+from azure.core.exceptions import HttpResponseError
+from cloudify import exceptions as cfy_exc
+from cloudify.state import current_ctx
+from cloudify.mocks import MockCloudifyContext
 
-from cloudify_azure.utils import handle_task
+from cloudify_azure.utils import handle_task, run_task, read_modify_write
+from azure_sdk.resources.compute.virtual_machine import VirtualMachine
 
 
 class UtilsTests(unittest.TestCase):
@@ -55,3 +60,85 @@ class UtilsTests(unittest.TestCase):
             resource, resource_group_name, name, parent_name, resource_task)
         resource.task.assert_called_once_with(resource_group_name)
         self.assertEquals(result, side_effect)
+
+    @mock.patch('azure_sdk.resources.compute.virtual_machine.'
+                'ComputeManagementClient')
+    @mock.patch('azure_sdk.common.ClientSecretCredential')
+    def test_run_task_async_mode(self, _, client):
+        ctx = MockCloudifyContext(
+            node_id='vm', node_name='vm', properties={})
+        current_ctx.set(ctx)
+        self.addCleanup(current_ctx.clear)
+        virtual_machine = VirtualMachine({
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy',
+            'async_mode': True
+        }, mock.Mock())
+        poller = client().virtual_machines.begin_start.return_value
+        poller.polling_method().finished.side_effect = [False, True, False]
+        poller.continuation_token.return_value = 'token'
+
+        with self.assertRaises(cfy_exc.OperationRetry):
+            run_task(virtual_machine, 'start', 'foo', 'bar')
+        self.assertEqual(
+            ctx.instance.runtime_properties['async_op'],
+            {'task': 'VirtualMachine.start', 'continuation_token': 'token'})
+        self.assertNotIn(
+            'continuation_token',
+            client().virtual_machines.begin_start.call_args[1])
+        self.assertFalse(virtual_machine.non_blocking)
+
+        run_task(virtual_machine, 'start', 'foo', 'bar')
+        self.assertEqual(
+            client().virtual_machines.begin_start.call_args[1][
+                'continuation_token'], 'token')
+        self.assertNotIn('async_op', ctx.instance.runtime_properties)
+
+        # A resumed operation that fails is not resumed again.
+        with self.assertRaises(cfy_exc.OperationRetry):
+            run_task(virtual_machine, 'start', 'foo', 'bar')
+        client().virtual_machines.begin_start.side_effect = \
+            HttpResponseError('Conflict')
+        with self.assertRaises(HttpResponseError):
+            run_task(virtual_machine, 'start', 'foo', 'bar')
+        self.assertNotIn('async_op', ctx.instance.runtime_properties)
+
+    @mock.patch('cloudify_azure.utils.time')
+    def test_read_modify_write(self, mock_time):
+        current_ctx.set(MockCloudifyContext())
+        self.addCleanup(current_ctx.clear)
+        precondition_failed = HttpResponseError('Precondition failed')
+        precondition_failed.status_code = 412
+        resource = mock.Mock()
+        resource.get.side_effect = [
+            {'etag': 'first', 'tags': {'a': 'b'}},
+            {'etag': 'second', 'tags': {'c': 'd'}}
+        ]
+        resource.create_or_update.side_effect = [
+            precondition_failed, {'etag': 'third'}]
+
+        def add_tag(current):
+            tags = current['tags']
+            tags['x'] = 'y'
+            return {'tags': tags}
+
+        result = read_modify_write(resource, 'foo', 'bar', add_tag)
+        self.assertEqual(result, {'etag': 'third'})
+        resource.create_or_update.assert_called_with(
+            'foo', 'bar', {'tags': {'c': 'd', 'x': 'y'}}, etag='second')
+        self.assertEqual(mock_time.sleep.call_count, 1)
+
+        conflict = HttpResponseError('Conflict')
+        conflict.status_code = 409
+        resource.get.side_effect = None
+        resource.get.return_value = {'etag': 'first', 'tags': {}}
+        resource.create_or_update.side_effect = conflict
+        with self.assertRaises(HttpResponseError):
+            read_modify_write(resource, 'foo', 'bar', add_tag)
+
+        resource.create_or_update.side_effect = precondition_failed
+        with self.assertRaises(cfy_exc.OperationRetry):
+            read_modify_write(resource, 'foo', 'bar', add_tag, attempts=3)
+        self.assertEqual(mock_time.sleep.call_count, 3)
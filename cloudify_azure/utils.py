@@ -19,13 +19,18 @@
 """
 import re
 import sys
+import time
+import random
+import threading
 
 from cloudify import ctx
+from cloudify import context
 from cloudify import exceptions as cfy_exc
+from cloudify.state import current_ctx, current_workflow_ctx, NotInContext
 from cloudify_azure import constants
 
 from msrestazure.azure_exceptions import CloudError
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 if sys.version_info.major == 3 and sys.version_info.minor > 7:
     from collections.abc import Mapping
@@ -505,6 +510,19 @@ def get_resource_id_from_name(subscription_id,
     return resource_id
 
 
+def get_resource_group_from_id(resource_id):
+    """
+        Finds the resource group name in a resource ID
+
+    :returns: Resource Group name or None
+    :rtype: string
+    """
+    parts = (resource_id or '').split('/')
+    for index, part in enumerate(parts[:-1]):
+        if part.lower() == 'resourcegroups':
+            return parts[index + 1]
+
+
 def check_if_resource_exists(resource, resource_group_name, name=None):
     try:
         if name:
@@ -549,7 +567,6 @@ def handle_task(resource,
     """
     if not resource_task:
         raise RuntimeError('No resource task name provided.')
-    task = getattr(resource, resource_task)
     args = [resource_group_name]
     if parent_name:
         args.append(parent_name)
@@ -558,11 +575,61 @@ def handle_task(resource,
     if additional_params:
         args.append(additional_params)
     try:
-        return task(*args, **kwargs)
+        return run_task(resource, resource_task, *args, **kwargs)
     except (CloudError, ResourceNotFoundError) as e:
         return e
 
 
+def run_task(resource, resource_task, *args, **kwargs):
+    """
+        Calls a task on a resource. When async_mode is enabled in the client
+        config, long running operations do not block the operation: the
+        poller's continuation token is saved in the async_op runtime property
+        and OperationRetry is raised. The retry resumes the poller from the
+        token and checks the operation status once.
+
+    :param resource: A AzureResource object from azure_sdk package.
+    :param resource_task: The name of the task, e.g. create_or_update.
+    :return: The result of the task.
+    """
+    from azure_sdk.common import AzureResource, LongRunningOperationPending
+    task = getattr(resource, resource_task)
+    if not isinstance(resource, AzureResource) or \
+            ctx.type != context.NODE_INSTANCE:
+        return task(*args, **kwargs)
+    resource.retry_after = get_retry_after()
+    if not resource.creds.get('async_mode'):
+        return task(*args, **kwargs)
+    runtime_properties = ctx.instance.runtime_properties
+    op_key = '{0}.{1}'.format(type(resource).__name__, resource_task)
+    async_op = runtime_properties.get('async_op') or {}
+    if async_op.get('task') == op_key:
+        ctx.logger.debug('Resuming {0} operation.'.format(op_key))
+        resource.continuation_token = async_op.get('continuation_token')
+    resource.non_blocking = True
+    try:
+        result = task(*args, **kwargs)
+    except LongRunningOperationPending as e:
+        runtime_properties['async_op'] = {
+            'task': op_key,
+            'continuation_token': e.continuation_token
+        }
+        raise cfy_exc.OperationRetry(
+            'Waiting for {0} operation to complete.'.format(op_key),
+            retry_after=get_retry_after())
+    except Exception:
+        # The operation failed, so there is nothing left to resume, and
+        # with_azure_resource must not keep treating it as pending.
+        if async_op.get('task') == op_key:
+            del runtime_properties['async_op']
+        raise
+    finally:
+        resource.non_blocking = False
+    if async_op.get('task') == op_key:
+        del runtime_properties['async_op']
+    return result
+
+
 def handle_delete(_ctx,
                   resource,
                   resource_group_name,
@@ -611,6 +678,57 @@ def handle_create(resource,
     return cr
 
 
+def is_concurrent_update_error(error):
+    """Whether a failed write lost a race with another writer."""
+    code = getattr(getattr(error, 'error', None), 'code', None)
+    return getattr(error, 'status_code', None) == 412 or code in (
+        'PreconditionFailed', 'AnotherOperationInProgress')
+
+
+def read_modify_write(resource,
+                      resource_group_name,
+                      name,
+                      mutate,
+                      attempts=constants.RMW_ATTEMPTS,
+                      backoff=constants.RMW_BACKOFF):
+    """
+        Updates a resource with optimistic concurrency. The resource is read,
+        mutate is applied to it, and the result is written with an If-Match
+        header holding the ETag of the read. If the resource was changed by
+        another writer meanwhile, or another operation on it is in progress,
+        the cycle is repeated after a jittered exponential backoff.
+
+    :param resource: A AzureResource object whose create_or_update accepts
+        an etag.
+    :param resource_group_name: An Azure resource group name.
+    :param name: The name of the resource.
+    :param mutate: Callable that gets the current resource as a dict and
+        returns the parameters to write, or None if no update is needed.
+    :return: The updated resource.
+    """
+    for attempt in range(attempts):
+        current = resource.get(resource_group_name, name)
+        params = mutate(current)
+        if params is None:
+            return current
+        try:
+            return run_task(resource, 'create_or_update', resource_group_name,
+                            name, params, etag=current.get('etag'))
+        except HttpResponseError as e:
+            if not is_concurrent_update_error(e):
+                raise
+            error = e
+        if attempt + 1 < attempts:
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            ctx.logger.debug(
+                'Concurrent update of {0}, retrying in {1:.1f}s: {2}'.format(
+                    name, delay, error))
+            time.sleep(delay)
+    raise cfy_exc.OperationRetry(
+        'Could not update {0} after {1} attempts: {2}'.format(
+            name, attempts, error))
+
+
 def check_types_in_hierarchy(types, hierarchy):
     """ When we deprecated old node types, like
     cloudify.azure.nodes.VirtualMachine in favor of
@@ -626,3 +744,105 @@ def check_types_in_hierarchy(types, hierarchy):
     elif types in hierarchy:
         return True
     return False
+
+
+class MutationBatcher(object):
+    """
+        Group commit of mutations to a single Azure resource.
+
+        Operations running in the same process submit their change to a
+        target resource. A change to a target with no commit in flight is
+        committed right away. Changes submitted while a commit of the same
+        target is in flight are collected, and applied together with one
+        commit when it ends, and all of their submitters get the result of
+        that commit.
+
+        Batching only merges submitters of the same process, e.g. the
+        threads of a workflow, as operations that run in separate processes
+        each have their own batcher.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._targets = {}
+
+    def submit(self, key, mutation, commit, window=0):
+        """
+            Submits a mutation and waits for the commit that includes it.
+
+        :param key: Identifies the target resource.
+        :param mutation: The change to apply, as understood by commit.
+        :param commit: Callable that gets the list of mutations and applies
+            them in a single write.
+        :param window: Seconds to wait for a commit of the same target in
+            flight before committing anyway. 0 does not wait.
+        :return: The result of commit.
+        """
+        with self._lock:
+            target = self._targets.setdefault(
+                key, {'committing': 0, 'batch': None})
+            batch = target['batch']
+            leader = batch is None
+            if leader:
+                batch = target['batch'] = {
+                    'mutations': [],
+                    'done': threading.Event(),
+                    'result': None,
+                    'error': None
+                }
+            batch['mutations'].append(mutation)
+            if leader:
+                if target['committing'] and window:
+                    self._lock.wait_for(
+                        lambda: not target['committing'], window)
+                target['batch'] = None
+                target['committing'] += 1
+        if not leader:
+            batch['done'].wait()
+        else:
+            try:
+                batch['result'] = commit(batch['mutations'])
+            except Exception as e:
+                batch['error'] = e
+            finally:
+                with self._lock:
+                    target['committing'] -= 1
+                    if not target['committing'] and target['batch'] is None:
+                        del self._targets[key]
+                    self._lock.notify_all()
+                batch['done'].set()
+        if batch['error'] is not None:
+            raise batch['error']
+        return batch['result']
+
+
+mutation_batcher = MutationBatcher()
+
+
+def in_calling_context(func):
+    """
+        Wraps func to run in the operation and workflow contexts of the
+        calling thread. The contexts are thread-local, so pool threads do
+        not have them otherwise, and without the operation context they do
+        not share its operation cache.
+    """
+    contexts = []
+    for state in (current_ctx, current_workflow_ctx):
+        try:
+            contexts.append(
+                (state, state.get_ctx(), state.get_parameters()))
+        except NotInContext:
+            continue
+    if not contexts:
+        return func
+
+    def call(remaining, args, kwargs):
+        if not remaining:
+            return func(*args, **kwargs)
+        state, _ctx, parameters = remaining[0]
+        with state.push(_ctx, parameters):
+            return call(remaining[1:], args, kwargs)
+
+    def wrapper(*args, **kwargs):
+        return call(contexts, args, kwargs)
+    return wrapper
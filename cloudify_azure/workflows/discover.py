@@ -13,15 +13,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+import random
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait
+)
+
 from cloudify.decorators import workflow
 from cloudify.workflows import ctx as wtx
 from cloudify.exceptions import NonRecoverableError
 
 from .resources import (
-    get_resources,
-    get_locations
+    chunks,
+    discover,
+    iter_rows,
+    SpillFile,
+    apply_delta,
+    get_locations,
+    get_watermark,
+    iter_resources,
+    list_resource_ids,
+    get_subscription_ids,
+    get_discovery_options
 )
+from .. import utils
+from .. import constants
 from cloudify_common_sdk.utils import (
+    with_rest_client,
     create_deployments,
     install_deployments
 )
@@ -32,26 +54,129 @@ AZURE_TYPE = 'cloudify.azure.nodes.resources.Azure'
 def discover_resources(node_id=None,
                        resource_types=None,
                        locations=None,
+                       backend=None,
+                       incremental=False,
+                       spill_dir=None,
+                       new_state=None,
                        ctx=None,
                        **_):
+    """Discover resources and store them in the account node instance's
+    resources runtime property.
+
+    :param incremental: Merge the discovered resources into the stored
+        ones and return only the newly discovered resources, see
+        resources.apply_delta.
+    :param spill_dir: Stream the discovered resources to a file in this
+        directory, and store its path in the resources_file runtime property
+        instead. Not used in incremental mode.
+    :param new_state: In incremental mode, a dict that gets the resources and
+        discovery_state runtime properties instead of storing them, so that
+        the caller stores them once the new resources were handled.
+    :return: The discovered resources, or the SpillFile with them.
+    """
 
     discovered_resources = {}
     ctx = ctx or wtx
     node_id = node_id or get_azure_account_node_id(ctx.nodes)
     node = ctx.get_node(node_id)
     for node_instance in node.instances:
+        resource_config = node.properties.get('resource_config', {})
         if not isinstance(locations, list) and not locations:
-            locations = get_locations(node, ctx.deployment.id)
-        resources = get_resources(node, locations, resource_types, ctx.logger)
-        discovered_resources.update(resources)
-        node_instance._node_instance.runtime_properties['resources'] = \
-            resources
+            locations = get_locations(
+                node,
+                ctx.deployment.id,
+                ctx.logger,
+                subscription_ids=resource_config.get('subscription_ids'))
+        options = get_discovery_options(resource_config)
+        options['backend'] = backend or options['backend']
+        runtime_properties = node_instance._node_instance.runtime_properties
+        if spill_dir and not incremental:
+            spill_file = SpillFile(os.path.join(
+                spill_dir,
+                '{d}-{i}.jsonl'.format(d=ctx.deployment.id,
+                                       i=node_instance.id)))
+            count = spill_file.write(iter_resources(
+                node, locations, resource_types, ctx.logger, **options))
+            ctx.logger.info('Wrote {n} discovered resources to {p}.'.format(
+                n=count, p=spill_file.path))
+            runtime_properties.pop('resources', None)
+            runtime_properties['resources_file'] = spill_file.path
+            return spill_file
+        if not incremental:
+            resources = discover(
+                node, locations, resource_types, ctx.logger, **options)
+            discovered_resources.update(resources)
+            runtime_properties['resources'] = resources
+            return discovered_resources
+        state = runtime_properties.get('discovery_state')
+        graph = options['backend'] == 'resource_graph'
+        present = None
+        if graph:
+            # Only list the resources that changed since the last run, and
+            # the IDs of the others.
+            options['changed_since'] = get_watermark(
+                state, resource_types, locations)
+            if options['changed_since']:
+                present = list_resource_ids(node,
+                                            locations,
+                                            resource_types,
+                                            ctx.logger,
+                                            ctx.deployment.id,
+                                            options['subscription_ids'])
+        resources = discover(
+            node, locations, resource_types, ctx.logger, **options)
+        delta, state, merged = apply_delta(
+            runtime_properties.get('resources'),
+            state,
+            resources,
+            resource_types,
+            present=present,
+            subscription_ids=get_subscription_ids(
+                node,
+                ctx.logger,
+                ctx.deployment.id,
+                options['subscription_ids']),
+            locations=locations if graph else None)
+        ctx.logger.info(
+            'Discovered {c} new, {u} changed and {d} deleted '
+            'resources.'.format(c=len(delta['created']),
+                                u=len(delta['changed']),
+                                d=len(delta['deleted'])))
+        if isinstance(new_state, dict):
+            new_state.update(resources=merged, discovery_state=state)
+        else:
+            runtime_properties['resources'] = merged
+            runtime_properties['discovery_state'] = state
+            update_runtime_properties(node_instance)
+        created = set(delta['created'])
+        for location, types in resources.items():
+            for resource_type, entries in types.items():
+                for resource_id, resource in entries.items():
+                    if resource_id in created:
+                        discovered_resources.setdefault(
+                            location, {}).setdefault(
+                                resource_type, {})[resource_id] = resource
         return discovered_resources
     raise NonRecoverableError(
         'No node instances of the provided node ID {n} exist. '
         'Please install the account blueprint.'.format(n=node_id))
 
 
+@with_rest_client
+def update_runtime_properties(node_instance, rest_client):
+    """Store the runtime properties of a workflow node instance.
+
+    :param node_instance: A workflow context node instance.
+    :param rest_client: A Cloudify REST client.
+    """
+    updated = rest_client.node_instances.update(
+        node_instance.id,
+        runtime_properties=node_instance._node_instance.runtime_properties,
+        version=node_instance._node_instance.version)
+    # Later updates in the same workflow need the new version.
+    node_instance._node_instance['version'] = updated.version
+
+
 def deploy_resources(group_id,
                      blueprint_id,
                      deployment_ids,
@@ -83,6 +208,11 @@ def discover_and_deploy(node_id=None,
                         resource_types=None,
                         regions=None,
                         blueprint_id=None,
+                        backend=None,
+                        incremental=False,
+                        spill_dir=None,
+                        chunk_size=None,
+                        max_workers=None,
                         ctx=None,
                         **_):
     """This workflow will check against the parent "Account" node for
@@ -93,6 +223,14 @@ def discover_and_deploy(node_id=None,
     :param resource_types: List of crawlable types. (AWS::EKS::CLUSTER)
     :param regions: List of regions.
     :param blueprint_id: The blueprint ID to create child deployments with.
+    :param backend: management or resource_graph, by default the backend
+        in the account node's resource_config.
+    :param incremental: Only deploy resources that were not discovered
+        before.
+    :param spill_dir: A directory to stream the discovered resources to,
+        instead of keeping them in memory.
+    :param chunk_size: How many child deployments to create per request.
+    :param max_workers: How many requests to run at the same time.
     :param ctx:
     :param _:
     :return:
@@ -102,18 +240,69 @@ def discover_and_deploy(node_id=None,
     blueprint_id = blueprint_id or ctx.blueprint.id
     label_list = [{'csys-env-type': 'environment'},
                   {'csys-obj-parent': ctx.deployment.id}]
+    # The new discovery state is only stored once the deployments of the
+    # new resources were created, so that a failed run finds them again.
+    new_state = {}
     # Refresh the AZURE_TYPE nodes list..
     resources = discover_resources(node_id=node_id,
                                    resource_types=resource_types,
                                    regions=regions,
+                                   backend=backend,
+                                   incremental=incremental,
+                                   spill_dir=spill_dir,
+                                   new_state=new_state,
                                    ctx=ctx)
-    # Loop over the resources to create new deployments from them.
-    resource_type = None
-    for _, resource_types in resources.items():
-        deployment_ids_list = []
-        inputs_list = []
-        for resource_type, resources in resource_types.items():
-            for resource_id, _ in resources.items():
+    node_id = node_id or get_azure_account_node_id(ctx.nodes)
+    node_instance = ctx.get_node(node_id).instances[0]
+    if incremental and not resources:
+        ctx.logger.info('No new resources were discovered.')
+        store_state(node_instance, new_state)
+        return
+    if not isinstance(resources, SpillFile):
+        resources = iter_rows(resources)
+    deploy_in_chunks(get_deployment_batches(resources,
+                                            ctx.deployment.id,
+                                            chunk_size),
+                     node_instance,
+                     blueprint_id,
+                     label_list,
+                     max_workers=max_workers,
+                     ctx=ctx)
+    store_state(node_instance, new_state)
+    install_deployments(ctx.deployment.id)
+
+
+def store_state(node_instance, new_state):
+    """Store the runtime properties that incremental discovery deferred.
+
+    :param node_instance: The account node instance.
+    :param new_state: The deferred runtime properties, see
+        discover_resources.
+    """
+    if new_state:
+        node_instance._node_instance.runtime_properties.update(new_state)
+        update_runtime_properties(node_instance)
+
+
+def get_deployment_batches(rows, deployment_id, chunk_size=None):
+    """Turn discovered resources into batches of child deployments of one
+    resource type.
+
+    :param rows: Discovered resources, see resources.iter_resources.
+    :param deployment_id: The parent deployment ID.
+    :param chunk_size: The maximum number of deployments in a batch.
+    :return: A generator of (resource type, deployment IDs, inputs).
+    """
+    chunk_size = chunk_size or constants.DEPLOY_CHUNK_SIZE
+    for chunk in chunks(rows, chunk_size):
+        resource_ids = OrderedDict()
+        for location, resource_type, resource_id, _ in chunk:
+            resource_ids.setdefault(
+                (location, resource_type), []).append(resource_id)
+        for (_, resource_type), ids in resource_ids.items():
+            deployment_ids_list = []
+            inputs_list = []
+            for resource_id in ids:
                 # We are now at the resource level.
                 # Create the inputs and deployment ID for the new deployment.
                 resource_name = resource_id.split('/')
@@ -124,22 +313,103 @@ def discover_and_deploy(node_id=None,
                     }
                 )
                 deployment_ids_list.append(
-                    generate_deployment_ids(
-                        ctx.deployment.id, resource_name[-1])
+                    generate_deployment_ids(deployment_id, resource_name[-1])
                 )
+            yield resource_type, deployment_ids_list, inputs_list
+
+
+def deploy_in_chunks(batches,
+                     node_instance,
+                     blueprint_id,
+                     labels,
+                     max_workers=None,
+                     attempts=constants.DEPLOY_ATTEMPTS,
+                     backoff=constants.DEPLOY_BACKOFF,
+                     ctx=None):
+    """Create child deployments, several batches at a time.
+
+    The IDs of the created deployments are stored in the deployed runtime
+    property of the account node instance as each batch completes, and
+    are skipped by later runs, so that an interrupted run resumes where
+    it stopped. The property is removed when all batches were created.
+
+    :param batches: (resource type, deployment IDs, inputs), see
+        get_deployment_batches.
+    :param node_instance: The account node instance.
+    :param blueprint_id: The child blueprint ID.
+    :param labels: The labels of all child deployments.
+    :param max_workers: How many batches to create at the same time.
+    :param attempts: How many times to try a batch.
+    :param backoff: The base delay between attempts, in seconds.
+    :param ctx:
+    :raises NonRecoverableError: if a batch still failed after all attempts.
+    """
+    max_workers = max_workers or constants.DEPLOY_MAX_WORKERS
+    runtime_properties = node_instance._node_instance.runtime_properties
+    deployed = set(runtime_properties.get('deployed', []))
 
-            if deployment_ids_list:
-                label_list.append({'csys-env-type': resource_type})
+    def deploy(resource_type, deployment_ids, inputs):
+        batch_labels = labels + [{'csys-env-type': resource_type}]
+        for attempt in range(attempts):
+            try:
                 deploy_resources(ctx.deployment.id,
                                  blueprint_id,
-                                 deployment_ids_list,
-                                 inputs_list,
-                                 label_list,
+                                 deployment_ids,
+                                 inputs,
+                                 batch_labels,
                                  ctx)
-                del label_list[-1]
-            deployment_ids_list = []
-            inputs_list = []
-    install_deployments(ctx.deployment.id)
+                return
+            except Exception as e:
+                if attempt + 1 >= attempts:
+                    raise
+                ctx.logger.error(
+                    'Failed to create deployments {d}: {e}, '
+                    'retrying.'.format(d=deployment_ids, e=e))
+                time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+    deploy = utils.in_calling_context(deploy)
+
+    def record(futures):
+        errors = []
+        for future in futures:
+            deployment_ids = pending.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                errors.append('{d}: {e}'.format(d=deployment_ids, e=e))
+                continue
+            deployed.update(deployment_ids)
+        runtime_properties['deployed'] = sorted(deployed)
+        update_runtime_properties(node_instance)
+        return errors
+
+    errors = []
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for resource_type, deployment_ids, inputs in batches:
+            remaining = [(deployment_id, deployment_input)
+                         for deployment_id, deployment_input
+                         in zip(deployment_ids, inputs)
+                         if deployment_id not in deployed]
+            if not remaining:
+                continue
+            deployment_ids, inputs = [list(i) for i in zip(*remaining)]
+            # Only read as many batches ahead as there are workers.
+            if len(pending) >= max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                errors.extend(record(done))
+            future = executor.submit(
+                deploy, resource_type, deployment_ids, inputs)
+            pending[future] = deployment_ids
+        if pending:
+            errors.extend(record(list(pending)))
+    if errors:
+        raise NonRecoverableError(
+            'Failed to create these deployments, run the workflow again to '
+            'resume: {e}.'.format(e=', '.join(errors)))
+    if 'deployed' in runtime_properties:
+        del runtime_properties['deployed']
+        update_runtime_properties(node_instance)
 
 
 def get_azure_account_node_id(nodes):
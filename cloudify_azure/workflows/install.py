@@ -0,0 +1,217 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from cloudify.decorators import workflow
+from cloudify.workflows import ctx as wtx
+from cloudify.workflows.tasks import HandlerResult
+from cloudify.exceptions import NonRecoverableError
+
+from .. import constants
+
+
+def get_levels(node_instances):
+    """Sort node instances into dependency levels. The instances in a level
+    only depend on instances in earlier levels, through their relationships,
+    i.e. the Azure relationships in constants, so each level can be
+    installed all at once.
+
+    :param node_instances: Workflow context node instances.
+    :return: A list of levels, each a list of node instances.
+    """
+    instances = dict((instance.id, instance) for instance in node_instances)
+    dependencies = dict(
+        (instance.id, set(relationship.target_id
+                          for relationship in instance.relationships
+                          if relationship.target_id in instances))
+        for instance in node_instances)
+    levels = []
+    while dependencies:
+        level = sorted(instance_id
+                       for instance_id, targets in dependencies.items()
+                       if not targets)
+        if not level:
+            raise NonRecoverableError(
+                'The node instances {i} have circular '
+                'dependencies.'.format(i=sorted(dependencies)))
+        for instance_id in level:
+            del dependencies[instance_id]
+        for targets in dependencies.values():
+            targets.difference_update(level)
+        levels.append([instances[instance_id] for instance_id in level])
+    return levels
+
+
+def get_critical_path(levels, durations):
+    """Find the chain of dependent node instances that took the longest to
+    install, which bounds the duration of the whole install.
+
+    :param levels: See get_levels.
+    :param durations: A dict of node instance ID to install time.
+    :return: A tuple of (node instance IDs, total seconds).
+    """
+    finish = {}
+    previous = {}
+    for level in levels:
+        for instance in level:
+            start = 0
+            for relationship in instance.relationships:
+                target_id = relationship.target_id
+                if finish.get(target_id, -1) > start:
+                    start = finish[target_id]
+                    previous[instance.id] = target_id
+            finish[instance.id] = start + durations.get(instance.id, 0)
+    if not finish:
+        return [], 0
+    instance_id = max(finish, key=lambda i: finish[i])
+    total = finish[instance_id]
+    path = [instance_id]
+    while instance_id in previous:
+        instance_id = previous[instance_id]
+        path.insert(0, instance_id)
+    return path, total
+
+
+def get_subscription(node):
+    """The subscription that a node's operations call, for the concurrency
+    cap. Nodes without a client config share the default subscription.
+    """
+    client_config = node.properties.get('client_config') or \
+        node.properties.get('azure_config') or {}
+    return str(client_config.get('subscription_id', ''))
+
+
+def get_priorities(levels):
+    """Rank node instances by the longest chain of node instances that
+    depend on them, so that the instances on the critical path of the
+    install are started first.
+
+    :param levels: See get_levels.
+    :return: A dict of node instance ID to the length of the chain.
+    """
+    priorities = {}
+    for level in reversed(levels):
+        for instance in level:
+            priorities.setdefault(instance.id, 1)
+            for relationship in instance.relationships:
+                target_id = relationship.target_id
+                priorities[target_id] = max(priorities.get(target_id, 1),
+                                            priorities[instance.id] + 1)
+    return priorities
+
+
+def record_finish(subgraph, instance_id, finished):
+    """Record the time that a node instance's install subgraph succeeds,
+    keeping the subgraph's own on_success handler.
+
+    :param subgraph: The install subgraph of the node instance.
+    :param instance_id: The node instance ID.
+    :param finished: A dict of node instance ID to finish time to update.
+    """
+    handler = subgraph.on_success
+
+    def on_success(task):
+        finished[instance_id] = time.time()
+        return handler(task) if handler else HandlerResult.cont()
+    subgraph.on_success = on_success
+
+
+def get_durations(waits, finished, started):
+    """Find how long each node instance took to install. A subgraph starts
+    when the last subgraph that it waits for finishes, or when the
+    workflow starts.
+
+    :param waits: A dict of node instance ID to the IDs it waits for.
+    :param finished: A dict of node instance ID to finish time.
+    :param started: The time that the graph was executed.
+    :return: A dict of node instance ID to install time.
+    """
+    return dict(
+        (instance_id,
+         finished[instance_id] - max(
+             [finished.get(target_id, started) for target_id in targets] +
+             [started]))
+        for instance_id, targets in waits.items()
+        if instance_id in finished)
+
+
+@workflow
+def parallel_install(max_concurrency=None, ctx=None, **_):
+    """Install the deployment with a task graph, in which each node
+    instance's install lifecycle depends on the node instances that it has
+    relationships to, so that all of the independent instances run at once.
+    At most max_concurrency node instances of a subscription run at the
+    same time: the instances of a subscription are ordered by dependency
+    level and critical path, and each waits for the one max_concurrency
+    places before it. Node instances that are already started are skipped,
+    so the workflow can be resumed.
+
+    :param max_concurrency: The maximum number of node instances to
+        install at the same time in one subscription.
+    :param ctx:
+    :param _:
+    :return: The critical path, as a tuple of (node instance IDs, seconds
+        that the install took).
+    """
+
+    from cloudify.plugins import lifecycle
+    ctx = ctx or wtx
+    max_concurrency = max_concurrency or constants.INSTALL_MAX_CONCURRENCY
+    node_instances = [instance for node in ctx.nodes
+                      for instance in node.instances]
+    levels = get_levels(node_instances)
+    priorities = get_priorities(levels)
+    pending = [instance for level in levels
+               for instance in sorted(level,
+                                      key=lambda i: -priorities[i.id])
+               if instance.state != 'started']
+    graph = ctx.graph_mode()
+    subgraphs = dict(
+        (instance.id,
+         lifecycle.install_node_instance_subgraph(instance, graph))
+        for instance in pending)
+    lanes = {}
+    waits = {}
+    finished = {}
+    for instance in pending:
+        subgraph = subgraphs[instance.id]
+        record_finish(subgraph, instance.id, finished)
+        targets = waits.setdefault(instance.id, set())
+        for relationship in instance.relationships:
+            if relationship.target_id in subgraphs:
+                graph.add_dependency(
+                    subgraph, subgraphs[relationship.target_id])
+                targets.add(relationship.target_id)
+        lane = lanes.setdefault(get_subscription(instance.node), [])
+        if len(lane) >= max_concurrency:
+            graph.add_dependency(
+                subgraph, subgraphs[lane[-max_concurrency].id])
+            targets.add(lane[-max_concurrency].id)
+        lane.append(instance)
+    ctx.logger.info(
+        'Installing {n} node instances in {l} levels, at most {c} at a time '
+        'per subscription.'.format(
+            n=len(pending), l=len(levels), c=max_concurrency))
+    started = time.time()
+    graph.execute()
+    path, _ = get_critical_path(
+        levels, get_durations(waits, finished, started))
+    total = time.time() - started
+    ctx.logger.info(
+        'Installed {n} node instances in {l} levels, in {t:.1f} seconds. '
+        'The critical path is {p}.'.format(
+            n=len(pending), l=len(levels), t=total, p=' -> '.join(path)))
+    return path, total
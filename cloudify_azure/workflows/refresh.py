@@ -0,0 +1,165 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+from cloudify.decorators import workflow
+from cloudify.workflows import ctx as wtx
+
+from .. import constants
+from .discover import update_runtime_properties
+from .resources import get_resource_interface
+from .uninstall import get_resource_group_name
+from ..resources.network.publicipaddress import PUBLIC_IP_PROPERTY
+from azure_sdk.resources.compute.virtual_machine import VirtualMachine
+from azure_sdk.resources.network.public_ip_address import PublicIPAddress
+from azure_sdk.resources.network.network_interface_card import \
+    NetworkInterfaceCard
+
+
+def refresh_virtual_machine(runtime_properties, resource):
+    runtime_properties['power_state'] = resource['power_state']
+
+
+def refresh_network_interface_card(runtime_properties, resource):
+    runtime_properties['resource'] = resource
+    for ip_cfg in resource.get('ip_configurations', []):
+        if ip_cfg.get('primary', True):
+            runtime_properties['ip'] = ip_cfg.get('private_ip_address')
+            break
+
+
+def refresh_public_ip_address(runtime_properties, resource):
+    runtime_properties['resource'] = resource
+    runtime_properties[PUBLIC_IP_PROPERTY] = resource.get('ip_address')
+
+
+# The node types that can be refreshed, with the resource class, the
+# default API version and the function that stores a listed resource in
+# runtime properties. The power states of virtual machines are read once
+# per subscription, see VirtualMachine.get_power_states, and the rest are
+# listed once per resource group.
+REFRESH_TYPES = [
+    (constants.VM_NODE_TYPE, VirtualMachine, constants.API_VER_COMPUTE,
+     refresh_virtual_machine),
+    (constants.NIC_NODE_TYPE, NetworkInterfaceCard,
+     constants.API_VER_NETWORK, refresh_network_interface_card),
+    (constants.PIP_NODE_TYPE, PublicIPAddress, constants.API_VER_NETWORK,
+     refresh_public_ip_address),
+]
+
+
+def get_refresh_type(node):
+    for node_types, class_decl, api_version, refresh in REFRESH_TYPES:
+        if any(node_type in node_types for node_type in node.type_hierarchy):
+            return class_decl, api_version, refresh
+
+
+def group_node_instances(node_instances):
+    """Group the node instances that have a resource ID by the list call
+    that returns their resources.
+
+    :param node_instances: Workflow context node instances.
+    :return: An ordered dict of (class, API version, subscription ID,
+        resource group name) to a list of node instances.
+    """
+    instances = dict((instance.id, instance) for instance in node_instances)
+    groups = OrderedDict()
+    for instance in node_instances:
+        refresh_type = get_refresh_type(instance.node)
+        if not refresh_type or not \
+                instance._node_instance.runtime_properties.get('resource_id'):
+            continue
+        class_decl, api_version, _ = refresh_type
+        api_version = instance.node.properties.get('api_version', api_version)
+        # The subscription ID may be an intrinsic function.
+        subscription_id = str((instance.node.properties.get(
+            'client_config') or {}).get('subscription_id'))
+        if class_decl is VirtualMachine:
+            resource_group_name = None
+        else:
+            resource_group_name = get_resource_group_name(instance, instances)
+        key = (class_decl, api_version, subscription_id, resource_group_name)
+        groups.setdefault(key, []).append(instance)
+    return groups
+
+
+def list_group(key, instances, logger, deployment_id):
+    """List the resources of one group with a single call.
+
+    :return: A dict of lower case resource ID to resource. The resource of
+        a virtual machine only has its power_state.
+    """
+    class_decl, api_version, _, resource_group_name = key
+    resource = get_resource_interface(
+        instances[0].node, class_decl, logger, deployment_id,
+        api_version=api_version)
+    if class_decl is not VirtualMachine:
+        return dict((item['id'].lower(), item)
+                    for item in resource.list_by_scope(resource_group_name))
+    resource_ids = dict(
+        (tuple(resource_id.split('/')[i] for i in (4, -1)), resource_id)
+        for resource_id in (
+            instance._node_instance.runtime_properties['resource_id']
+            for instance in instances))
+    return dict(
+        (resource_ids[name].lower(), {'power_state': power_state})
+        for name, power_state in resource.get_power_states(
+            list(resource_ids)).items()
+        if power_state is not None)
+
+
+@workflow
+def refresh_status(node_ids=None, ctx=None, **_):
+    """Refresh the power states of virtual machines and the IP addresses
+    of network interface cards and public IP addresses, with one list call
+    per type and resource group instead of a call per node instance.
+
+    :param node_ids: Only refresh the instances of these nodes.
+    :param ctx:
+    :param _:
+    :return: A dict with the IDs of the updated node instances, and of
+        those whose resources no longer exist.
+    """
+
+    ctx = ctx or wtx
+    node_instances = [instance for node in ctx.nodes
+                      for instance in node.instances
+                      if instance.state != 'deleted' and
+                      (not node_ids or node.id in node_ids)]
+    updated = []
+    missing = []
+    for key, instances in group_node_instances(node_instances).items():
+        _, _, refresh = get_refresh_type(instances[0].node)
+        resources = list_group(
+            key, instances, ctx.logger, ctx.deployment.id)
+        for instance in instances:
+            runtime_properties = instance._node_instance.runtime_properties
+            resource = resources.get(
+                runtime_properties['resource_id'].lower())
+            if resource is None:
+                missing.append(instance.id)
+                continue
+            previous = dict(runtime_properties)
+            refresh(runtime_properties, resource)
+            if dict(runtime_properties) != previous:
+                update_runtime_properties(instance)
+                updated.append(instance.id)
+    if missing:
+        ctx.logger.error(
+            'The resources of node instances {m} do not exist.'.format(
+                m=missing))
+    ctx.logger.info('Refreshed node instances {u}.'.format(u=updated))
+    return {'updated': updated, 'missing': missing}
@@ -1,3 +1,10 @@
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from cloudify import ctx as _ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
@@ -6,8 +13,51 @@ from cloudify_common_sdk.secure_property_management import resolve_props
 
 from .. import utils
 from .. import constants
+from azure_sdk.resources.generic import GenericResource
+from azure_sdk.resources.subscription import Subscription
+from azure_sdk.resources.resource_graph import ResourceGraph
 from azure_sdk.resources.compute.managed_cluster import ManagedCluster
 
+# Used when the locations of a subscription cannot be listed.
+DEFAULT_LOCATIONS = [
+    'centralus',
+    'eastasia',
+    'southeastasia',
+    'eastus',
+    'eastus2',
+    'westus',
+    'westus2',
+    'northcentralus',
+    'southcentralus',
+    'westcentralus',
+    'northeurope',
+    'westeurope',
+    'japaneast',
+    'japanwest',
+    'brazilsouth',
+    'australiasoutheast',
+    'australiaeast',
+    'westindia',
+    'southindia',
+    'centralindia',
+    'canadacentral',
+    'canadaeast',
+    'uksouth',
+    'ukwest',
+    'koreacentral',
+    'koreasouth',
+    'francecentral',
+    'southafricanorth',
+    'uaenorth',
+    'australiacentral',
+    'switzerlandnorth',
+    'germanywestcentral',
+    'norwayeast',
+    'jioindiawest',
+    'westus3',
+    'australiacentral2'
+]
+
 TYPES_MATRIX = {
     'Microsoft.ContainerService/ManagedClusters': (
         ManagedCluster, 'aks', 'id'
@@ -15,13 +65,45 @@ TYPES_MATRIX = {
 }
 
 
+def enrich_by_id(api_version):
+    """An enricher that adds the full resource, including its properties,
+    to a resource from the generic resources list.
+    """
+    def enrich(iface, resource):
+        resource.update(iface.get_by_id(resource['id'], api_version))
+        return resource
+    return enrich
+
+
+# Types that are not in TYPES_MATRIX are listed with the generic resources
+# list API, which does not return resource properties. With the
+# resource_config enrich flag, resources of these types are completed by an
+# enricher.
+ENRICHERS = {
+    'Microsoft.Compute/virtualMachines': enrich_by_id(
+        constants.API_VER_COMPUTE),
+    'Microsoft.Network/virtualNetworks': enrich_by_id(
+        constants.API_VER_NETWORK),
+    'Microsoft.Storage/storageAccounts': enrich_by_id(
+        constants.API_VER_STORAGE),
+    'Microsoft.Web/sites': enrich_by_id(
+        constants.API_VER_APP_SERVICE),
+}
+
+
 @operation
 def initialize(resource_config=None, locations=None, ctx=None, **_):
     """ Initialize an cloudify.azure.nodes.resources.Azure node.
     This checks for resource_types in resource config and
         locations in locations.
     :param resource_config: A dict with key resource_types,
-      a list of Azure types like Microsoft.ContainerService/ManagedClusters.
+      a list of Azure types like Microsoft.ContainerService/ManagedClusters,
+      and optionally subscription_ids, a list of subscriptions to search,
+      max_workers, the number of concurrent list calls, backend, either
+      management (the default) or resource_graph, projection, the
+      keys to keep of each resource, skip_empty_locations, to count the
+      resources in each location with Resource Graph before listing them,
+      and enrich, to complete generically listed resources, see ENRICHERS.
     :param locations: A list of locations, like [eastus1, centralus].
     :param ctx: Cloudify CTX
     :param _:
@@ -35,8 +117,25 @@ def initialize(resource_config=None, locations=None, ctx=None, **_):
     ctx.logger.info('Checking for these resource types: {t}.'.format(
         t=resource_types))
 
-    ctx.instance.runtime_properties['resources'] = get_resources(
-        ctx.node, locations, resource_types, ctx.logger, ctx.deployment.id)
+    ctx.instance.runtime_properties['resources'] = discover(
+        ctx.node,
+        locations,
+        resource_types,
+        ctx.logger,
+        ctx.deployment.id,
+        **get_discovery_options(resource_config))
+
+
+def get_discovery_options(resource_config):
+    """Get the keyword arguments of discover from a resource_config."""
+    return {
+        'backend': resource_config.get('backend'),
+        'subscription_ids': resource_config.get('subscription_ids'),
+        'max_workers': resource_config.get('max_workers'),
+        'projection': resource_config.get('projection'),
+        'skip_empty_locations': resource_config.get('skip_empty_locations'),
+        'enrich': resource_config.get('enrich'),
+    }
 
 
 @operation
@@ -46,7 +145,138 @@ def deinitialize(ctx, **_):
     del ctx.instance.runtime_properties['resources']
 
 
-def get_resources(node, locations, resource_types, logger, deployment_id=None):
+def discover(node,
+             locations,
+             resource_types,
+             logger,
+             deployment_id=None,
+             backend=None,
+             subscription_ids=None,
+             max_workers=None,
+             projection=None,
+             skip_empty_locations=False,
+             enrich=False,
+             changed_since=None):
+    """Get resources with the management list APIs, see get_resources, or
+    with a Resource Graph query, see get_graph_resources.
+
+    :param backend: management (the default) or resource_graph.
+    :param skip_empty_locations: See iter_resources.
+    :param enrich: See list_resources.
+    :param changed_since: See iter_resources.
+    """
+    return merge_resources(iter_resources(node,
+                                          locations,
+                                          resource_types,
+                                          logger,
+                                          deployment_id,
+                                          backend=backend,
+                                          subscription_ids=subscription_ids,
+                                          max_workers=max_workers,
+                                          projection=projection,
+                                          skip_empty_locations=(
+                                              skip_empty_locations),
+                                          enrich=enrich,
+                                          changed_since=changed_since))
+
+
+def iter_resources(node,
+                   locations,
+                   resource_types,
+                   logger,
+                   deployment_id=None,
+                   backend=None,
+                   subscription_ids=None,
+                   max_workers=None,
+                   projection=None,
+                   skip_empty_locations=False,
+                   enrich=False,
+                   changed_since=None):
+    """Stream discovered resources, one page at a time.
+
+    :param backend: management (the default) or resource_graph.
+    :param enrich: See list_resources, the resource_graph backend does not
+        enrich resources.
+    :param skip_empty_locations: Count the resources first, see
+        count_resources, and only list the types, subscriptions and
+        locations that have any.
+    :param changed_since: Only list the resources that changed after this
+        ISO 8601 time. The management backend lists all resources.
+    :return: A generator of (location, resource type, resource ID, resource
+        dict) tuples.
+    """
+    backend = backend or 'management'
+    if backend not in ('management', 'resource_graph'):
+        raise NonRecoverableError(
+            'Unsupported discovery backend: {b}.'.format(b=backend))
+    populated = None
+    if skip_empty_locations and resource_types:
+        counts = count_resources(node,
+                                 locations,
+                                 resource_types,
+                                 logger,
+                                 deployment_id,
+                                 subscription_ids)
+        if counts is not None:
+            counts = [key for key, total in counts.items() if total]
+            populated = set((s, t) for s, t, _ in counts)
+            locations = sorted(set(location for _, _, location in counts))
+            logger.info('Found resources in these locations: {l}.'.format(
+                l=locations))
+            if not locations:
+                return iter(())
+    if backend == 'management':
+        return iter_management_resources(node,
+                                         resource_types,
+                                         logger,
+                                         deployment_id,
+                                         subscription_ids=subscription_ids,
+                                         max_workers=max_workers,
+                                         projection=projection,
+                                         populated=populated,
+                                         enrich=enrich)
+    return iter_graph_resources(node,
+                                locations,
+                                resource_types,
+                                logger,
+                                deployment_id,
+                                subscription_ids=subscription_ids,
+                                projection=projection,
+                                changed_since=changed_since)
+
+
+def merge_resources(rows):
+    """Build the location.resource_type.resource_id structure from
+    discovered resources.
+
+    :param rows: (location, resource type, resource ID, resource dict)
+        tuples.
+    """
+    resources = {}
+    # The structure goes resources.location.resource_type.resource, so we start
+    # with location.
+    # then resource type.
+    for location, resource_type, resource_id, resource in rows:
+        resources.setdefault(location, {}).setdefault(
+            resource_type, {})[resource_id] = resource
+    return resources
+
+
+def iter_rows(resources):
+    """The reverse of merge_resources."""
+    for location, resource_types in resources.items():
+        for resource_type, entries in resource_types.items():
+            for resource_id, resource in entries.items():
+                yield location, resource_type, resource_id, resource
+
+
+def get_resources(node,
+                  locations,
+                  resource_types,
+                  logger,
+                  deployment_id=None,
+                  subscription_ids=None,
+                  max_workers=None):
     """Get a dict of resources in the following structure:
 
     :param node: ctx.node
@@ -54,6 +284,9 @@ def get_resources(node, locations, resource_types, logger, deployment_id=None):
     :param resource_types: List of resource types,
         i.e. Microsoft.ContainerService/ManagedClusters.
     :param logger: ctx logger
+    :param subscription_ids: List of subscriptions to search, by default
+        only the subscription in the node's client_config.
+    :param max_workers: How many list calls to run at the same time.
     :return: a dictionary of resources in the structure:
         {
             'Microsoft.ContainerService/ManagedClusters': {
@@ -63,92 +296,631 @@ def get_resources(node, locations, resource_types, logger, deployment_id=None):
             }
         }
     """
+    return merge_resources(iter_management_resources(
+        node,
+        resource_types,
+        logger,
+        deployment_id,
+        subscription_ids=subscription_ids,
+        max_workers=max_workers))
+
+
+def iter_management_resources(node,
+                              resource_types,
+                              logger,
+                              deployment_id=None,
+                              subscription_ids=None,
+                              max_workers=None,
+                              projection=None,
+                              queue_size=constants.DISCOVERY_QUEUE_SIZE,
+                              populated=None,
+                              enrich=False):
+    """Stream resources from the management list APIs, see
+    list_resources. The list calls run in a thread pool and hand over
+    resources through a bounded queue, so a list call that gets ahead of
+    the consumer waits instead of buffering its pages. The interfaces are
+    created in the calling thread, as the client config is resolved from
+    the Cloudify context, so the threads only make the list calls.
+
+    :param projection: The keys to keep of each resource, or all.
+    :param queue_size: How many resources may wait in the queue.
+    :param populated: A set of (subscription ID, lower case resource type)
+        to list, the others are skipped.
+    :param enrich: See list_resources.
+    :return: A generator of (location, resource type, resource ID, resource
+        dict) tuples.
+    """
 
     logger.info('Checking for these resource types: {t}.'.format(
         t=resource_types))
-    resources = {}
-    # The structure goes resources.location.resource_type.resource, so we start
-    # with location.
-    # then resource type.
+    jobs = []
     for resource_type in resource_types:
-        logger.info(
-            'Checking for this resource type: {t}.'.format(
-                t=resource_type))
-        # Get the class callable, the service name, and resource_id key.
-        class_decl, service_name, resource_key = TYPES_MATRIX.get(
-            resource_type)
-        # Note that the service_name needs to be updated in the Cloudify
-        # Azure plugin resource module class for supporting new types.
-        if not class_decl:
-            # It means that we don't support whatever they provided.
+        # Types that are not in TYPES_MATRIX are listed with the generic
+        # resources API, which needs a namespace and a type name.
+        if resource_type not in TYPES_MATRIX and '/' not in resource_type:
             raise NonRecoverableError(
                 'Unsupported resource type: {t}.'.format(t=resource_type))
-        iface = get_resource_interface(node, class_decl, logger, deployment_id)
-        # Get the resource response from the API.
-        # Clean it up for context serialization.
-        result = iface.list()
-        # Add this stuff to the resources dict.
-        for resource in result:
-            resource_id = getattr(resource, resource_key)
-            resource_entry = {resource_id: resource.as_dict()}
-            if resource.location not in resources:
-                resources[resource.location] = {resource_type: resource_entry}
-            elif resource_type not in resources[resource.location]:
-                resources[resource.location][resource_type] = resource_entry
-            else:
-                resources[resource.location][resource_type][resource_id] = \
-                    resource.as_dict()
-    return resources
+        for subscription_id in subscription_ids or [None]:
+            if populated is not None and not any(
+                    t == resource_type.lower() and
+                    (s == subscription_id or not subscription_id)
+                    for s, t in populated):
+                continue
+            jobs.append((resource_type,
+                         subscription_id,
+                         get_list_interface(node,
+                                            resource_type,
+                                            logger,
+                                            deployment_id,
+                                            subscription_id)))
+    if not jobs:
+        return
+    max_workers = min(
+        max_workers or constants.DISCOVERY_MAX_WORKERS, len(jobs))
+    rows = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(resource_type, subscription_id, iface):
+        try:
+            for row in list_resources(node,
+                                      resource_type,
+                                      logger,
+                                      deployment_id,
+                                      subscription_id,
+                                      projection,
+                                      enrich,
+                                      iface):
+                if not put(row):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        produce = utils.in_calling_context(produce)
+        for resource_type, subscription_id, iface in jobs:
+            executor.submit(produce, resource_type, subscription_id, iface)
+        try:
+            remaining = len(jobs)
+            while remaining:
+                row = rows.get()
+                if row is done:
+                    remaining -= 1
+                elif isinstance(row, Exception):
+                    raise row
+                else:
+                    yield row
+        finally:
+            # Release producers that wait on a full queue.
+            stop.set()
+
+
+def list_resources(node,
+                   resource_type,
+                   logger,
+                   deployment_id=None,
+                   subscription_id=None,
+                   projection=None,
+                   enrich=False,
+                   iface=None):
+    """List all resources of one type in one subscription, with the class in
+    TYPES_MATRIX, or else with the generic resources list API.
+
+    :param enrich: Run the enricher of the type in ENRICHERS, if any, on
+        each resource.
+    :param iface: The interface to list with, see get_list_interface, by
+        default a new one.
+    :return: a generator of (location, resource type, resource ID, resource
+        dict).
+    """
+    logger.info(
+        'Checking for this resource type: {t} in subscription {s}.'.format(
+            t=resource_type, s=subscription_id or 'default'))
+    if resource_type not in TYPES_MATRIX:
+        for row in list_generic_resources(node,
+                                          resource_type,
+                                          logger,
+                                          deployment_id,
+                                          subscription_id,
+                                          projection,
+                                          enrich,
+                                          iface):
+            yield row
+        return
+    _, service_name, resource_key = TYPES_MATRIX[resource_type]
+    iface = iface or get_list_interface(
+        node, resource_type, logger, deployment_id, subscription_id)
+    # Get the resource response from the API.
+    # Clean it up for context serialization.
+    for resource in iface.list():
+        yield (resource.location,
+               resource_type,
+               getattr(resource, resource_key),
+               project_resource(resource.as_dict(), projection))
+
+
+def get_list_interface(node,
+                       resource_type,
+                       logger,
+                       deployment_id=None,
+                       subscription_id=None):
+    """Get the interface that lists the resources of a type, the class in
+    TYPES_MATRIX, or else a GenericResource.
+    """
+    if resource_type in TYPES_MATRIX:
+        return get_resource_interface(
+            node, TYPES_MATRIX[resource_type][0], logger, deployment_id,
+            subscription_id)
+    return get_resource_interface(
+        node, GenericResource, logger, deployment_id, subscription_id,
+        api_version=constants.API_VER_RESOURCES)
+
+
+def list_generic_resources(node,
+                           resource_type,
+                           logger,
+                           deployment_id=None,
+                           subscription_id=None,
+                           projection=None,
+                           enrich=False,
+                           iface=None):
+    """List all resources of any type in one subscription with a single
+    paged call. Enrichers run in a thread pool, one page at a time, with
+    the interface of the list call, so that they share its client and
+    operation cache.
+    """
+    iface = iface or get_list_interface(
+        node, resource_type, logger, deployment_id, subscription_id)
+    enricher = ENRICHERS.get(resource_type) if enrich else None
+
+    @utils.in_calling_context
+    def complete(resource):
+        try:
+            return enricher(iface, resource)
+        except Exception as e:
+            logger.error('Failed to enrich resource {r}: {e}'.format(
+                r=resource['id'], e=e))
+            return resource
+
+    resources = (resource.as_dict()
+                 for resource in iface.list_by_type(resource_type))
+    if enricher:
+        executor = ThreadPoolExecutor(
+            max_workers=constants.DISCOVERY_ENRICH_WORKERS)
+        with executor:
+            for chunk in chunks(resources, constants.DISCOVERY_QUEUE_SIZE):
+                for resource in executor.map(complete, chunk):
+                    yield (resource['location'],
+                           resource_type,
+                           resource['id'],
+                           project_resource(resource, projection))
+        return
+    for resource in resources:
+        yield (resource['location'],
+               resource_type,
+               resource['id'],
+               project_resource(resource, projection))
+
+
+def project_resource(resource, projection=None):
+    """Keep only the projected keys of a resource dict, and its id, type
+    and location.
+    """
+    if not projection:
+        return resource
+    return dict((k, v) for k, v in resource.items()
+                if k in projection or k in ('id', 'type', 'location'))
+
+
+def get_graph_resources(node,
+                        locations,
+                        resource_types,
+                        logger,
+                        deployment_id=None,
+                        subscription_ids=None,
+                        projection=None):
+    """Get resources of any type with a single Resource Graph query,
+    in the same structure as get_resources.
+
+    :param projection: The columns to keep for each resource,
+        by default constants.RESOURCE_GRAPH_PROJECTION.
+    """
+    return merge_resources(iter_graph_resources(
+        node,
+        locations,
+        resource_types,
+        logger,
+        deployment_id,
+        subscription_ids=subscription_ids,
+        projection=projection))
+
+
+def iter_graph_resources(node,
+                         locations,
+                         resource_types,
+                         logger,
+                         deployment_id=None,
+                         subscription_ids=None,
+                         projection=None,
+                         changed_since=None):
+    """Stream resources of any type from a paged Resource Graph query.
+
+    :param changed_since: Only list the resources that changed after this
+        ISO 8601 time.
+    :return: A generator of (location, resource type, resource ID, resource
+        dict) tuples.
+    """
+
+    logger.info('Querying resource graph for these resource types: '
+                '{t}.'.format(t=resource_types))
+    if not resource_types:
+        return
+    # Resource Graph returns types in lower case.
+    type_names = dict((t.lower(), t) for t in resource_types)
+    graph = get_resource_interface(
+        node, ResourceGraph, logger, deployment_id,
+        api_version=constants.API_VER_RESOURCE_GRAPH)
+    for resource in graph.list_resources(resource_types,
+                                         locations,
+                                         subscription_ids,
+                                         projection,
+                                         changed_since):
+        yield (resource['location'],
+               type_names.get(resource['type'].lower(), resource['type']),
+               resource['id'],
+               resource)
+
+
+def chunks(iterable, size):
+    """Split an iterable into lists of up to size items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class SpillFile(object):
+    """Discovered resources in a JSON lines file, written and read back in
+    chunks, for tenants with too many resources to keep in memory or in
+    runtime properties.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, rows, chunk_size=constants.DISCOVERY_CHUNK_SIZE):
+        """Write rows to the file, replacing its content.
+
+        :return: The number of rows written.
+        """
+        count = 0
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, 'w') as outfile:
+            for chunk in chunks(rows, chunk_size):
+                outfile.writelines(
+                    json.dumps(row, default=str) + '\n' for row in chunk)
+                count += len(chunk)
+        return count
+
+    def __iter__(self):
+        with open(self.path) as infile:
+            for line in infile:
+                yield tuple(json.loads(line))
+
+
+def get_changed_time(resource):
+    """Get the last change time of a discovered resource, as an ISO 8601
+    string, from whichever field the list API returned it in.
 
+    :param resource: A resource dict.
+    :return: The change time, or None if the resource does not have one.
+    """
+    system_data = resource.get('system_data') or \
+        resource.get('systemData') or {}
+    changed_time = resource.get('changedTime') or \
+        resource.get('changed_time') or \
+        system_data.get('last_modified_at') or \
+        system_data.get('lastModifiedAt') or \
+        resource.get('createdTime') or \
+        resource.get('created_time') or \
+        system_data.get('created_at') or \
+        system_data.get('createdAt')
+    if hasattr(changed_time, 'isoformat'):
+        return changed_time.isoformat()
+    return changed_time
+
+
+def get_subscription_id(resource_id):
+    """Get the subscription ID from a resource ID, or None."""
+    parts = resource_id.split('/')
+    if len(parts) > 2 and parts[1].lower() == 'subscriptions':
+        return parts[2]
+
+
+def get_watermark(state, resource_types, locations=None):
+    """Get the oldest watermark of the resource types in the locations,
+    see apply_delta. Every resource that changed after it was discovered
+    by a run with the state.
+
+    :return: An ISO 8601 time, or None if there are no watermarks.
+    """
+    locations = set(loc.lower() for loc in locations or [])
+    watermarks = [
+        watermark
+        for location, types in ((state or {}).get('watermarks') or {}).items()
+        if not locations or location.lower() in locations
+        for resource_type, watermark in types.items()
+        if resource_type in resource_types]
+    if watermarks:
+        return min(watermarks)
 
-def get_resource_interface(node, class_decl, logger, deployment_id=None):
+
+def apply_delta(resources,
+                state,
+                discovered,
+                resource_types,
+                present=None,
+                subscription_ids=None,
+                locations=None):
+    """Merge a discovery result into the previously discovered resources.
+
+    The state holds the IDs of the resources seen so far, and for each
+    location and resource type the latest change time (the watermark).
+    A seen resource is only considered changed if its change time is past
+    the watermark, and it is deleted if it was not discovered again.
+
+    :param resources: The previously discovered resources, in the
+        location.resource_type.resource_id structure.
+    :param state: The discovery state of the previous run, or None to
+        treat the previously discovered resources as seen.
+    :param discovered: The resources discovered in this run.
+    :param resource_types: The resource types discovered in this run.
+        Seen resources of other types are left alone.
+    :param present: The IDs of all the resources that exist, if discovered
+        only has the resources that changed, see get_watermark.
+    :param subscription_ids: The subscriptions discovered in this run, or
+        all. Seen resources of other subscriptions are left alone.
+    :param locations: The locations discovered in this run, or all. Seen
+        resources of other locations are left alone.
+    :return: A tuple of (delta, state, resources), where delta is a dict of
+        created, changed and deleted resource IDs, and state and resources
+        are the updated state and resources.
+    """
+    if state is None:
+        # The first incremental run starts from the resources that a
+        # full discovery already found.
+        state = {'seen': dict(
+            (resource_id, [location, resource_type])
+            for location, types in (resources or {}).items()
+            for resource_type, entries in types.items()
+            for resource_id in entries)}
+    seen = dict(state.get('seen', {}))
+    watermarks = state.get('watermarks', {})
+    new_watermarks = {}
+    resources = dict((location, dict((resource_type, dict(entries))
+                                     for resource_type, entries
+                                     in types.items()))
+                     for location, types in (resources or {}).items())
+    delta = {'created': [], 'changed': [], 'deleted': []}
+    current = set()
+    for location, types in discovered.items():
+        for resource_type, entries in types.items():
+            watermark = watermarks.get(location, {}).get(resource_type)
+            new_watermark = watermark
+            for resource_id, resource in entries.items():
+                current.add(resource_id)
+                changed_time = get_changed_time(resource)
+                if changed_time and (
+                        not new_watermark or changed_time > new_watermark):
+                    new_watermark = changed_time
+                if resource_id not in seen:
+                    delta['created'].append(resource_id)
+                elif changed_time and (
+                        not watermark or changed_time > watermark):
+                    delta['changed'].append(resource_id)
+                else:
+                    continue
+                seen[resource_id] = [location, resource_type]
+                resources.setdefault(location, {}).setdefault(
+                    resource_type, {})[resource_id] = resource
+            if new_watermark:
+                new_watermarks.setdefault(location, {})[resource_type] = \
+                    new_watermark
+    if present is not None:
+        current.update(present)
+    subscription_ids = set(s.lower() for s in subscription_ids or [])
+    locations = set(loc.lower() for loc in locations or [])
+    for resource_id, (location, resource_type) in list(seen.items()):
+        if resource_id in current or resource_type not in resource_types:
+            continue
+        subscription_id = get_subscription_id(resource_id)
+        if subscription_ids and subscription_id and \
+                subscription_id.lower() not in subscription_ids:
+            continue
+        if locations and location.lower() not in locations:
+            continue
+        delta['deleted'].append(resource_id)
+        del seen[resource_id]
+        resources.get(location, {}).get(resource_type, {}).pop(
+            resource_id, None)
+        if not resources.get(location, {}).get(resource_type, True):
+            del resources[location][resource_type]
+        if not resources.get(location, True):
+            del resources[location]
+    # Keep the watermarks of the types and locations not discovered now.
+    for location, types in watermarks.items():
+        for resource_type, watermark in types.items():
+            new_watermarks.setdefault(location, {}).setdefault(
+                resource_type, watermark)
+    return (delta,
+            {'seen': seen, 'watermarks': new_watermarks},
+            resources)
+
+
+def get_subscription_ids(node,
+                         logger,
+                         deployment_id=None,
+                         subscription_ids=None):
+    """Get the subscriptions that discovery lists, subscription_ids, or
+    else the subscription in the node's client_config.
+    """
+    if subscription_ids:
+        return list(subscription_ids)
+    return [get_resource_interface(
+        node, GenericResource, logger, deployment_id,
+        api_version=constants.API_VER_RESOURCES).subscription_id]
+
+
+def list_resource_ids(node,
+                      locations,
+                      resource_types,
+                      logger,
+                      deployment_id=None,
+                      subscription_ids=None):
+    """List the IDs of all resources of the types with a Resource Graph
+    query.
+
+    :return: A set of resource IDs.
+    """
+    graph = get_resource_interface(
+        node, ResourceGraph, logger, deployment_id,
+        api_version=constants.API_VER_RESOURCE_GRAPH)
+    return set(graph.list_resource_ids(
+        resource_types, locations, subscription_ids))
+
+
+def get_resource_interface(node,
+                           class_decl,
+                           logger,
+                           deployment_id=None,
+                           subscription_id=None,
+                           api_version=None):
     azure_config = resolve_props(
         utils.get_client_config(node.properties),
         deployment_id)
     for k, v in azure_config.items():
         if isinstance(v, CommonSDKSecret):
             azure_config[k] = v.secret
-    api_version = node.properties.get(
+    if subscription_id:
+        azure_config['subscription_id'] = subscription_id
+    api_version = api_version or node.properties.get(
         'api_version', constants.API_VER_MANAGED_CLUSTER)
     return class_decl(azure_config, logger, api_version)
 
 
-def get_locations(*_, **__):
-    return [
-        'centralus',
-        'eastasia',
-        'southeastasia',
-        'eastus',
-        'eastus2',
-        'westus',
-        'westus2',
-        'northcentralus',
-        'southcentralus',
-        'westcentralus',
-        'northeurope',
-        'westeurope',
-        'japaneast',
-        'japanwest',
-        'brazilsouth',
-        'australiasoutheast',
-        'australiaeast',
-        'westindia',
-        'southindia',
-        'centralindia',
-        'canadacentral',
-        'canadaeast',
-        'uksouth',
-        'ukwest',
-        'koreacentral',
-        'koreasouth',
-        'francecentral',
-        'southafricanorth',
-        'uaenorth',
-        'australiacentral',
-        'switzerlandnorth',
-        'germanywestcentral',
-        'norwayeast',
-        'jioindiawest',
-        'westus3',
-        'australiacentral2'
-    ]
+class LocationCatalog(object):
+    """The locations of each subscription, cached in a JSON file per
+    subscription so that all workflows on the manager share them.
+    """
+
+    def __init__(self,
+                 cache_dir=constants.LOCATIONS_CACHE_DIR,
+                 ttl=constants.LOCATIONS_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, subscription_id):
+        return os.path.join(self.cache_dir, '{0}.json'.format(
+            subscription_id.replace(os.sep, '_')))
+
+    def get(self, subscription_id, factory):
+        """Get the cached locations of a subscription, or list them with
+        factory if they are not cached or expired.
+        """
+        path = self._path(subscription_id)
+        try:
+            with open(path) as infile:
+                cached = json.load(infile)
+            if time.time() - cached['time'] < self.ttl:
+                return cached['locations']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+        locations = factory()
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            temp_path = '{0}.{1}'.format(path, os.getpid())
+            with open(temp_path, 'w') as outfile:
+                json.dump({'time': time.time(), 'locations': locations},
+                          outfile)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+        return locations
+
+
+location_catalog = LocationCatalog()
+
+
+def get_locations(node=None,
+                  deployment_id=None,
+                  logger=None,
+                  subscription_ids=None):
+    """Get the locations that the subscriptions can use, from the
+    location catalog.
+
+    :param node: The account node, without it DEFAULT_LOCATIONS is returned.
+    :param subscription_ids: List of subscriptions, by default only the
+        subscription in the node's client_config.
+    :return: A list of location names.
+    """
+    if node is None:
+        return list(DEFAULT_LOCATIONS)
+    logger = logger or _ctx.logger
+    try:
+        iface = get_resource_interface(
+            node, Subscription, logger, deployment_id,
+            api_version=constants.API_VER_SUBSCRIPTIONS)
+        locations = []
+        for subscription_id in subscription_ids or [iface.subscription_id]:
+            for location in location_catalog.get(
+                    subscription_id,
+                    lambda: iface.list_locations(subscription_id)):
+                if location not in locations:
+                    locations.append(location)
+        return locations
+    except Exception as e:
+        logger.error(
+            'Failed to list locations, using the default locations: '
+            '{e}'.format(e=e))
+        return list(DEFAULT_LOCATIONS)
+
+
+def count_resources(node,
+                    locations,
+                    resource_types,
+                    logger,
+                    deployment_id=None,
+                    subscription_ids=None):
+    """Count the resources of each type in each subscription and location
+    with a Resource Graph query.
+
+    :return: See ResourceGraph.count_resources, or None if the query failed.
+    """
+    try:
+        graph = get_resource_interface(
+            node, ResourceGraph, logger, deployment_id,
+            api_version=constants.API_VER_RESOURCE_GRAPH)
+        return graph.count_resources(
+            resource_types, locations, subscription_ids)
+    except Exception as e:
+        logger.error(
+            'Failed to count resources, checking all locations: '
+            '{e}'.format(e=e))
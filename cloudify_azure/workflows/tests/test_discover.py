@@ -1,6 +1,13 @@
+import os
+import shutil
+import tempfile
+import threading
 from unittest import TestCase
 from mock import patch, call, MagicMock
 
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx, current_workflow_ctx
+
 from .. import resources, discover
 from ..._compat import PY2
 
@@ -48,7 +55,7 @@ class AzureWorkflowTests(TestCase):
         mock_rest_client.deployment_groups = mock_deployment_groups_client
         return mock_rest_client
 
-    @patch('cloudify_azure.workflows.discover.get_resources')
+    @patch('cloudify_azure.workflows.discover.discover')
     def test_discover_resources(self, mock_get_resources, *_, **__):
         mock_ctx = MagicMock()
         node = MagicMock()
@@ -68,6 +75,371 @@ class AzureWorkflowTests(TestCase):
         }
         self.assertEqual(discover.discover_resources(**params), result)
 
+    def test_apply_delta(self, *_, **__):
+        aks = 'Microsoft.ContainerService/ManagedClusters'
+        vm = 'Microsoft.Compute/virtualMachines'
+        previous = {'region1': {aks: {'foo': {'id': 'foo'},
+                                      'bar': {'id': 'bar'}},
+                                vm: {'vm': {'id': 'vm'}}}}
+        state = {
+            'seen': {'foo': ['region1', aks],
+                     'bar': ['region1', aks],
+                     'vm': ['region1', vm]},
+            'watermarks': {'region1': {aks: '2022-01-01T00:00:00Z'}}}
+        foo = {'id': 'foo', 'changedTime': '2022-01-01T00:00:00Z'}
+        baz = {'id': 'baz',
+               'system_data': {'last_modified_at': '2022-02-01T00:00:00Z'}}
+        delta, state, merged = resources.apply_delta(
+            previous, state,
+            {'region1': {aks: {'foo': foo}}, 'region2': {aks: {'baz': baz}}},
+            [aks])
+        self.assertEqual(delta, {'created': ['baz'],
+                                 'changed': [],
+                                 'deleted': ['bar']})
+        self.assertEqual(merged, {'region1': {aks: {'foo': {'id': 'foo'}},
+                                              vm: {'vm': {'id': 'vm'}}},
+                                  'region2': {aks: {'baz': baz}}})
+        self.assertEqual(state['watermarks'], {
+            'region1': {aks: '2022-01-01T00:00:00Z'},
+            'region2': {aks: '2022-02-01T00:00:00Z'}})
+        self.assertNotIn('bar', state['seen'])
+        self.assertIn('vm', state['seen'])
+        foo = {'id': 'foo', 'changedTime': '2022-03-01T00:00:00Z'}
+        delta, state, merged = resources.apply_delta(
+            merged, state,
+            {'region1': {aks: {'foo': foo}}, 'region2': {aks: {'baz': baz}}},
+            [aks])
+        self.assertEqual(delta, {'created': [],
+                                 'changed': ['foo'],
+                                 'deleted': []})
+        self.assertIs(merged['region1'][aks]['foo'], foo)
+        # Without a state, the stored resources are the baseline.
+        delta, _, _ = resources.apply_delta(
+            merged, None, {'region1': {aks: {'foo': foo}}}, [aks])
+        self.assertEqual(delta, {'created': [],
+                                 'changed': ['foo'],
+                                 'deleted': ['baz']})
+
+    def test_apply_delta_scope(self, *_, **__):
+        aks = 'Microsoft.ContainerService/ManagedClusters'
+        ids = dict((name, '/subscriptions/{0}/resourceGroups/rg/providers/'
+                          '{1}/{2}'.format(sub, aks, name))
+                   for name, sub in [('foo', 'sub1'), ('bar', 'sub1'),
+                                     ('baz', 'sub2'), ('qux', 'sub1')])
+        previous = {
+            'region1': {aks: dict((ids[n], {'id': ids[n]})
+                                  for n in ['foo', 'bar', 'baz'])},
+            'region2': {aks: {ids['qux']: {'id': ids['qux']}}}}
+        state = {'watermarks': {'region1': {aks: '2022-02-01T00:00:00Z'},
+                                'region2': {aks: '2022-01-01T00:00:00Z'}}}
+        self.assertEqual(
+            resources.get_watermark(state, [aks]), '2022-01-01T00:00:00Z')
+        self.assertEqual(
+            resources.get_watermark(state, [aks], ['REGION1']),
+            '2022-02-01T00:00:00Z')
+        self.assertIsNone(resources.get_watermark(None, [aks]))
+        # Only the changed resources are discovered, foo is still present,
+        # and baz and qux were not listed.
+        delta, state, merged = resources.apply_delta(
+            previous, None, {}, [aks],
+            present=[ids['foo']],
+            subscription_ids=['SUB1'],
+            locations=['region1'])
+        self.assertEqual(delta, {'created': [],
+                                 'changed': [],
+                                 'deleted': [ids['bar']]})
+        self.assertEqual(sorted(state['seen']),
+                         sorted([ids['foo'], ids['baz'], ids['qux']]))
+
+    @patch('cloudify_common_sdk.utils.get_rest_client')
+    @patch('cloudify_azure.workflows.discover.get_subscription_ids')
+    @patch('cloudify_azure.workflows.discover.list_resource_ids')
+    @patch('cloudify_azure.workflows.discover.discover')
+    def test_discover_resources_changed_since(self,
+                                              mock_discover,
+                                              list_resource_ids,
+                                              get_subscription_ids,
+                                              *_,
+                                              **__):
+        mock_ctx = MagicMock()
+        node = MagicMock()
+        node.properties = {'resource_config': {}}
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(
+            version=3,
+            runtime_properties={
+                'resources': {'region1': {'aks': {
+                    'foo': {'id': 'foo'}, 'bar': {'id': 'bar'}}}},
+                'discovery_state': {
+                    'seen': {'foo': ['region1', 'aks'],
+                             'bar': ['region1', 'aks']},
+                    'watermarks': {'region1': {
+                        'aks': '2022-01-01T00:00:00Z'}}}})
+        node.instances = [node_instance]
+        mock_ctx.get_node.return_value = node
+        baz = {'id': 'baz', 'changedTime': '2022-02-01T00:00:00Z'}
+        mock_discover.return_value = {'region1': {'aks': {'baz': baz}}}
+        list_resource_ids.return_value = set(['foo', 'baz'])
+        get_subscription_ids.return_value = ['sub1']
+        self.assertEqual(
+            discover.discover_resources(node_id='foo',
+                                        resource_types=['aks'],
+                                        locations=['region1'],
+                                        backend='resource_graph',
+                                        incremental=True,
+                                        ctx=mock_ctx),
+            {'region1': {'aks': {'baz': baz}}})
+        self.assertEqual(mock_discover.call_args[1]['changed_since'],
+                         '2022-01-01T00:00:00Z')
+        self.assertEqual(
+            sorted(node_instance._node_instance.runtime_properties[
+                'discovery_state']['seen']), ['baz', 'foo'])
+
+    @patch('cloudify_common_sdk.utils.get_rest_client')
+    @patch('cloudify_azure.workflows.discover.discover')
+    def test_discover_resources_incremental(self,
+                                            mock_discover,
+                                            get_rest_client,
+                                            *_,
+                                            **__):
+        mock_ctx = MagicMock()
+        node = MagicMock()
+        node.properties = {'resource_config': {}}
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(
+            version=3,
+            runtime_properties={'resources': {'region1': {'aks': {
+                'foo': {'id': 'foo'}}}}})
+        node.instances = [node_instance]
+        mock_ctx.get_node.return_value = node
+        mock_discover.return_value = {'region1': {'aks': {
+            'foo': {'id': 'foo'}, 'bar': {'id': 'bar'}}}}
+        self.assertEqual(
+            discover.discover_resources(node_id='foo',
+                                        resource_types=['aks'],
+                                        locations=['region1'],
+                                        incremental=True,
+                                        ctx=mock_ctx),
+            {'region1': {'aks': {'bar': {'id': 'bar'}}}})
+        runtime_properties = node_instance._node_instance.runtime_properties
+        self.assertEqual(runtime_properties['resources'],
+                         mock_discover.return_value)
+        self.assertEqual(
+            runtime_properties['discovery_state']['seen'],
+            {'foo': ['region1', 'aks'], 'bar': ['region1', 'aks']})
+        get_rest_client().node_instances.update.assert_called_once_with(
+            'foo_instance',
+            runtime_properties=runtime_properties,
+            version=3)
+
+    @patch('cloudify_azure.workflows.discover.time')
+    @patch('cloudify_azure.workflows.discover.install_deployments')
+    @patch('cloudify_azure.workflows.discover.deploy_resources')
+    @patch('cloudify_common_sdk.utils.get_rest_client')
+    @patch('cloudify_azure.workflows.discover.get_locations',
+           return_value=['region1'])
+    @patch('cloudify_azure.workflows.discover.discover')
+    def test_discover_and_deploy_resume(self,
+                                        mock_discover,
+                                        get_locations,
+                                        get_rest_client,
+                                        mock_deploy,
+                                        *_,
+                                        **__):
+        mock_ctx = MagicMock()
+        mock_ctx.deployment = MagicMock(id='dep')
+        node = MagicMock()
+        node.properties = {'resource_config': {}}
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(
+            version=3, runtime_properties={})
+        node.instances = [node_instance]
+        mock_ctx.get_node.return_value = node
+        mock_discover.return_value = {'region1': {'aks': {
+            'a/b/c/d/rg/e/f/g/bar': {'id': 'bar'}}}}
+        runtime_properties = node_instance._node_instance.runtime_properties
+        mock_deploy.side_effect = Exception('failed')
+        with self.assertRaises(discover.NonRecoverableError):
+            discover.discover_and_deploy(node_id='foo',
+                                         regions=['region1'],
+                                         incremental=True,
+                                         ctx=mock_ctx)
+        # The failed resources are not stored as seen.
+        self.assertNotIn('discovery_state', runtime_properties)
+        self.assertNotIn('resources', runtime_properties)
+
+        # So the next run finds and deploys them.
+        mock_deploy.side_effect = None
+        mock_deploy.reset_mock()
+        discover.discover_and_deploy(node_id='foo',
+                                     regions=['region1'],
+                                     incremental=True,
+                                     ctx=mock_ctx)
+        mock_deploy.assert_called_once()
+        self.assertEqual(mock_deploy.call_args[0][2], ['dep-bar'])
+        self.assertEqual(
+            list(runtime_properties['discovery_state']['seen']),
+            ['a/b/c/d/rg/e/f/g/bar'])
+
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_iter_resources(self, get_iface, *_, **__):
+        clusters = [MagicMock(id='c{0}'.format(i), location='region1')
+                    for i in range(10)]
+        for cluster in clusters:
+            cluster.as_dict.return_value = {
+                'id': cluster.id, 'location': 'region1', 'tags': {}}
+        get_iface.return_value.list.return_value = iter(clusters)
+        threads = []
+        get_iface.side_effect = lambda *_, **__: (
+            threads.append(threading.current_thread()) or
+            get_iface.return_value)
+        rows = resources.iter_resources(
+            MagicMock(), [], ['Microsoft.ContainerService/ManagedClusters'],
+            MagicMock(), subscription_ids=['sub1', 'sub2'],
+            projection=['name'])
+        self.assertEqual(next(rows), (
+            'region1', 'Microsoft.ContainerService/ManagedClusters', 'c0',
+            {'id': 'c0', 'location': 'region1'}))
+        # Closing the stream early stops the list calls.
+        rows.close()
+        # The interfaces are created in the calling thread, which has the
+        # Cloudify context.
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+        self.assertEqual(
+            list(resources.chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    @patch('cloudify_azure.workflows.discover.iter_resources')
+    def test_discover_resources_spill_file(self,
+                                           mock_iter_resources,
+                                           *_,
+                                           **__):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir)
+        mock_ctx = MagicMock()
+        mock_ctx.deployment.id = 'dep'
+        node = MagicMock()
+        node.properties = {'resource_config': {}}
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(
+            runtime_properties={'resources': {}})
+        node.instances = [node_instance]
+        mock_ctx.get_node.return_value = node
+        rows = [('region1', 'aks', 'foo', {'id': 'foo'}),
+                ('region2', 'aks', 'bar', {'id': 'bar'})]
+        mock_iter_resources.return_value = iter(rows)
+        spill_file = discover.discover_resources(node_id='foo',
+                                                 resource_types=['aks'],
+                                                 locations=['region1'],
+                                                 spill_dir=spill_dir,
+                                                 ctx=mock_ctx)
+        self.assertEqual(list(spill_file), rows)
+        self.assertEqual(
+            node_instance._node_instance.runtime_properties,
+            {'resources_file': os.path.join(spill_dir,
+                                            'dep-foo_instance.jsonl')})
+
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_list_generic_resources(self, get_iface, *_, **__):
+        vms = []
+        for i in range(3):
+            vm = MagicMock()
+            vm.as_dict.return_value = {'id': 'vm{0}'.format(i),
+                                       'location': 'region1'}
+            vms.append(vm)
+        iface = get_iface.return_value
+        iface.list_by_type.return_value = iter(vms)
+
+        contexts = []
+
+        def get_by_id(resource_id, api_version):
+            contexts.append(current_ctx.get_ctx())
+            if resource_id == 'vm1':
+                raise Exception('gone')
+            return {'properties': {'vmId': resource_id}}
+
+        iface.get_by_id.side_effect = get_by_id
+        vm_type = 'Microsoft.Compute/virtualMachines'
+        result = resources.get_resources(
+            MagicMock(), [], [vm_type], MagicMock())
+        self.assertEqual(
+            result['region1'][vm_type]['vm0'],
+            {'id': 'vm0', 'location': 'region1'})
+        iface.get_by_id.assert_not_called()
+        iface.list_by_type.assert_called_once_with(vm_type)
+        self.assertIs(get_iface.call_args[0][1],
+                      resources.GenericResource)
+
+        iface.list_by_type.return_value = iter(vms)
+        operation_ctx = MockCloudifyContext()
+        current_ctx.set(operation_ctx)
+        self.addCleanup(current_ctx.clear)
+        result = resources.discover(
+            MagicMock(), [], [vm_type], MagicMock(), enrich=True)
+        # The enrichers run in the operation context, and share its cache.
+        self.assertEqual(contexts, [operation_ctx] * 3)
+        self.assertEqual(result['region1'][vm_type], {
+            'vm0': {'id': 'vm0', 'location': 'region1',
+                    'properties': {'vmId': 'vm0'}},
+            'vm1': {'id': 'vm1', 'location': 'region1'},
+            'vm2': {'id': 'vm2', 'location': 'region1',
+                    'properties': {'vmId': 'vm2'}}})
+        iface.get_by_id.assert_any_call(
+            'vm2', resources.constants.API_VER_COMPUTE)
+
+    @patch('cloudify_azure.workflows.resources.time')
+    def test_location_catalog(self, mock_time, *_, **__):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        catalog = resources.LocationCatalog(cache_dir, ttl=10)
+        factory = MagicMock(side_effect=[['eastus'], ['eastus', 'westus']])
+        mock_time.time.return_value = 100
+        self.assertEqual(catalog.get('sub1', factory), ['eastus'])
+        mock_time.time.return_value = 105
+        # Another catalog, i.e. another workflow, reads the same file.
+        self.assertEqual(
+            resources.LocationCatalog(cache_dir, ttl=10).get(
+                'sub1', factory), ['eastus'])
+        mock_time.time.return_value = 111
+        self.assertEqual(catalog.get('sub1', factory), ['eastus', 'westus'])
+        self.assertEqual(factory.call_count, 2)
+
+    @patch('cloudify_azure.workflows.resources.location_catalog')
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_get_locations(self, get_iface, catalog, *_, **__):
+        catalog.get.side_effect = lambda sub, factory: factory()
+        get_iface.return_value.list_locations.side_effect = [
+            ['eastus', 'westus'], ['westus', 'uksouth']]
+        self.assertEqual(
+            resources.get_locations(MagicMock(), 'dep', MagicMock(),
+                                    ['sub1', 'sub2']),
+            ['eastus', 'westus', 'uksouth'])
+        get_iface.return_value.list_locations.side_effect = Exception()
+        self.assertEqual(
+            resources.get_locations(MagicMock(), 'dep', MagicMock()),
+            resources.DEFAULT_LOCATIONS)
+
+    @patch('cloudify_azure.workflows.resources.iter_management_resources')
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_skip_empty_locations(self, get_iface, iter_mgmt, *_, **__):
+        aks = 'Microsoft.ContainerService/ManagedClusters'
+        get_iface.return_value.count_resources.return_value = {
+            ('sub1', aks.lower(), 'eastus'): 2,
+            ('sub1', aks.lower(), 'westus'): 0}
+        resources.iter_resources(
+            MagicMock(), ['eastus', 'westus'], [aks], MagicMock(),
+            subscription_ids=['sub1', 'sub2'], skip_empty_locations=True)
+        self.assertEqual(iter_mgmt.call_args[1]['populated'],
+                         set([('sub1', aks.lower())]))
+        get_iface.return_value.count_resources.return_value = {}
+        self.assertEqual(list(resources.iter_resources(
+            MagicMock(), ['eastus'], [aks], MagicMock(),
+            backend='resource_graph', skip_empty_locations=True)), [])
+        get_iface.return_value.count_resources.side_effect = Exception()
+        resources.iter_resources(
+            MagicMock(), ['eastus'], [aks], MagicMock(),
+            skip_empty_locations=True)
+        self.assertIsNone(iter_mgmt.call_args[1]['populated'])
+
     @patch('cloudify_common_sdk.utils.get_rest_client')
     def test_deploy_resources(self, get_rest_client, *_, **__):
         mock_rest_client = self.get_mock_rest_client()
@@ -128,22 +500,116 @@ class AzureWorkflowTests(TestCase):
                       'managed_cluster_name': 'resource2'}],
                  [
                      {'csys-env-type': 'environment'},
-                     {'csys-obj-parent': 'foo'}], mock_ctx),
+                     {'csys-obj-parent': 'foo'},
+                     {'csys-env-type': 'resource_type1'}], mock_ctx),
             call('foo', 'foo', ['foo-resource3'],
                  [
                      {'resource_group_name': 'bar',
                       'managed_cluster_name': 'resource3'}],
                  [{'csys-env-type': 'environment'},
-                  {'csys-obj-parent': 'foo'}], mock_ctx),
+                  {'csys-obj-parent': 'foo'},
+                  {'csys-env-type': 'resource_type2'}], mock_ctx),
             call('foo', 'foo', ['foo-resource4'],
                  [{
                      'resource_group_name': 'bar',
                      'managed_cluster_name': 'resource4'}],
                  [{'csys-env-type': 'environment'},
-                  {'csys-obj-parent': 'foo'}], mock_ctx)]
+                  {'csys-obj-parent': 'foo'},
+                  {'csys-env-type': 'resource_type1'}], mock_ctx)]
         if PY2:
             return
-        mock_deploy.assert_has_calls(expected_calls)
+        mock_deploy.assert_has_calls(expected_calls, any_order=True)
+
+    @patch('cloudify_azure.workflows.discover.time')
+    @patch('cloudify_common_sdk.utils.get_rest_client')
+    @patch('cloudify_azure.workflows.discover.deploy_resources')
+    def test_deploy_in_chunks(self, mock_deploy, get_rest_client, *_, **__):
+        mock_ctx = MagicMock()
+        mock_ctx.deployment = MagicMock(id='foo')
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(
+            runtime_properties={'deployed': ['foo-r0']})
+        rows = [('region1', 'aks', 'a/b/c/d/rg/f/g/h/r{0}'.format(i), {})
+                for i in range(5)]
+        rows.append(('region1', 'vm', 'a/b/c/d/rg/f/g/h/r5', {}))
+        failures = {'foo-r3': 3}
+
+        def deploy(group_id, blueprint_id, deployment_ids, *_):
+            for deployment_id in deployment_ids:
+                if failures.get(deployment_id):
+                    failures[deployment_id] -= 1
+                    raise Exception('boom')
+
+        mock_deploy.side_effect = deploy
+        batches = list(discover.get_deployment_batches(rows, 'foo', 2))
+        self.assertEqual(
+            [(t, d) for t, d, _ in batches],
+            [('aks', ['foo-r0', 'foo-r1']),
+             ('aks', ['foo-r2', 'foo-r3']),
+             ('aks', ['foo-r4']),
+             ('vm', ['foo-r5'])])
+        self.assertEqual(
+            batches[0][2][1],
+            {'resource_group_name': 'rg', 'managed_cluster_name': 'r1'})
+        with self.assertRaises(discover.NonRecoverableError):
+            discover.deploy_in_chunks(iter(batches),
+                                      node_instance,
+                                      'bar',
+                                      [{'csys-obj-parent': 'foo'}],
+                                      max_workers=2,
+                                      ctx=mock_ctx)
+        # The created deployment was skipped, the failed chunk was tried
+        # three times and its progress was not recorded.
+        self.assertEqual(mock_deploy.call_count, 6)
+        mock_deploy.assert_any_call(
+            'foo', 'bar', ['foo-r1'],
+            [{'resource_group_name': 'rg', 'managed_cluster_name': 'r1'}],
+            [{'csys-obj-parent': 'foo'}, {'csys-env-type': 'aks'}],
+            mock_ctx)
+        runtime_properties = node_instance._node_instance.runtime_properties
+        self.assertEqual(runtime_properties['deployed'],
+                         ['foo-r0', 'foo-r1', 'foo-r4', 'foo-r5'])
+        self.assertTrue(get_rest_client().node_instances.update.called)
+        # A second run only creates the failed chunk.
+        mock_deploy.reset_mock()
+        discover.deploy_in_chunks(iter(batches),
+                                  node_instance,
+                                  'bar',
+                                  [{'csys-obj-parent': 'foo'}],
+                                  ctx=mock_ctx)
+        self.assertEqual(mock_deploy.call_count, 1)
+        # The progress is removed once all deployments were created.
+        self.assertNotIn('deployed', runtime_properties)
+
+    @patch('cloudify.manager.CloudifyClusterClient')
+    def test_deploy_in_chunks_context(self, rest_client, *_, **__):
+        # The workers get a real REST client, which needs the workflow
+        # context of the thread that runs the workflow.
+        cert_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(cert_file.close)
+        mock_ctx = MagicMock(rest_ssl_cert=None)
+        mock_ctx.deployment = MagicMock(id='foo')
+        current_workflow_ctx.set(mock_ctx, {})
+        self.addCleanup(current_workflow_ctx.clear)
+        node_instance = MagicMock(id='foo_instance')
+        node_instance._node_instance = MagicMock(runtime_properties={})
+        batches = [('aks', ['foo-r{0}'.format(i)],
+                    [{'managed_cluster_name': 'r{0}'.format(i)}])
+                   for i in range(3)]
+        with patch.dict(os.environ,
+                        {'LOCAL_REST_CERT_FILE': cert_file.name}):
+            discover.deploy_in_chunks(iter(batches),
+                                      node_instance,
+                                      'bar',
+                                      [],
+                                      max_workers=2,
+                                      ctx=mock_ctx)
+        self.assertEqual(
+            rest_client().deployment_groups.add_deployments.call_count, 3)
+        self.assertEqual(rest_client.call_args_list[0][1]['tenant'],
+                         mock_ctx.tenant_name)
+        self.assertNotIn(
+            'deployed', node_instance._node_instance.runtime_properties)
 
     @patch('azure_sdk.resources.compute.managed_cluster.ManagedCluster.list')
     def test_get_resources(self, cluster_list, *_, **__):
@@ -174,6 +640,63 @@ class AzureWorkflowTests(TestCase):
         cluster_list.return_value = [resource_1, resource_2]
         self.assertEqual(resources.get_resources(**params), expected)
 
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_get_resources_parallel(self, get_iface, *_, **__):
+        clusters = {
+            'sub1': [MagicMock(id='foo', location='region1')],
+            'sub2': [MagicMock(id='bar', location='region1'),
+                     MagicMock(id='baz', location='region2')],
+        }
+        for resource in clusters['sub1'] + clusters['sub2']:
+            resource.as_dict.return_value = {'id': resource.id}
+
+        def iface(node, class_decl, logger, deployment_id, subscription_id):
+            return MagicMock(list=MagicMock(
+                return_value=clusters[subscription_id]))
+
+        get_iface.side_effect = iface
+        resource_type = 'Microsoft.ContainerService/ManagedClusters'
+        result = resources.get_resources(
+            MagicMock(), [], [resource_type], MagicMock(),
+            subscription_ids=['sub1', 'sub2'], max_workers=2)
+        self.assertEqual(result, {
+            'region1': {resource_type: {'foo': {'id': 'foo'},
+                                        'bar': {'id': 'bar'}}},
+            'region2': {resource_type: {'baz': {'id': 'baz'}}}})
+        self.assertEqual(get_iface.call_count, 2)
+        for resource in clusters['sub1'] + clusters['sub2']:
+            resource.as_dict.assert_called_once_with()
+        with self.assertRaises(resources.NonRecoverableError):
+            resources.get_resources(
+                MagicMock(), [], ['foo'], MagicMock())
+
+    @patch('cloudify_azure.workflows.resources.get_resource_interface')
+    def test_get_graph_resources(self, get_iface, *_, **__):
+        graph = get_iface.return_value
+        graph.list_resources.return_value = iter([
+            {'id': 'foo', 'location': 'region1',
+             'type': 'microsoft.compute/virtualmachines'},
+            {'id': 'bar', 'location': 'region2',
+             'type': 'microsoft.web/sites'},
+        ])
+        result = resources.discover(
+            MagicMock(), ['region1', 'region2'],
+            ['Microsoft.Compute/virtualMachines', 'Microsoft.Web/sites'],
+            MagicMock(), backend='resource_graph', projection=['name'])
+        graph.list_resources.assert_called_once_with(
+            ['Microsoft.Compute/virtualMachines', 'Microsoft.Web/sites'],
+            ['region1', 'region2'], None, ['name'], None)
+        self.assertEqual(result, {
+            'region1': {'Microsoft.Compute/virtualMachines': {'foo': {
+                'id': 'foo', 'location': 'region1',
+                'type': 'microsoft.compute/virtualmachines'}}},
+            'region2': {'Microsoft.Web/sites': {'bar': {
+                'id': 'bar', 'location': 'region2',
+                'type': 'microsoft.web/sites'}}}})
+        with self.assertRaises(resources.NonRecoverableError):
+            resources.discover(
+                MagicMock(), [], ['foo'], MagicMock(), backend='foo')
+
     @patch('azure_sdk.resources.compute.managed_cluster.ManagedCluster.list')
     def test_initialize(self, *_, **__):
         mock_ctx = MagicMock()
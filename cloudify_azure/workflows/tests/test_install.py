@@ -0,0 +1,109 @@
+from unittest import TestCase
+from mock import patch, MagicMock
+
+from .. import install
+
+
+def get_instance(instance_id, targets=(), state='uninitialized',
+                 subscription='sub1'):
+    instance = MagicMock(id=instance_id, state=state)
+    instance.relationships = [MagicMock(target_id=target)
+                              for target in targets]
+    instance.node.properties = {
+        'client_config': {'subscription_id': subscription}}
+    return instance
+
+
+class ParallelInstallTests(TestCase):
+
+    def setUp(self):
+        # rg <- vnet <- subnet <- nic <- vm, rg <- ip <- nic, rg <- sa
+        self.instances = [
+            get_instance('vm', ['nic', 'sa']),
+            get_instance('nic', ['subnet', 'ip']),
+            get_instance('subnet', ['vnet']),
+            get_instance('vnet', ['rg']),
+            get_instance('ip', ['rg']),
+            get_instance('sa', ['rg']),
+            get_instance('rg', state='started'),
+        ]
+
+    def test_get_levels(self):
+        levels = install.get_levels(self.instances)
+        self.assertEqual(
+            [[instance.id for instance in level] for level in levels],
+            [['rg'], ['ip', 'sa', 'vnet'], ['subnet'], ['nic'], ['vm']])
+        self.instances[-1].relationships = [MagicMock(target_id='vm')]
+        with self.assertRaises(install.NonRecoverableError):
+            install.get_levels(self.instances)
+
+    def test_get_critical_path(self):
+        levels = install.get_levels(self.instances)
+        durations = {'rg': 1, 'vnet': 2, 'ip': 10, 'sa': 30, 'subnet': 2,
+                     'nic': 5, 'vm': 60}
+        self.assertEqual(install.get_critical_path(levels, durations),
+                         (['rg', 'sa', 'vm'], 91))
+
+    def test_get_priorities(self):
+        priorities = install.get_priorities(
+            install.get_levels(self.instances))
+        self.assertEqual(priorities, {'rg': 5, 'vnet': 4, 'subnet': 3,
+                                      'ip': 3, 'nic': 2, 'sa': 2, 'vm': 1})
+
+    @patch('cloudify_azure.workflows.install.time')
+    @patch('cloudify.plugins.lifecycle.install_node_instance_subgraph')
+    def test_parallel_install(self, install_node_instance_subgraph, time):
+        mock_ctx = MagicMock()
+        node = MagicMock(instances=self.instances)
+        mock_ctx.nodes = [node]
+        graph = mock_ctx.graph_mode.return_value
+        subgraphs = {}
+
+        def get_subgraph(instance, _):
+            subgraphs[instance.id] = MagicMock(id=instance.id,
+                                               on_success=None)
+            return subgraphs[instance.id]
+
+        clock = [0]
+
+        def execute():
+            # Each subgraph starts when the subgraphs it waits for finish.
+            for instance_id, finish in [('vnet', 2), ('ip', 10),
+                                        ('subnet', 12), ('sa', 32),
+                                        ('nic', 37), ('vm', 97)]:
+                clock[0] = finish
+                subgraphs[instance_id].on_success(subgraphs[instance_id])
+
+        install_node_instance_subgraph.side_effect = get_subgraph
+        graph.execute.side_effect = execute
+        time.time.side_effect = lambda: clock[0]
+        path, total = install.parallel_install(max_concurrency=2,
+                                               ctx=mock_ctx)
+        # The started resource group is skipped.
+        self.assertEqual(
+            [c[0][0].id for c in
+             install_node_instance_subgraph.call_args_list],
+            ['vnet', 'ip', 'sa', 'subnet', 'nic', 'vm'])
+        dependencies = [(c[0][0].id, c[0][1].id)
+                        for c in graph.add_dependency.call_args_list]
+        # Each node instance waits for its relationship targets, and for the
+        # node instance two places before it in the subscription.
+        self.assertEqual(
+            sorted(dependencies),
+            sorted([('subnet', 'vnet'), ('nic', 'subnet'), ('nic', 'ip'),
+                    ('vm', 'nic'), ('vm', 'sa'),
+                    ('sa', 'vnet'), ('subnet', 'ip'), ('nic', 'sa'),
+                    ('vm', 'subnet')]))
+        graph.execute.assert_called_once_with()
+        # The critical path is found from the measured install times, e.g.
+        # nic took 5 seconds once sa, which it waited for, finished.
+        self.assertEqual(path, ['sa', 'vm'])
+        self.assertEqual(total, 97)
+
+        # Node instances of other subscriptions do not wait for each other.
+        graph.reset_mock()
+        for instance in self.instances:
+            instance.node.properties = {
+                'client_config': {'subscription_id': instance.id}}
+        install.parallel_install(max_concurrency=1, ctx=mock_ctx)
+        self.assertEqual(len(graph.add_dependency.call_args_list), 5)
@@ -0,0 +1,100 @@
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import patch, MagicMock
+
+from .. import refresh
+from azure_sdk.resources.compute.virtual_machine import power_state_cache
+
+
+def get_instance(instance_id, node_type, runtime_properties):
+    instance = MagicMock(id=instance_id, state='started')
+    instance.node.type_hierarchy = ['cloudify.nodes.Root', node_type]
+    instance.node.properties = {}
+    instance._node_instance.runtime_properties = runtime_properties
+    instance.relationships = []
+    return instance
+
+
+def get_resource(resource):
+    item = MagicMock()
+    item.as_dict.return_value = resource
+    return item
+
+
+@patch('cloudify_azure.utils.get_client_config')
+@patch('azure_sdk.common.ClientSecretCredential')
+class RefreshStatusTests(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        patcher = patch.object(power_state_cache, 'cache_dir', cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vms = [
+            get_instance(
+                'vm{0}'.format(i),
+                'cloudify.nodes.azure.compute.VirtualMachine',
+                {'resource_id': '/subscriptions/dummy/resourceGroups/rg1/'
+                                'providers/Microsoft.Compute/'
+                                'virtualMachines/vm{0}'.format(i),
+                 'resource_group': 'rg1'})
+            for i in range(3)]
+        self.nic = get_instance(
+            'nic', 'cloudify.nodes.azure.network.NetworkInterfaceCard',
+            {'resource_id': '/subscriptions/dummy/resourceGroups/rg1/'
+                            'providers/Microsoft.Network/'
+                            'networkInterfaces/nic',
+             'resource_group': 'rg1'})
+        self.ctx = MagicMock()
+        self.ctx.nodes = [MagicMock(instances=self.vms + [self.nic])]
+
+    @patch('cloudify_common_sdk.utils.get_rest_client')
+    @patch('azure_sdk.resources.network.network_interface_card.'
+           'NetworkManagementClient')
+    @patch('azure_sdk.resources.compute.virtual_machine.'
+           'ComputeManagementClient')
+    def test_refresh_status(self, compute, network, get_rest_client,
+                            _, get_client_config):
+        get_client_config.return_value = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+        compute().virtual_machines.list_all.return_value = [
+            get_resource({
+                'id': '/subscriptions/dummy/resourceGroups/RG1/providers/'
+                      'Microsoft.Compute/virtualMachines/vm{0}'.format(i),
+                'name': 'vm{0}'.format(i),
+                'instance_view': {'statuses': [
+                    {'code': 'ProvisioningState/succeeded'},
+                    {'code': 'PowerState/running'}]}})
+            for i in range(2)]
+        network().network_interfaces.list.return_value = [
+            get_resource({
+                'id': self.nic._node_instance.runtime_properties[
+                    'resource_id'],
+                'ip_configurations': [
+                    {'primary': True, 'private_ip_address': '10.0.0.4'}]})]
+        self.assertEqual(
+            refresh.refresh_status(ctx=self.ctx),
+            {'updated': ['vm0', 'vm1', 'nic'], 'missing': ['vm2']})
+        compute().virtual_machines.list_all.assert_called_once_with(
+            status_only='true')
+        network().network_interfaces.list.assert_called_once_with('rg1')
+        self.assertEqual(
+            self.vms[0]._node_instance.runtime_properties['power_state'],
+            'PowerState/running')
+        self.assertEqual(
+            self.nic._node_instance.runtime_properties['ip'], '10.0.0.4')
+        self.assertEqual(
+            get_rest_client().node_instances.update.call_count, 3)
+
+        # Nothing changed, so nothing is stored.
+        get_rest_client().node_instances.update.reset_mock()
+        self.assertEqual(
+            refresh.refresh_status(node_ids=['vm'], ctx=self.ctx)['updated'],
+            [])
+        get_rest_client().node_instances.update.assert_not_called()
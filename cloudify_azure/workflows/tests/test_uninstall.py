@@ -0,0 +1,121 @@
+from unittest import TestCase
+from mock import patch, MagicMock, ANY
+
+from .. import uninstall
+
+
+def get_instance(instance_id, node_type, targets=(), properties=None,
+                 runtime_properties=None):
+    instance = MagicMock(id=instance_id, state='started')
+    instance.node.type_hierarchy = ['cloudify.nodes.Root', node_type]
+    instance.node.properties = properties or {}
+    instance._node_instance.runtime_properties = runtime_properties or {}
+    instance.relationships = [MagicMock(target_id=target)
+                              for target in targets]
+    return instance
+
+
+@patch('azure_sdk.common.ClientSecretCredential')
+class FastUninstallTests(TestCase):
+
+    def setUp(self):
+        self.rg = get_instance(
+            'rg', 'cloudify.nodes.azure.ResourceGroup',
+            runtime_properties={'name': 'rg1'})
+        self.instances = [
+            self.rg,
+            get_instance('vnet', 'cloudify.nodes.azure.network.VirtualNetwork',
+                         ['rg'], runtime_properties={'resource_id': 'VNET'}),
+            get_instance('subnet', 'cloudify.nodes.azure.network.Subnet',
+                         ['vnet'], runtime_properties={'resource_id': 'sub'}),
+            get_instance('ip', 'cloudify.nodes.azure.network.PublicIPAddress',
+                         properties={'resource_group_name': 'rg1'},
+                         runtime_properties={'resource_id': 'ip'}),
+        ]
+        self.ctx = MagicMock()
+        self.ctx.nodes = [MagicMock(instances=self.instances)]
+
+    def test_get_owned_resource_groups(self, *_):
+        self.assertEqual(
+            uninstall.get_owned_resource_groups(self.instances),
+            ([self.rg], None))
+        self.instances[3].node.properties = {'resource_group_name': 'other'}
+        self.assertIn(
+            'other',
+            uninstall.get_owned_resource_groups(self.instances)[1])
+        self.instances[3].node.properties = {'resource_group_name': 'rg1',
+                                             'use_external_resource': True}
+        self.assertIn(
+            'external',
+            uninstall.get_owned_resource_groups(self.instances)[1])
+        self.instances[3].node.type_hierarchy = ['cloudify.nodes.Root']
+        self.assertIn(
+            'not an Azure resource',
+            uninstall.get_owned_resource_groups(self.instances)[1])
+        self.rg._node_instance.runtime_properties[
+            uninstall.CLOUDIFY_TAGGED_EXT] = True
+        self.assertIn(
+            'not created by this deployment',
+            uninstall.get_owned_resource_groups(self.instances)[1])
+
+    def test_get_unowned_resources(self, *_):
+        vm_id = '/subscriptions/s/resourceGroups/rg1/providers/' \
+                'Microsoft.Compute/virtualMachines/VM'
+        self.instances.append(get_instance(
+            'vm', 'cloudify.nodes.azure.compute.VirtualMachine', ['rg'],
+            runtime_properties={'resource_id': vm_id}))
+        disks = '/subscriptions/s/resourceGroups/rg1/providers/' \
+                'Microsoft.Compute/disks/'
+        resources = [
+            {'id': 'vnet'},
+            # The OS disk of the virtual machine.
+            {'id': disks + 'os', 'managed_by': vm_id.lower()},
+            # An extension of the virtual machine.
+            {'id': vm_id + '/extensions/ext', 'managed_by': None},
+            {'id': vm_id + '2'},
+            {'id': disks + 'other', 'managed_by': vm_id + '2'},
+        ]
+        self.assertEqual(
+            uninstall.get_unowned_resources(resources, self.instances),
+            [vm_id + '2', disks + 'other'])
+
+    @patch('cloudify_azure.utils.get_client_config')
+    @patch('azure_sdk.resources.resource_group.ResourceManagementClient')
+    def test_fast_uninstall(self, client, get_client_config, *_):
+        get_client_config.return_value = {
+            'client_id': 'dummy',
+            'client_secret': 'dummy',
+            'subscription_id': 'dummy',
+            'tenant_id': 'dummy'
+        }
+        client().resources.list_by_resource_group.return_value = [
+            MagicMock(id='vnet'), MagicMock(id='ip')]
+        uninstall.fast_uninstall(ctx=self.ctx)
+        client().resources.list_by_resource_group.assert_called_once_with(
+            resource_group_name='rg1', expand=ANY)
+        client().resource_groups.begin_delete.assert_called_once()
+        self.assertEqual(
+            client().resource_groups.begin_delete.call_args[1][
+                'resource_group_name'], 'rg1')
+        for instance in self.instances:
+            instance.set_state.assert_called_once_with('deleted')
+
+        # A resource that no node instance owns would be deleted too.
+        client().resources.list_by_resource_group.return_value = [
+            MagicMock(id='vnet'), MagicMock(id='other')]
+        with self.assertRaises(uninstall.NonRecoverableError) as e:
+            uninstall.fast_uninstall(fallback=False, ctx=self.ctx)
+        self.assertIn('other', str(e.exception))
+
+    def test_not_eligible(self, *_):
+        self.instances[3].node.properties = {'resource_group_name': 'other'}
+        with self.assertRaises(uninstall.NonRecoverableError):
+            uninstall.fast_uninstall(fallback=False, ctx=self.ctx)
+        lifecycle = MagicMock()
+        with patch.dict('sys.modules', {
+                'cloudify.plugins.lifecycle': lifecycle}), \
+                patch('cloudify.plugins.lifecycle', lifecycle, create=True):
+            uninstall.fast_uninstall(ctx=self.ctx)
+        lifecycle.uninstall_node_instances.assert_called_once()
+        for instance in self.instances:
+            instance.set_state.assert_not_called()
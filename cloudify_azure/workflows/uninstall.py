@@ -0,0 +1,222 @@
+# #######
+# Copyright (c) 2022 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudify.decorators import workflow
+from cloudify.workflows import ctx as wtx
+from cloudify.exceptions import NonRecoverableError
+from cloudify_common_sdk.utils import CLOUDIFY_TAGGED_EXT
+from azure.core.exceptions import ResourceNotFoundError
+
+from .. import constants
+from .resources import get_resource_interface
+from azure_sdk.resources.resource_group import ResourceGroup
+
+
+def is_azure_node(node):
+    return any(node_type.startswith(constants.AZURE_NODE_TYPE_PREFIXES)
+               for node_type in node.type_hierarchy)
+
+
+def is_resource_group(node):
+    return any(node_type in constants.RG_NODE_TYPE
+               for node_type in node.type_hierarchy)
+
+
+def is_external(instance):
+    return bool(
+        instance.node.properties.get('use_external_resource') or
+        instance._node_instance.runtime_properties.get(CLOUDIFY_TAGGED_EXT))
+
+
+def get_name(instance):
+    return instance._node_instance.runtime_properties.get('name') or \
+        instance.node.properties.get('name')
+
+
+def get_resource_group_name(instance, instances, visited=None):
+    """Find the resource group of a workflow node instance from its
+    properties, or else from the node instances it is related to.
+    """
+    if is_resource_group(instance.node):
+        return get_name(instance)
+    name = instance.node.properties.get('resource_group_name') or \
+        instance.node.properties.get('resource_group') or \
+        instance._node_instance.runtime_properties.get('resource_group')
+    if name:
+        return name
+    visited = visited or set()
+    visited.add(instance.id)
+    for relationship in instance.relationships:
+        target = instances.get(relationship.target_id)
+        if target is None or target.id in visited:
+            continue
+        name = get_resource_group_name(target, instances, visited)
+        if name:
+            return name
+
+
+def get_owned_resource_groups(node_instances):
+    """Check that deleting resource groups tears down the whole deployment:
+    every node instance is an Azure resource that the deployment created,
+    in a resource group that the deployment created.
+
+    :param node_instances: Workflow context node instances.
+    :return: A tuple of (resource group node instances, reason), where
+        reason explains why the deployment is not eligible, or is None.
+    """
+    instances = dict((instance.id, instance) for instance in node_instances)
+    groups = dict((get_name(instance), instance)
+                  for instance in node_instances
+                  if is_resource_group(instance.node) and
+                  instance.state != 'deleted')
+    for name, instance in groups.items():
+        if is_external(instance):
+            return [], 'resource group {n} was not created by this ' \
+                'deployment'.format(n=name)
+    if not groups:
+        return [], 'the deployment has no resource groups'
+    for instance in node_instances:
+        if instance.state == 'deleted' or is_resource_group(instance.node):
+            continue
+        if not is_azure_node(instance.node):
+            return [], 'node instance {i} is not an Azure ' \
+                'resource'.format(i=instance.id)
+        if is_external(instance):
+            return [], 'node instance {i} is an external ' \
+                'resource'.format(i=instance.id)
+        name = get_resource_group_name(instance, instances)
+        if name not in groups:
+            return [], 'node instance {i} is in resource group {n}, which ' \
+                'was not created by this deployment'.format(
+                    i=instance.id, n=name)
+    return list(groups.values()), None
+
+
+def get_unowned_resources(resources, node_instances):
+    """Find the listed resources that do not belong to the resource of a
+    node instance, i.e. that the deployment did not create. A resource
+    belongs to an owned resource if it is that resource, if it is nested
+    in it, i.e. the owned ID is a prefix of its ID, or if it is managed by
+    it, like the managed OS disk of a virtual machine.
+
+    :param resources: Resource dicts with an id and a managed_by, see
+        ResourceGroup.list_resources.
+    :param node_instances: Workflow context node instances.
+    :return: A list of resource IDs.
+    """
+    owned = set(
+        instance._node_instance.runtime_properties['resource_id'].lower()
+        for instance in node_instances
+        if instance.state != 'deleted' and not is_external(instance) and
+        instance._node_instance.runtime_properties.get('resource_id'))
+
+    def is_owned(resource):
+        resource_id = resource['id'].lower()
+        managed_by = (resource.get('managed_by') or '').lower()
+        return managed_by in owned or any(
+            resource_id == owned_id or
+            resource_id.startswith(owned_id + '/')
+            for owned_id in owned)
+
+    return [resource['id'] for resource in resources
+            if not is_owned(resource)]
+
+
+def check_resource_groups(resource_groups, node_instances):
+    """Check that the resource groups only have resources that the
+    deployment created, so deleting them does not delete anything else.
+
+    :param resource_groups: A dict of resource group name to ResourceGroup
+        interface.
+    :param node_instances: Workflow context node instances.
+    :return: The reason why the resource groups cannot be deleted, or None.
+    """
+    for name, resource_group in resource_groups.items():
+        try:
+            resources = resource_group.list_resources(name)
+        except ResourceNotFoundError:
+            continue
+        unowned = get_unowned_resources(resources, node_instances)
+        if unowned:
+            return 'resource group {n} has resources that were not ' \
+                'created by this deployment: {r}'.format(n=name, r=unowned)
+
+
+@workflow
+def fast_uninstall(fallback=True, ignore_failure=False, ctx=None, **_):
+    """Uninstall the deployment by deleting its resource groups, each with
+    a single long running operation, and then marking every node instance
+    as deleted without any further API calls.
+
+    This is only possible if the deployment created all of its resources
+    and resource groups, see get_owned_resource_groups, and its resource
+    groups have no other resources, see check_resource_groups.
+
+    :param fallback: Run the standard uninstall if the deployment is not
+        eligible, instead of failing.
+    :param ignore_failure: Passed to the standard uninstall.
+    :param ctx:
+    :param _:
+    :return:
+    """
+
+    ctx = ctx or wtx
+    node_instances = [instance for node in ctx.nodes
+                      for instance in node.instances]
+    groups, reason = get_owned_resource_groups(node_instances)
+    # The interfaces resolve the client config from the workflow context,
+    # which the delete threads do not have.
+    resource_groups = dict(
+        (get_name(instance),
+         get_resource_interface(
+             instance.node, ResourceGroup, ctx.logger, ctx.deployment.id,
+             api_version=instance.node.properties.get(
+                 'api_version', constants.API_VER_RESOURCES)))
+        for instance in groups)
+    reason = reason or check_resource_groups(resource_groups, node_instances)
+    if reason:
+        if not fallback:
+            raise NonRecoverableError(
+                'Fast uninstall is not possible: {r}.'.format(r=reason))
+        ctx.logger.info(
+            'Fast uninstall is not possible: {r}. '
+            'Running the standard uninstall.'.format(r=reason))
+        from cloudify.plugins import lifecycle
+        lifecycle.uninstall_node_instances(
+            graph=ctx.graph_mode(),
+            node_instances=set(ctx.node_instances),
+            ignore_failure=ignore_failure)
+        return
+
+    def delete(name, resource_group):
+        try:
+            resource_group.delete(name)
+        except ResourceNotFoundError:
+            ctx.logger.info(
+                'Resource group {n} does not exist.'.format(n=name))
+
+    ctx.logger.info('Deleting resource groups {g}.'.format(
+        g=list(resource_groups)))
+    with ThreadPoolExecutor(max_workers=len(resource_groups)) as executor:
+        for future in [executor.submit(delete, name, resource_group)
+                       for name, resource_group in resource_groups.items()]:
+            future.result()
+    for instance in node_instances:
+        if instance.state != 'deleted':
+            instance.set_state('deleted').get()
+    ctx.logger.info('Deleted {n} node instances.'.format(
+        n=len(node_instances)))